@@ -2,11 +2,12 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 import os
+from app.services.db_routing import RoutingSession
 
 load_dotenv()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
 
     # Africastalking and Database configuration
@@ -16,16 +17,186 @@ def create_app():
     app.config["host"] = os.getenv("host")
     app.config["db_username"] = os.getenv("db_username")
 
+    # signing key for step-up PIN tokens; set SECRET_KEY so tokens are valid across workers
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY") or os.urandom(32).hex()
+    app.config["STEP_UP_TOKEN_TTL"] = int(os.getenv("STEP_UP_TOKEN_TTL", 60))
+
+    # PIN hashing pool; HASH_POOL_WORKERS=0 hashes inline on the request thread
+    app.config["HASH_POOL_WORKERS"] = int(os.getenv("HASH_POOL_WORKERS", os.cpu_count() or 1))
+    app.config["HASH_QUEUE_LIMIT"] = int(os.getenv("HASH_QUEUE_LIMIT", app.config["HASH_POOL_WORKERS"] * 4))
+    app.config["HASH_TIMEOUT"] = float(os.getenv("HASH_TIMEOUT", 2.0))
+
+    # PIN hashing policy, e.g. "scrypt:16384:8:1" or "pbkdf2:sha256:600000"
+    app.config["PIN_HASH_METHOD"] = os.getenv("PIN_HASH_METHOD", "scrypt")
+    app.config["PIN_HASH_SALT_LENGTH"] = int(os.getenv("PIN_HASH_SALT_LENGTH", 16))
+
+    # failed PIN attempts allowed per phone and per session within the window (seconds)
+    app.config["PIN_MAX_ATTEMPTS"] = int(os.getenv("PIN_MAX_ATTEMPTS", 5))
+    app.config["PIN_ATTEMPT_WINDOW"] = int(os.getenv("PIN_ATTEMPT_WINDOW", 300))
+    app.config["PIN_ATTEMPT_FLUSH_INTERVAL"] = int(os.getenv("PIN_ATTEMPT_FLUSH_INTERVAL", 5))
+
     # SQLAlchemy database configuration
     app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql+pymysql://{os.getenv("db_username")}:{os.getenv("db_password")}@{os.getenv("host")}/saccos'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # connection pool for MySQL; connections are recycled before the server's wait_timeout
+    # (minus a margin) closes them, and DB_POOL_WARMUP connections are opened at startup; forked
+    # workers start with an empty pool, so set DB_POOL_WARMUP=0 under gunicorn --preload
+    app.config["DB_POOL_SIZE"] = int(os.getenv("DB_POOL_SIZE", 10))
+    app.config["DB_MAX_OVERFLOW"] = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    app.config["DB_POOL_TIMEOUT"] = int(os.getenv("DB_POOL_TIMEOUT", 10))
+    app.config["DB_POOL_RECYCLE"] = os.getenv("DB_POOL_RECYCLE")
+    app.config["DB_POOL_RECYCLE_MARGIN"] = int(os.getenv("DB_POOL_RECYCLE_MARGIN", 60))
+    app.config["MYSQL_WAIT_TIMEOUT"] = int(os.getenv("MYSQL_WAIT_TIMEOUT", 28800))
+    app.config["DB_POOL_PRE_PING"] = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+    app.config["DB_CONNECT_TIMEOUT"] = int(os.getenv("DB_CONNECT_TIMEOUT", 5))
+    app.config["DB_POOL_WARMUP"] = int(os.getenv("DB_POOL_WARMUP", app.config["DB_POOL_SIZE"]))
+
+    # read replicas for statement and account-detail reads, as comma separated URIs; a session
+    # that wrote keeps reading from the primary for REPLICA_STICKY_SECONDS
+    app.config["DATABASE_REPLICA_URLS"] = os.getenv("DATABASE_REPLICA_URLS")
+    app.config["REPLICA_STICKY_SECONDS"] = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+
+    # USSD session store configuration
+    app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "memory")
+    app.config["SESSION_TTL"] = int(os.getenv("SESSION_TTL", 300))
+    app.config["SESSION_MAX_ENTRIES"] = int(os.getenv("SESSION_MAX_ENTRIES", 10000))
+    app.config["SESSION_SQLITE_PATH"] = os.getenv("SESSION_SQLITE_PATH")
+
+    # per-member snapshot of the row (including the PIN hash) for logged in hops; "auto" enables it
+    # only when the session store is shared, so a PIN change reaches every worker
+    app.config["MEMBER_CACHE"] = os.getenv("MEMBER_CACHE", "auto")
+
+    # per-member cache of the newest mini statement entries, dropped by every write; "auto" enables
+    # it only when the session store is shared, since a write must reach every worker's copy
+    app.config["STATEMENT_CACHE"] = os.getenv("STATEMENT_CACHE", "auto")
+    app.config["STATEMENT_CACHE_SIZE"] = int(os.getenv("STATEMENT_CACHE_SIZE", 5))
+    app.config["STATEMENT_CACHE_TTL"] = int(os.getenv("STATEMENT_CACHE_TTL", 300))
+
+    # how long a hop's response is replayed to gateway retries, and how many are kept; they have
+    # their own store so retries never evict live sessions
+    app.config["REPLAY_CACHE_TTL"] = int(os.getenv("REPLAY_CACHE_TTL", 30))
+    app.config["REPLAY_CACHE_MAX_ENTRIES"] = int(os.getenv("REPLAY_CACHE_MAX_ENTRIES", 10000))
+
+    # serve constant menu/FAQ screens from pre-encoded bodies
+    app.config["STATIC_RESPONSE_CACHE"] = os.getenv("STATIC_RESPONSE_CACHE", "1") != "0"
+
+    # back office statement export; disabled unless EXPORT_API_KEY is set
+    app.config["EXPORT_API_KEY"] = os.getenv("EXPORT_API_KEY")
+    app.config["EXPORT_CHUNK_SIZE"] = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+
+    # mobile money deposit confirmations; disabled unless PAYMENT_CALLBACK_TOKEN is set
+    app.config["PAYMENT_CALLBACK_TOKEN"] = os.getenv("PAYMENT_CALLBACK_TOKEN")
+    app.config["DEPOSIT_BATCH_SIZE"] = int(os.getenv("DEPOSIT_BATCH_SIZE", 200))
+    app.config["DEPOSIT_FLUSH_INTERVAL"] = float(os.getenv("DEPOSIT_FLUSH_INTERVAL", 0.05))
+    app.config["DEPOSIT_COMMIT_TIMEOUT"] = float(os.getenv("DEPOSIT_COMMIT_TIMEOUT", 5.0))
+    app.config["DEPOSIT_MAX_PER_REQUEST"] = int(os.getenv("DEPOSIT_MAX_PER_REQUEST", 1000))
+    # largest single confirmation accepted, in KES; M-Pesa caps a transaction at 250,000
+    app.config["DEPOSIT_MAX_AMOUNT"] = float(os.getenv("DEPOSIT_MAX_AMOUNT", 250000))
+
+    # logging: records are queued on the request thread and written by a background listener
+    app.config["LOG_LEVEL"] = os.getenv("LOG_LEVEL", "INFO")
+    app.config["LOG_FORMAT"] = os.getenv("LOG_FORMAT", "json")
+    app.config["LOG_FILE"] = os.getenv("LOG_FILE")
+    app.config["LOG_QUEUE_SIZE"] = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+    # per-logger sampling and rate limits for INFO and below, e.g. "app.services.logic:0.1"
+    app.config["LOG_SAMPLING"] = os.getenv("LOG_SAMPLING")
+    app.config["LOG_RATE_LIMITS"] = os.getenv("LOG_RATE_LIMITS")
+
+    # Prometheus metrics at /api/metrics; when METRICS_API_KEY is set scrapers must send it as X-API-Key
+    app.config["METRICS_API_KEY"] = os.getenv("METRICS_API_KEY")
+
+    # append USSD callbacks, masked, to this NDJSON file for replay; off unless set
+    app.config["USSD_CAPTURE_PATH"] = os.getenv("USSD_CAPTURE_PATH")
+
+    # span tracing for a share of requests (0 disables it), written to a rotating NDJSON file
+    # and summed into a Server-Timing header
+    app.config["TRACE_SAMPLE_RATE"] = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+    app.config["TRACE_FILE"] = os.getenv("TRACE_FILE", "traces.ndjson")
+    app.config["TRACE_FILE_MAX_BYTES"] = int(os.getenv("TRACE_FILE_MAX_BYTES", 10 * 1024 * 1024))
+    app.config["TRACE_FILE_BACKUPS"] = int(os.getenv("TRACE_FILE_BACKUPS", 5))
+    app.config["TRACE_SERVER_TIMING"] = os.getenv("TRACE_SERVER_TIMING", "1") != "0"
+
+    # statements slower than this (ms) are appended with their plan to SLOW_QUERY_LOG; 0 disables it
+    app.config["SLOW_QUERY_THRESHOLD_MS"] = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", 0))
+    app.config["SLOW_QUERY_LOG"] = os.getenv("SLOW_QUERY_LOG", "slow_queries.ndjson")
+    app.config["SLOW_QUERY_EXPLAIN_INTERVAL"] = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+
+    # statements allowed per request by endpoint, e.g. "ussd.ussd:4" (a withdrawal reads the member
+    # row to check the PIN, then writes three rows); over budget warns, or raises when testing
+    app.config["QUERY_BUDGETS"] = os.getenv("QUERY_BUDGETS", "ussd.ussd:4")
+    app.config["QUERY_BUDGET_DEFAULT"] = int(os.getenv("QUERY_BUDGET_DEFAULT", 0))
+    # the same statement issued more often than this in one request is reported as a likely N+1
+    app.config["QUERY_REPEAT_LIMIT"] = int(os.getenv("QUERY_REPEAT_LIMIT", 3))
+
+    # explicit settings (tests, benchmarks) override the environment
+    if config:
+        app.config.update(config)
+
+    from app.services.log_pipeline import init_logging
+    init_logging(app)
+
+    from app.services.db_pool import configure_engine_options
+    configure_engine_options(app)
+
+    from app.services.db_routing import configure_replicas
+    configure_replicas(app)
+
     # Initialize SQLAlchemy with the app
     db.init_app(app)
 
+    from app.services.hashing import init_hashing
+    init_hashing(app)
+
+    from app.services.session_store import init_session_store
+    init_session_store(app)
+
+    from app.services.replay_cache import init_replay_cache
+    init_replay_cache(app)
+
+    from app.services.rate_limit import init_pin_limiter
+    init_pin_limiter(app)
+
+    from app.services.deposit_ingest import init_deposit_batcher
+    init_deposit_batcher(app)
+
+    from app.services.query_counter import init_query_counter
+    init_query_counter(app)
+
+    from app.services.tracing import init_tracing
+    init_tracing(app)
+
+    from app.services.slow_queries import init_slow_query_log
+    init_slow_query_log(app)
+
+    # compile the USSD menus once, rejecting broken definitions at startup
+    from app.services.logic import init_menu_table
+    init_menu_table(app)
+
+    from app.services.metrics import init_metrics
+    init_metrics(app)
+
+    from app.commands import register_commands
+    register_commands(app)
+
     from app.routes.ussd_routes import ussd_bp
     app.register_blueprint(ussd_bp, url_prefix="/api")
 
+    from app.routes.statement_routes import statement_bp
+    app.register_blueprint(statement_bp, url_prefix="/api")
+
+    from app.routes.payment_routes import payments_bp
+    app.register_blueprint(payments_bp, url_prefix="/api")
+
+    from app.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp, url_prefix="/api")
+
+    from app.services.traffic_capture import init_traffic_capture
+    init_traffic_capture(app)
+
+    from app.services.db_pool import init_db_pool
+    init_db_pool(app)
+
 
     with app.app_context():
         from app.models import Tests
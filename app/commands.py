@@ -0,0 +1,82 @@
+import json
+import os
+import time
+from collections import Counter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app import db
+from app.models import Tests
+from app.services.hashing import hash_policy, needs_rehash
+from app.services.slow_queries import summarize_slow_queries
+
+
+def audit_pin_hashes(chunk_size=500, pause=0.1):
+    """Count members whose PIN hash predates the current policy, one chunk at a time."""
+    methods = Counter()
+    total = outdated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Tests.id, Tests.pin).where(Tests.id > last_id).order_by(Tests.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        for user_id, pin in rows:
+            total += 1
+            if needs_rehash(pin):
+                outdated += 1
+                methods[pin.partition("$")[0]] += 1
+        last_id = rows[-1][0]
+        db.session.rollback()
+        # throttle so the audit does not compete with live traffic
+        time.sleep(pause)
+    return {"total": total, "outdated": outdated, "methods": dict(methods)}
+
+
+@click.command("pin-hash-audit")
+@click.option("--chunk-size", default=500, show_default=True, help="Members read per query.")
+@click.option("--pause", default=0.1, show_default=True, help="Seconds to sleep between chunks.")
+@with_appcontext
+def pin_hash_audit_command(chunk_size, pause):
+    """Report how many members still have PIN hashes with old parameters."""
+    policy = hash_policy()
+    report = audit_pin_hashes(chunk_size, pause)
+    click.echo(f"Current policy: {policy['method']} (salt length {policy['salt_length']})")
+    click.echo(f"Members on old parameters: {report['outdated']} of {report['total']}")
+    for method, count in sorted(report["methods"].items(), key=lambda item: -item[1]):
+        click.echo(f"  {method}: {count}")
+
+
+@click.command("slow-queries")
+@click.option("--top", default=10, show_default=True, help="Statements to show.")
+@click.option("--sort", type=click.Choice(["total", "count", "max"]), default="total", show_default=True)
+@click.option("--log", "path", default=None, help="Slow query log to read; defaults to SLOW_QUERY_LOG.")
+@with_appcontext
+def slow_queries_command(top, sort, path):
+    """Report the slowest statements in the slow query log, grouped by fingerprint."""
+    path = path or current_app.config["SLOW_QUERY_LOG"]
+    if not os.path.exists(path):
+        click.echo(f"No slow query log at {path}")
+        return
+    groups = summarize_slow_queries(path, sort)
+    click.echo(f"{len(groups)} statement shapes in {path}")
+    for rank, group in enumerate(groups[:top], 1):
+        click.echo(
+            f"{rank:2d}. {group['fingerprint']}  {group['count']} slow, "
+            f"total {group['total_ms']:.1f} ms, mean {group['total_ms'] / group['count']:.1f} ms, "
+            f"max {group['max_ms']:.1f} ms"
+        )
+        click.echo(f"    {group['statement'][:300]}")
+        click.echo(f"    parameters: {json.dumps(group['parameters'])}")
+        if isinstance(group["plan"], list):
+            for row in group["plan"]:
+                click.echo(f"    plan: {' | '.join(row)}")
+        elif group["plan"]:
+            click.echo(f"    plan: {group['plan']}")
+
+
+def register_commands(app):
+    """Register the maintenance CLI commands."""
+    app.cli.add_command(pin_hash_audit_command)
+    app.cli.add_command(slow_queries_command)
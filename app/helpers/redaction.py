@@ -0,0 +1,92 @@
+import logging
+import re
+from collections.abc import Mapping
+
+# structured fields masked by name, whether passed through `extra` or as a mapping argument
+PIN_FIELDS = frozenset({"pin", "new_pin", "current_pin", "confirm_pin"})
+SENSITIVE_FIELDS = PIN_FIELDS | {"phone_number", "phone", "msisdn", "national_id", "registration_phone", "registration_id"}
+
+# one pass over the message finds every run of four or more digits; starting the pattern with a
+# character set lets the regex engine skip ahead to digits instead of trying each position
+REDACT_PATTERN = re.compile(r"[+\d]\d{3,}")
+# the key, if any, written immediately before a digit run, e.g. phone_number='...'
+KEY_BEFORE = re.compile(r"(phone_number|national_id|new_pin|current_pin|confirm_pin|pin)=['\"]?$")
+MSISDN = re.compile(r"(?:\+?254|0)[17]\d{8}")
+KEY_WINDOW = 16
+
+
+def mask_sensitive_info(data, visible_start=2, visible_end=2):
+    """Mask sensitive information, keeping only a few visible characters."""
+    if isinstance(data, str) and len(data) > (visible_start + visible_end):
+        return data[:visible_start] + "*" * (len(data) - visible_start - visible_end) + data[-visible_end:]
+    return "*" * len(data)
+
+
+def mask_field(key, value):
+    """Mask the value of a structured field by its name."""
+    if key in PIN_FIELDS:
+        return "****"
+    return mask_sensitive_info(str(value))
+
+
+def redact_fields(fields):
+    """Return a copy of a mapping with its sensitive fields masked."""
+    return {key: mask_field(key, value) if key in SENSITIVE_FIELDS and value is not None else value for key, value in fields.items()}
+
+
+def _replace(match):
+    value = match.group()
+    start = match.start()
+    key = KEY_BEFORE.search(match.string, max(start - KEY_WINDOW, 0), start)
+    if key is not None:
+        return mask_field(key.group(1), value)
+    if MSISDN.fullmatch(value):
+        return mask_sensitive_info(value)
+    return value
+
+
+def redact(message):
+    """Mask sensitive values in a formatted log message."""
+    return REDACT_PATTERN.sub(_replace, message)
+
+
+def redact_record(record):
+    """Format a record's message lazily and return it redacted.
+
+    Mapping arguments and sensitive `extra` fields are masked by key before
+    formatting; the result is cached on the record so every handler reuses it.
+    """
+    message = getattr(record, "_redacted_message", None)
+    if message is not None:
+        return message
+
+    args = record.args
+    if isinstance(args, Mapping):
+        args = redact_fields(args)
+    message = str(record.msg)
+    if args:
+        message = message % args
+    message = record._redacted_message = redact(message)
+
+    for key in SENSITIVE_FIELDS.intersection(record.__dict__):
+        value = record.__dict__[key]
+        if value is not None:
+            record.__dict__[key] = mask_field(key, value)
+    return message
+
+
+class RedactingFormatter(logging.Formatter):
+    """Formatter that masks phone numbers, national IDs and PINs.
+
+    Formatters only run for records that passed the level checks and filters,
+    so messages that are dropped are never formatted or scanned.
+    """
+
+    def format(self, record):
+        message = redact_record(record)
+        msg, args = record.msg, record.args
+        record.msg, record.args = message, None
+        try:
+            return super().format(record)
+        finally:
+            record.msg, record.args = msg, args
@@ -1,32 +1,21 @@
+import hashlib
+import hmac
 import logging
+import math
 import re
-from werkzeug.security import check_password_hash, generate_password_hash
-from flask import make_response
+from datetime import datetime
+from flask import current_app, make_response
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import tuple_, update
 from app import db
-from app.models import Tests, Withdrawals, Transactions
+from app.models import Tests, Accounts, Withdrawals, Transactions
+from app.helpers.redaction import mask_sensitive_info
+from app.services.hashing import hash_password, needs_rehash, verify_password
+from app.services.db_routing import reading_from_replica, replica_reads
+from app.services.member_cache import get_member_record, invalidate_member
+from app.services.statement_cache import fill_statement_cache, get_cached_statement, invalidate_statement, statement_generation
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-
-def mask_sensitive_info(data, visible_start=2, visible_end=2):
-    """Mask sensitive information, keeping only a few visible characters."""
-    if isinstance(data, str) and len(data) > (visible_start + visible_end):
-        return data[:visible_start] + "*" * (len(data) - visible_start - visible_end) + data[-visible_end:]
-    return "*" * len(data)
-
-def sanitize_log_message(message):
-    """Mask sensitive data in log messages."""
-    message = re.sub(r"phone_number='(\d{10,})'", lambda m: f"phone_number='{mask_sensitive_info(m.group(1))}'", message)
-    message = re.sub(r"national_id='(\d+)'", lambda m: f"national_id='{mask_sensitive_info(m.group(1))}'", message)
-    message = re.sub(r"pin='(\d+)'", lambda m: f"pin='****'", message)
-    return message
-
-class MaskingFormatter(logging.Formatter):
-    def format(self, record):
-        record.msg = sanitize_log_message(str(record.msg))
-        return super().format(record)
-
-for handler in logging.getLogger().handlers:
-    handler.setFormatter(MaskingFormatter("%(asctime)s - %(levelname)s - %(message)s"))
+logger = logging.getLogger(__name__)
 
 def validate_phone_number(phone_number):
     """Validate phone number: Must be 10 digits and start with 07."""
@@ -34,9 +23,9 @@ def validate_phone_number(phone_number):
 
 def validate_national_id(national_id):
     """Validate national ID: Must be 8 or 9 digits."""
-    logging.info(f"Validating National ID: '{national_id}'")  # Debug print
+    logger.info("Validating national_id='%s'", national_id)
     is_valid = bool(re.match(r"^\d{8,9}$", national_id))
-    logging.info(f"Validation result: {is_valid}")      # Debug print
+    logger.info("Validation result: %s", is_valid)
     return is_valid
 
 
@@ -49,17 +38,17 @@ def register_user(phone_number, national_id, pin):
     phone_number = normalize_phone_number(phone_number)
 
     if not validate_phone_number(phone_number):
-        logging.warning(f"Invalid phone number: '{phone_number}'")
+        logger.warning("Invalid phone number: phone_number='%s'", phone_number)
         return {"status": False, "message": "Invalid phone number.Please try again"}
 
-    logging.info(f"Registering user with phone: '{phone_number}', ID: '{national_id}', PIN: '{pin}'") # Debug print
+    logger.info("Registering user with phone_number='%s', national_id='%s'", phone_number, national_id)
     
     if not validate_national_id(national_id):
-        logging.warning(f"Invalid national ID: '{national_id}'")
+        logger.warning("Invalid national ID: national_id='%s'", national_id)
         return {"status": False, "message": "Invalid national ID.Please try again"}
 
     if not validate_pin(pin):
-        logging.warning(f"Invalid pin:'{pin}'")
+        logger.warning("Invalid PIN format for phone_number='%s'", phone_number)
         return {"status": False, "message": "Invalid pin.Please try again"}
 
     existing_user = Tests.query.filter(
@@ -67,22 +56,23 @@ def register_user(phone_number, national_id, pin):
     ).first()
 
     if existing_user:
-        logging.warning(f"Registration failed: User already exists - phone_number='{mask_sensitive_info(phone_number)}'")
+        logger.warning("Registration failed: User already exists - phone_number='%s'", phone_number)
         return {"status": False, "message": "User already exists."}
 
     new_user = Tests(phone_number=phone_number, national_id=national_id)
     new_user.set_pin(pin)
+    new_user.account = Accounts(wallet_balance=0, savings_balance=0)
 
-    logging.info(f"Registering user: phone_number='{mask_sensitive_info(phone_number)}'")
+    logger.info("Registering user: phone_number='%s'", phone_number)
 
     try:
         db.session.add(new_user)
         db.session.commit()
-        logging.info(f"User registered successfully: phone_number='{mask_sensitive_info(phone_number)}'")
+        logger.info("User registered successfully: phone_number='%s'", phone_number)
         return {"status": True, "message": "User registered successfully!"}
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error registering user: {e}")
+        logger.error("Error registering user: %s", e)
         return {"status": False, "message": f"Error occurred: {str(e)}"}
 
 def normalize_phone_number(phone_number):
@@ -96,142 +86,303 @@ def normalize_phone_number(phone_number):
 def verify_pin(user, pin):
     """Verify the entered PIN against the stored hash."""
     if not user or not user.pin:
-        logging.error("PIN verification failed: User not found or no PIN stored.")
+        logger.error("PIN verification failed: User not found or no PIN stored.")
         return False
 
-    logging.info(f"Verifying PIN for phone_number='{mask_sensitive_info(user.phone_number)}'")
+    logger.info("Verifying PIN for phone_number='%s'", user.phone_number)
 
-    if check_password_hash(user.pin, pin):
-        logging.info(f"PIN verification successful for phone_number='{mask_sensitive_info(user.phone_number)}'")
+    if verify_password(user.pin, pin):
+        logger.info("PIN verification successful for phone_number='%s'", user.phone_number)
         return True
     else:
-        logging.error(f"Invalid PIN for user phone_number='{mask_sensitive_info(user.phone_number)}'")
+        logger.error("Invalid PIN for user phone_number='%s'", user.phone_number)
+        return False
+
+def _step_up_serializer():
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"], salt="pin-step-up")
+
+def issue_step_up_token(user, action):
+    """Issue a short-lived signed token proving the user's PIN was just verified for an action."""
+    return _step_up_serializer().dumps({"user_id": user.id, "action": action})
+
+def verify_step_up_token(token, user, action):
+    """Check a step-up token without re-hashing the PIN."""
+    if not token or not user:
+        return False
+    try:
+        claims = _step_up_serializer().loads(token, max_age=current_app.config["STEP_UP_TOKEN_TTL"])
+    except BadSignature:
+        return False
+    return claims.get("user_id") == user.id and claims.get("action") == action
+
+def pin_digest(pin, session_id):
+    """Keyed digest of a PIN held between hops, so session data never stores the PIN itself."""
+    key = current_app.config["SECRET_KEY"].encode("utf-8")
+    return hmac.new(key, f"{session_id}:{pin}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+def upgrade_pin_hash(user, pin):
+    """Rehash a verified PIN whose stored hash uses outdated parameters."""
+    if not needs_rehash(user.pin):
         return False
+    try:
+        record = get_member_record(user)
+        record.pin = hash_password(pin)
+        db.session.commit()
+        invalidate_member(record.id)
+        logger.info("Upgraded PIN hash for phone_number='%s'", record.phone_number)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error upgrading PIN hash: %s", e)
+        return False
+
+USSD_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+def init_static_responses(app, messages):
+    """Pre-encode constant USSD screens once at startup."""
+    bodies = {}
+    if app.config.get("STATIC_RESPONSE_CACHE", True):
+        for message in messages:
+            bodies[message] = message.encode("utf-8")
+    app.extensions["static_responses"] = bodies
 
 def ussd_response(message, status=200):
     """Return a formatted USSD response with UTF-8 encoding."""
+    body = current_app.extensions.get("static_responses", {}).get(message) if status == 200 else None
+    if body is not None:
+        # a fresh response around the pre-encoded body, so nothing is shared between requests
+        return current_app.response_class(body, content_type=USSD_CONTENT_TYPE)
+
     response = make_response(message, status)
-    response.headers['Content-Type'] = "text/plain; charset=utf-8"
+    response.headers['Content-Type'] = USSD_CONTENT_TYPE
     return response
 
-def validate_withdrawal(user, amount, pin):
+def statement_timestamp():
+    """Current UTC time in whole seconds, as MySQL DATETIME stores it, so statement cursors match stored rows."""
+    return datetime.utcnow().replace(microsecond=0)
+
+# balance column for each internal account type
+ACCOUNT_BALANCES = {
+    "sacco_wallet": Accounts.wallet_balance,
+    "savings": Accounts.savings_balance,
+}
+
+def validate_withdrawal(user, amount, pin, step_up_token=None):
     """Validate if the withdrawal can proceed."""
     if not user:
         return {"status": False, "message": "User not found."}
 
-    if not verify_pin(user, pin):
-        return {"status": False, "message": "Incorrect PIN."}
+    if not math.isfinite(amount) or amount <= 0:
+        return {"status": False, "message": "Invalid withdrawal amount."}
 
-    if user.balance < amount:
-        return {"status": False, "message": "Insufficient funds."}
+    # a valid step-up token means the PIN was already verified for this withdrawal
+    if not verify_step_up_token(step_up_token, user, "withdrawal") and not verify_pin(user, pin):
+        return {"status": False, "message": "Incorrect PIN."}
 
     return {"status": True}
 
-def update_balance(user, amount):
-    """Update the user's balance after a successful withdrawal."""
+def update_balance(user_id, amount, source, destination):
+    """Move funds with a single conditional UPDATE; the caller commits.
+
+    Debits only apply while the source balance covers the amount, so concurrent
+    requests cannot overdraw an account. Returns False if nothing was updated.
+    """
+    values = {}
+    conditions = [Accounts.user_id == user_id]
+    if source in ACCOUNT_BALANCES:
+        column = ACCOUNT_BALANCES[source]
+        values[column.key] = column - amount
+        conditions.append(column >= amount)
+    if destination in ACCOUNT_BALANCES:
+        column = ACCOUNT_BALANCES[destination]
+        values[column.key] = column + amount
+
+    result = db.session.execute(update(Accounts).where(*conditions).values(**values))
+    return result.rowcount == 1
+
+def process_withdrawal(user, amount, pin, account_type, withdrawal_method, provider=None, phone_number=None, step_up_token=None):
+    """Withdraw from account_type (sacco_wallet or savings) to withdrawal_method (the other account or mobile_money)."""
+    validation = validate_withdrawal(user, amount, pin, step_up_token)
+    if not validation["status"]:
+        return validation
+
+    if account_type not in ACCOUNT_BALANCES:
+        return {"status": False, "message": "Invalid account type."}
+    if withdrawal_method == account_type or withdrawal_method not in ("sacco_wallet", "savings", "mobile_money"):
+        return {"status": False, "message": "Invalid withdrawal method."}
+    if withdrawal_method == "mobile_money" and (not provider or not phone_number or not validate_phone_number(phone_number)):
+        return {"status": False, "message": "Invalid mobile money details."}
+
     try:
-        user.balance -= amount
+        if not update_balance(user.id, amount, account_type, withdrawal_method):
+            db.session.rollback()
+            return {"status": False, "message": "Insufficient funds."}
+
+        transaction = Transactions(
+            user_id=user.id,
+            amount=amount,
+            transaction_type="withdrawal" if withdrawal_method == "mobile_money" else "transfer",
+            source=account_type,
+            destination=withdrawal_method,
+            created_at=statement_timestamp(),
+        )
+        db.session.add(transaction)
+        if withdrawal_method in ("savings", "mobile_money"):
+            db.session.add(Withdrawals(
+                user_id=user.id,
+                amount=amount,
+                withdrawal_method=withdrawal_method,
+                provider=provider,
+                phone_number=phone_number,
+                transaction=transaction,
+                created_at=transaction.created_at,
+            ))
         db.session.commit()
-        return {"status": True}
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error updating balance: {e}")
+        logger.error("Error processing withdrawal: %s", e)
         return {"status": False, "message": "Transaction failed."}
 
-def process_withdrawal(user, amount, pin, account_type, withdrawal_method, provider=None, phone_number=None):
-    validation = validate_withdrawal(user, amount, pin)
-    if not validation["status"]:
-        return validation
-
-    if account_type == "sacco_wallet":
-        if withdrawal_method == "savings":
-            logging.info(f"Transferring {amount} from Sacco Wallet to Savings for user {mask_sensitive_info(user.phone_number)}")
-            user.savings_balance += amount
-        elif withdrawal_method == "mobile_money":
-            if not provider or not phone_number or not validate_phone_number(phone_number):
-                return {"status": False, "message": "Invalid mobile money details."}
-            logging.info(f"Withdrawing {amount} from Sacco Wallet to {provider} ({mask_sensitive_info(phone_number)})")
-
-    elif account_type == "savings":
-        if withdrawal_method == "sacco_wallet":
-            logging.info(f"Transferring {amount} from Savings to Sacco Wallet for user {mask_sensitive_info(user.phone_number)}")
-            user.balance += amount
-        elif withdrawal_method == "mobile_money":
-            if not provider or not phone_number or not validate_phone_number(phone_number):
-                return {"status": False, "message": "Invalid mobile money details."}
-            logging.info(f"Withdrawing {amount} from Savings to {provider} ({mask_sensitive_info(phone_number)})")
+    invalidate_statement(user.id)
 
+    if withdrawal_method == "mobile_money":
+        logger.info("Withdrew %s from %s to %s phone_number='%s'", amount, account_type, provider, phone_number)
     else:
-        return {"status": False, "message": "Invalid account type."}
+        logger.info("Transferred %s from %s to %s for phone_number='%s'", amount, account_type, withdrawal_method, user.phone_number)
+    return {"status": True, "message": "Withdrawal successful."}
 
-    balance_update = update_balance(user, amount)
-    if not balance_update["status"]:
-        return balance_update
+def parse_amount(value):
+    """Parse an amount entered by a member, returning None unless it is a finite number."""
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if math.isfinite(amount) else None
 
-    return {"status": True, "message": "Withdrawal successful."}
+def request_mobile_deposit(user, amount, provider, destination):
+    """Accept a member's request to deposit from mobile money without moving any balance.
+
+    The account is credited only when the provider confirms the payment through
+    the deposit confirmation endpoint, so an amount typed on USSD is never money.
+    """
+    amount = parse_amount(amount)
+    if amount is None or amount <= 0:
+        return {"status": False, "message": "Invalid deposit amount."}
+    if not user:
+        return {"status": False, "message": "User not found."}
+    if destination not in ACCOUNT_BALANCES:
+        return {"status": False, "message": "Invalid deposit destination."}
+
+    logger.info("Mobile money deposit of %s to %s requested via %s for phone_number='%s'", amount, destination, provider, user.phone_number)
+    return {
+        "status": True,
+        "message": f"Complete the KES {amount} payment on {provider}. Your {destination.replace('_', ' ').title()} will be credited once it is confirmed.",
+    }
 
-def process_deposit(phone_number, amount, source, destination):
+def process_deposit(user, amount, source, destination):
+    """Deposit into destination (sacco_wallet or savings) from the member's other account.
+
+    Mobile money deposits go through request_mobile_deposit and are credited on confirmation.
+    """
     try:
-        amount = float(amount)
-        if amount <= 0:
+        amount = parse_amount(amount)
+        if amount is None or amount <= 0:
             return {"status": False, "message": "Invalid deposit amount."}
-
-        user = Tests.query.filter_by(phone_number=phone_number).first()
         if not user:
             return {"status": False, "message": "User not found."}
+        if source not in ACCOUNT_BALANCES or destination not in ACCOUNT_BALANCES or source == destination:
+            return {"status": False, "message": "Invalid deposit destination."}
+
+        if not update_balance(user.id, amount, source, destination):
+            db.session.rollback()
+            return {"status": False, "message": "Insufficient funds."}
 
-        new_transaction = Transactions(
-            phone_number=phone_number,
+        transaction = Transactions(
+            user_id=user.id,
             amount=amount,
-            transaction_type="deposit",
+            transaction_type="transfer",
             source=source,
             destination=destination,
+            created_at=statement_timestamp(),
         )
-
-        db.session.add(new_transaction)
+        db.session.add(transaction)
         db.session.commit()
+        invalidate_statement(user.id)
 
-        logging.info(f"Deposit successful: {amount} from {source} to {destination} for {phone_number}")
+        logger.info("Deposit successful: %s from %s to %s for phone_number='%s'", amount, source, destination, user.phone_number)
 
-        return {"status": True, "message": f"Deposit of KES {amount} to {destination} successful."}
+        return {"status": True, "message": f"Deposit of KES {amount} to {destination.replace('_', ' ').title()} successful."}
 
     except Exception as e:
-        logging.error(f"Error processing deposit: {str(e)}")
+        db.session.rollback()
+        logger.error("Error processing deposit: %s", e)
         return {"status": False, "message": "An error occurred. Please try again."}
 
-def get_user_pin(phone_number):
-    """Retrieves the pin for a given user"""
-    user = Tests.query.filter_by(phone_number=phone_number).first()
-    if user:
-        return user.pin
-    return None
+def statement_entry(transaction):
+    """Format a transaction for the mini statement."""
+    date = transaction.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        "id": transaction.id,
+        "created_at": transaction.created_at.isoformat(),
+        "date": date,
+        "type": transaction.transaction_type,
+        "amount": transaction.amount,
+        "source": transaction.source,
+        "destination": transaction.destination,
+        "line": f"{date}: {transaction.transaction_type} {transaction.amount}",
+    }
+
+@replica_reads
+def get_recent_transactions(user_id, limit=5, cursor=None):
+    """Retrieves a page of a user's transactions, newest first.
+
+    The cursor is the (created_at, id) of the last row of the previous page, so
+    each page is an index range scan on (user_id, created_at, id). Returns the
+    page and the cursor for the next one, or None when there are no older rows.
+    The newest page is served from the statement cache when it is warm.
+    Reads go to a replica when one is configured; a page read from a replica
+    is not cached, since it may miss a write the replica has not applied yet.
+    """
+    generation = None
+    if cursor is None:
+        cached = get_cached_statement(user_id, limit)
+        if cached is not None:
+            return cached
+        if not reading_from_replica():
+            generation = statement_generation(user_id)
 
-def get_recent_transactions(phone_number, limit=5):
-    """Retrieves recent transactions for a given user"""
     try:
-        transactions = Transactions.query.filter_by(phone_number=phone_number).order_by(Transactions.transaction_date.desc()).limit(limit).all()
-        transaction_list = []
-        for transaction in transactions:
-            transaction_list.append({
-                "date": transaction.transaction_date.strftime("%Y-%m-%d %H:%M:%S"),
-                "type": transaction.transaction_type,
-                "amount": transaction.amount,
-                "source": transaction.source,
-                "destination": transaction.destination
-            })
-        return transaction_list
+        query = Transactions.query.filter(Transactions.user_id == user_id)
+        if cursor:
+            created_at, last_id = datetime.fromisoformat(cursor[0]), cursor[1]
+            query = query.filter(tuple_(Transactions.created_at, Transactions.id) < tuple_(created_at, last_id))
+        transactions = query.order_by(Transactions.created_at.desc(), Transactions.id.desc()).limit(limit + 1).all()
+
+        has_more = len(transactions) > limit
+        transaction_list = [statement_entry(transaction) for transaction in transactions[:limit]]
+        next_cursor = None
+        if has_more:
+            next_cursor = [transaction_list[-1]["created_at"], transaction_list[-1]["id"]]
+
+        if generation is not None:
+            fill_statement_cache(user_id, transaction_list, has_more, generation)
+        return transaction_list, next_cursor
     except Exception as e:
-        logging.error(f"Error retrieving recent transactions: {str(e)}")
-        return None
+        logger.error("Error retrieving recent transactions: %s", e)
+        return None, None
 
 def change_user_pin(user, new_pin):
     """Changes the user pin"""
+    # hashed before the try, so HashingUnavailable reaches the hop's "service busy" reply
+    pin_hash = hash_password(new_pin)
     try:
-        user.pin = generate_password_hash(new_pin)
+        # a single UPDATE, so a snapshot's row is neither loaded nor refreshed after the commit
+        db.session.execute(update(Tests).where(Tests.id == user.id).values(pin=pin_hash))
         db.session.commit()
+        invalidate_member(user.id)
         return {"status": True, "message": "PIN changed successfully!"}
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error changing user PIN: {str(e)}")
+        logger.error("Error changing user PIN: %s", e)
         return {"status": False, "message": f"Error occurred: {str(e)}"}
 
@@ -1,5 +1,5 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.services.hashing import hash_password, verify_password
 from datetime import datetime
 
 class Tests(db.Model):
@@ -16,15 +16,29 @@ class Tests(db.Model):
 
     def set_pin(self, raw_pin):
         """Hashes the PIN before storing it."""
-        self.pin = generate_password_hash(raw_pin)
+        self.pin = hash_password(raw_pin)
 
     def verify_pin(self, raw_pin):
         """Checks if the entered PIN matches the stored hash."""
-        return check_password_hash(self.pin, raw_pin)
+        return verify_password(self.pin, raw_pin)
 
     def __repr__(self):
         return f"<User {self.phone_number}>"
 
+class Accounts(db.Model):
+    __tablename__ = 'accounts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), unique=True, nullable=False)
+    wallet_balance = db.Column(db.Float, default=0, nullable=False)
+    savings_balance = db.Column(db.Float, default=0, nullable=False)
+    updated_at = db.Column(db.TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+
+    user = db.relationship('Tests', backref=db.backref('account', uselist=False, cascade="all, delete"))
+
+    def __repr__(self):
+        return f"<Account {self.id} - User {self.user_id} - Wallet {self.wallet_balance} - Savings {self.savings_balance}>"
+
 class Withdrawals(db.Model):
     __tablename__ = 'withdrawals'
 
@@ -34,9 +48,17 @@ class Withdrawals(db.Model):
     withdrawal_method = db.Column(db.Enum('savings', 'mobile_money', name='withdrawal_method'), nullable=False)
     provider = db.Column(db.String(50), nullable=True)
     phone_number = db.Column(db.String(15), nullable=True)
+    # the ledger row for this money movement; empty for withdrawals recorded before transactions
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id', ondelete='CASCADE'), unique=True, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    user = db.relationship('Tests', backref=db.backref('withdrawals', lazy=True, cascade="all, delete"))
+    # the collection never loads implicitly; the database cascades deletes
+    user = db.relationship('Tests', backref=db.backref('withdrawals', lazy="raise_on_sql", cascade="all, delete", passive_deletes=True))
+    transaction = db.relationship('Transactions')
+
+    __table_args__ = (
+        db.Index('ix_withdrawals_user_created', 'user_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f"<Withdrawal {self.id} - User {self.user_id} - Amount {self.amount}>"
@@ -48,11 +70,16 @@ class Transactions(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     transaction_type = db.Column(db.Enum('deposit', 'withdrawal', 'transfer', name='transaction_type'), nullable=False)
-    source = db.Column(db.Enum('mobile_money', 'sacco_wallet', name='transaction_source'), nullable=False)
+    source = db.Column(db.Enum('mobile_money', 'sacco_wallet', 'savings', name='transaction_source'), nullable=False)
     destination = db.Column(db.Enum('savings', 'sacco_wallet', 'mobile_money', name='transaction_destination'), nullable=False)
+    provider_receipt = db.Column(db.String(64), unique=True, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    user = db.relationship('Tests', backref=db.backref('transactions', lazy=True))
+    user = db.relationship('Tests', backref=db.backref('transactions', lazy="raise_on_sql", passive_deletes=True))
+
+    __table_args__ = (
+        db.Index('ix_transactions_user_created', 'user_id', 'created_at', 'id'),
+    )
 
     def __repr__(self):
         return f"<Transaction {self.id} - {self.transaction_type} - Amount {self.amount}>"
@@ -0,0 +1,14 @@
+import hmac
+from app.services.metrics import render_prometheus
+from flask import Blueprint, Response, abort, current_app, request
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose hop latency, query, hashing and session store metrics for Prometheus."""
+    api_key = current_app.config.get("METRICS_API_KEY")
+    if api_key and not hmac.compare_digest(request.headers.get("X-API-Key", ""), api_key):
+        abort(403)
+    return Response(render_prometheus(current_app), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,45 @@
+import hmac
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from app.services.deposit_ingest import get_deposit_batcher, validate_confirmation
+from flask import Blueprint, abort, current_app, jsonify, request
+
+
+payments_bp = Blueprint('payments', __name__)
+
+@payments_bp.route('/payments/confirmations', methods=['POST'])
+def deposit_confirmations():
+    """Accept one or many mobile money deposit confirmations and group-commit them."""
+    token = current_app.config.get("PAYMENT_CALLBACK_TOKEN")
+    if not token or not hmac.compare_digest(request.headers.get("X-Callback-Token", ""), token):
+        abort(403)
+
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = request.form.to_dict()
+    confirmations = payload if isinstance(payload, list) else [payload]
+    if not confirmations or len(confirmations) > current_app.config["DEPOSIT_MAX_PER_REQUEST"]:
+        abort(400)
+
+    batcher = get_deposit_batcher()
+    max_amount = current_app.config["DEPOSIT_MAX_AMOUNT"]
+    results = []
+    pending = []
+    for confirmation in confirmations:
+        deposit, error = validate_confirmation(confirmation, max_amount)
+        if error:
+            results.append({"receipt": confirmation.get("receipt") if isinstance(confirmation, dict) else None, "status": "rejected", "error": error})
+        else:
+            result = {"receipt": deposit["receipt"], "status": None}
+            results.append(result)
+            pending.append((result, batcher.submit(deposit)))
+
+    # acknowledge only once the batch holding these deposits has committed
+    timeout = current_app.config["DEPOSIT_COMMIT_TIMEOUT"]
+    for result, future in pending:
+        try:
+            result["status"] = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            result["status"] = "pending"
+
+    failed = any(result["status"] in ("error", "pending") for result in results)
+    return jsonify({"results": results}), 503 if failed else 200
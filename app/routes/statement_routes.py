@@ -0,0 +1,29 @@
+import hmac
+from app import db
+from app.models import Tests
+from app.services.statement_export import EXPORT_FORMATS
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+
+
+statement_bp = Blueprint('statements', __name__)
+
+@statement_bp.route('/members/<int:user_id>/statement', methods=['GET'])
+def export_statement(user_id):
+    """Stream a member's full statement as CSV or NDJSON for the back office."""
+    api_key = current_app.config.get("EXPORT_API_KEY")
+    if not api_key or not hmac.compare_digest(request.headers.get("X-API-Key", ""), api_key):
+        abort(403)
+
+    export_format = request.args.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    if db.session.get(Tests, user_id) is None:
+        abort(404)
+
+    writer, mimetype = EXPORT_FORMATS[export_format]
+    chunk_size = current_app.config["EXPORT_CHUNK_SIZE"]
+    return Response(
+        stream_with_context(writer(user_id, chunk_size)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=statement-{user_id}.{export_format}"},
+    )
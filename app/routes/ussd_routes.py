@@ -1,4 +1,6 @@
 from app.services.logic import handle_ussd_request
+from app.services.replay_cache import get_replay_cache
+from app.services.tracing import span
 from flask import Blueprint, request
 
 
@@ -7,9 +9,13 @@ ussd_bp = Blueprint('ussd', __name__)
 @ussd_bp.route('/ussd/callback', methods=['POST', 'GET'])
 def ussd():
     """USSD route to handle incoming USSD requests."""
-    session_id = request.form.get("sessionId", "")
-    service_code = request.form.get("serviceCode", "")
-    phone_number = request.form.get("phoneNumber", "")
-    text = request.form.get("text", "")
+    with span("ussd.form"):
+        session_id = request.form.get("sessionId", "")
+        service_code = request.form.get("serviceCode", "")
+        phone_number = request.form.get("phoneNumber", "")
+        text = request.form.get("text", "")
 
-    return handle_ussd_request(session_id, service_code, phone_number, text)
+    # gateway retries of the same hop get the original response back
+    return get_replay_cache().get_or_compute(
+        session_id, text, lambda: handle_ussd_request(session_id, service_code, phone_number, text)
+    )
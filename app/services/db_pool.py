@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+from sqlalchemy import exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection.
+
+    The wait includes opening a new connection when the pool has room, which
+    is what a request pays for either way.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_stats = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._wait_lock:
+                stats = self.wait_stats
+                stats["checkouts"] += 1
+                stats["wait_seconds"] += elapsed
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], elapsed)
+                stats["timeouts"] += timed_out
+
+    def stats(self):
+        with self._wait_lock:
+            stats = dict(self.wait_stats)
+        stats["size"] = self.size()
+        stats["checked_out"] = self.checkedout()
+        stats["checked_in"] = self.checkedin()
+        # overflow() counts up from -pool_size; only connections beyond the pool size are overflow
+        stats["overflow"] = max(self.overflow(), 0)
+        return stats
+
+
+def recycle_seconds(config):
+    """Recycle connections before the server's wait_timeout closes them."""
+    wait_timeout = int(config.get("MYSQL_WAIT_TIMEOUT", 28800))
+    margin = int(config.get("DB_POOL_RECYCLE_MARGIN", 60))
+    limit = wait_timeout - margin if wait_timeout > margin else max(wait_timeout // 2, 1)
+    configured = config.get("DB_POOL_RECYCLE")
+    return min(int(configured), limit) if configured else limit
+
+
+def engine_options(config):
+    """Build SQLAlchemy engine options from the pool settings."""
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(config.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(config.get("DB_MAX_OVERFLOW", 20)),
+        # engine_from_config truncates pool_timeout to whole seconds
+        "pool_timeout": int(config.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": recycle_seconds(config),
+        "pool_pre_ping": bool(config.get("DB_POOL_PRE_PING", True)),
+        "connect_args": {"connect_timeout": int(config.get("DB_CONNECT_TIMEOUT", 5))},
+    }
+
+
+def uses_server_database(app):
+    return make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() != "sqlite"
+
+
+def configure_engine_options(app):
+    """Apply the pool settings to server databases; SQLite keeps its own pooling."""
+    if uses_server_database(app) and not app.config.get("SQLALCHEMY_ENGINE_OPTIONS"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+
+def warm_pool(engine, count):
+    """Open up to count connections at once and return them to the pool; returns how many opened."""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    except exc.SQLAlchemyError as e:
+        # a database that is down at startup must not stop the app from starting
+        logger.warning("Connection pool warm-up stopped after %d connections: %s", len(connections), e)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def check_wait_timeout(engine, recycle):
+    """Warn when the server closes idle connections before the pool recycles them."""
+    if engine.dialect.name != "mysql":
+        return
+    try:
+        with engine.connect() as connection:
+            row = connection.execute(text("SHOW SESSION VARIABLES LIKE 'wait_timeout'")).first()
+    except exc.SQLAlchemyError:
+        return
+    if row is not None and int(row[1]) <= recycle:
+        logger.warning(
+            "MySQL wait_timeout is %ss but connections are recycled after %ss; set MYSQL_WAIT_TIMEOUT to match",
+            row[1], recycle,
+        )
+
+
+def dispose_after_fork(engine):
+    """Give forked workers (e.g. gunicorn --preload) a fresh pool instead of the parent's sockets."""
+    # close=False leaves the inherited connections to the parent, which still owns them
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+
+def init_db_pool(app):
+    """Pre-open pooled connections so the first hops after a deploy skip connection setup."""
+    if not uses_server_database(app):
+        return
+    with app.app_context():
+        engine = db.engine
+        dispose_after_fork(engine)
+        count = int(app.config.get("DB_POOL_WARMUP", app.config.get("DB_POOL_SIZE", 10)))
+        if count > 0:
+            opened = warm_pool(engine, count)
+            logger.info("Opened %d pooled database connections", opened)
+            if not opened:
+                return
+        check_wait_timeout(engine, app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}).get("pool_recycle", -1))
+
+
+def pool_stats(engine):
+    """Return the pool's checkout stats, or None when it does not record them."""
+    pool = engine.pool
+    return pool.stats() if isinstance(pool, TimedQueuePool) else None
@@ -0,0 +1,134 @@
+import functools
+import math
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from app.services.session_store import get_session_store
+
+# set while a read-only helper runs, so its SELECTs may go to a replica
+_use_replica = ContextVar("use_replica", default=False)
+# wall-clock time of the last commit that wrote, for the read-your-writes window
+_last_write_at = ContextVar("last_write_at", default=None)
+
+REPLICA_BIND_PREFIX = "replica_"
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs from read-only helpers to a replica.
+
+    Everything else goes to the primary: writes, flushes, reads outside
+    read_from_replica(), reads after this session wrote, and reads within the
+    read-your-writes window of the last write.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and getattr(clause, "is_select", False) and not self._flushing:
+            engine = self._replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        routing = current_app.extensions.get("db_routing")
+        if routing is None or self.info.get("wrote") or in_write_window(routing["sticky_seconds"]):
+            return None
+        key = random.choice(routing["replicas"])
+        routing["reads"][key] += 1
+        return self._db.engines[key]
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _note_dml(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _note_flush(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _note_commit(session):
+    if session.info.pop("wrote", False):
+        _last_write_at.set(time.time())
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_writes(session):
+    session.info.pop("wrote", None)
+
+
+def in_write_window(sticky_seconds):
+    last_write_at = _last_write_at.get()
+    return last_write_at is not None and time.time() - last_write_at < sticky_seconds
+
+
+def reading_from_replica():
+    """Return True when SELECTs issued now would go to a replica."""
+    if not _use_replica.get() or not has_app_context():
+        return False
+    routing = current_app.extensions.get("db_routing")
+    return routing is not None and not in_write_window(routing["sticky_seconds"])
+
+
+@contextmanager
+def read_from_replica():
+    """Let the SELECTs in this block go to a replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(fn):
+    """Decorate a read-only helper so its queries may be served by a replica."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with read_from_replica():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def bind_member_writes(phone_number):
+    """Restore when this member last wrote, so their reads stay on the primary; returns a reset token.
+
+    The time is kept in the session store per phone, so the window carries over
+    to the member's next USSD session, e.g. a mini statement right after a deposit.
+    """
+    routing = current_app.extensions.get("db_routing")
+    last_write_at = get_session_store("last_write").get(phone_number) if routing is not None else None
+    return _last_write_at.set(last_write_at)
+
+
+def remember_member_writes(phone_number, token):
+    """Save the time of a write made during this hop, then restore the previous context."""
+    last_write_at = _last_write_at.get()
+    routing = current_app.extensions.get("db_routing")
+    if routing is not None and last_write_at is not None and last_write_at != token.old_value:
+        get_session_store("last_write").set(phone_number, last_write_at, ttl=max(1, math.ceil(routing["sticky_seconds"])))
+    _last_write_at.reset(token)
+
+
+def configure_replicas(app):
+    """Add a bind per DATABASE_REPLICA_URLS entry and enable routing to them."""
+    urls = [url.strip() for url in (app.config.get("DATABASE_REPLICA_URLS") or "").split(",") if url.strip()]
+    if not urls:
+        return
+    binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+    replicas = []
+    for index, url in enumerate(urls):
+        key = f"{REPLICA_BIND_PREFIX}{index}"
+        binds[key] = url
+        replicas.append(key)
+    app.config["SQLALCHEMY_BINDS"] = binds
+    app.extensions["db_routing"] = {
+        "replicas": replicas,
+        "sticky_seconds": float(app.config.get("REPLICA_STICKY_SECONDS", 5)),
+        "reads": {key: 0 for key in replicas},
+    }
@@ -0,0 +1,262 @@
+import atexit
+import logging
+import math
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from flask import current_app
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app import db
+from app.models import Tests, Accounts, Transactions
+from app.helpers.utils import ACCOUNT_BALANCES, normalize_phone_number, statement_timestamp, validate_phone_number
+from app.services.statement_cache import invalidate_statement
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {"mpesa": "M-Pesa", "airtel": "Airtel Money"}
+RECEIPT_MAX_LENGTH = Transactions.provider_receipt.type.length
+
+
+def validate_confirmation(payload, max_amount):
+    """Validate a provider deposit confirmation, returning (deposit, error)."""
+    if not isinstance(payload, dict):
+        return None, "Confirmation must be an object."
+    # providers send text fields; anything else is rejected here rather than failing a lookup below
+    for field in ("receipt", "provider", "phone_number", "destination"):
+        if payload.get(field) is not None and not isinstance(payload[field], str):
+            return None, f"Invalid {field}."
+
+    provider = (payload.get("provider") or "").lower()
+    if provider not in PROVIDERS:
+        return None, "Unknown provider."
+
+    # the stored key carries the provider prefix, so that is what must fit the column
+    receipt = (payload.get("receipt") or "").strip()
+    key = f"{provider}:{receipt}"
+    if not receipt or len(key) > RECEIPT_MAX_LENGTH:
+        return None, "Missing or invalid receipt."
+
+    phone_number = normalize_phone_number(payload.get("phone_number") or "")
+    if not validate_phone_number(phone_number):
+        return None, "Invalid phone number."
+
+    amount = payload.get("amount")
+    if isinstance(amount, bool):
+        return None, "Invalid amount."
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        return None, "Invalid amount."
+    if not math.isfinite(amount) or amount <= 0 or amount > max_amount:
+        return None, "Invalid amount."
+
+    destination = payload.get("destination") or "sacco_wallet"
+    if destination not in ACCOUNT_BALANCES:
+        return None, "Invalid destination."
+
+    return {
+        "receipt": key,
+        "phone_number": phone_number,
+        "amount": amount,
+        "destination": destination,
+    }, None
+
+
+def ingest_batch(deposits):
+    """Group-commit a batch of validated deposits; returns a status per deposit.
+
+    Receipts already recorded, or repeated within the batch, are reported as
+    duplicates and not credited again. Everything else is written with one
+    bulk insert and one executemany balance update per account type. If the
+    batch fails for any reason other than a receipt race, its deposits are
+    retried one at a time so a bad row cannot fail the others.
+    """
+    statuses = _commit_batch(deposits)
+    if statuses is None:
+        logger.warning("Batch of %d deposits failed; ingesting them one at a time", len(deposits))
+        statuses = [(_commit_batch([deposit]) or ["error"])[0] for deposit in deposits]
+
+    for user_id in {deposit["user_id"] for deposit, status in zip(deposits, statuses) if status == "accepted"}:
+        invalidate_statement(user_id)
+    return statuses
+
+
+def _is_receipt_conflict(error):
+    return "provider_receipt" in str(error.orig)
+
+
+def _commit_batch(deposits):
+    """Ingest and commit deposits, returning their statuses, or None if they could not be committed."""
+    for attempt in range(3):
+        statuses = [None] * len(deposits)
+        try:
+            _ingest(deposits, statuses)
+            db.session.commit()
+            return statuses
+        except IntegrityError as e:
+            db.session.rollback()
+            if not _is_receipt_conflict(e):
+                logger.error("Error ingesting %d deposits: %s", len(deposits), e)
+                return None
+            # another worker recorded one of these receipts first; re-check and retry
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error("Error ingesting %d deposits: %s", len(deposits), e)
+            return None
+    logger.error("Failed to ingest %d deposits after retries", len(deposits))
+    return None
+
+
+def _ingest(deposits, statuses):
+    receipts = [deposit["receipt"] for deposit in deposits]
+    existing = set(db.session.scalars(
+        select(Transactions.provider_receipt).where(Transactions.provider_receipt.in_(receipts))
+    ))
+    phones = {deposit["phone_number"] for deposit in deposits}
+    members = dict(db.session.execute(
+        select(Tests.phone_number, Tests.id).where(Tests.phone_number.in_(phones))
+    ).all())
+
+    seen = set()
+    accepted = []
+    for index, deposit in enumerate(deposits):
+        if deposit["receipt"] in existing or deposit["receipt"] in seen:
+            statuses[index] = "duplicate"
+        elif deposit["phone_number"] not in members:
+            statuses[index] = "unknown_member"
+        else:
+            seen.add(deposit["receipt"])
+            deposit["user_id"] = members[deposit["phone_number"]]
+            accepted.append(deposit)
+            statuses[index] = "accepted"
+    if not accepted:
+        return
+
+    now = statement_timestamp()
+    db.session.execute(insert(Transactions), [
+        {
+            "user_id": deposit["user_id"],
+            "amount": deposit["amount"],
+            "transaction_type": "deposit",
+            "source": "mobile_money",
+            "destination": deposit["destination"],
+            "provider_receipt": deposit["receipt"],
+            "created_at": now,
+        }
+        for deposit in accepted
+    ])
+
+    # members registered before accounts existed get one now
+    user_ids = {deposit["user_id"] for deposit in accepted}
+    with_accounts = set(db.session.scalars(select(Accounts.user_id).where(Accounts.user_id.in_(user_ids))))
+    missing = user_ids - with_accounts
+    if missing:
+        db.session.execute(insert(Accounts), [
+            {"user_id": user_id, "wallet_balance": 0, "savings_balance": 0} for user_id in missing
+        ])
+
+    credits = defaultdict(float)
+    for deposit in accepted:
+        credits[(deposit["destination"], deposit["user_id"])] += deposit["amount"]
+    table = Accounts.__table__
+    for destination, column in ACCOUNT_BALANCES.items():
+        rows = [
+            {"uid": user_id, "amt": amount}
+            for (target, user_id), amount in credits.items() if target == destination
+        ]
+        if rows:
+            statement = (
+                table.update()
+                .where(table.c.user_id == bindparam("uid"))
+                .values({column.key: table.c[column.key] + bindparam("amt")})
+            )
+            db.session.execute(statement, rows)
+
+
+class DepositBatcher:
+    """Queue deposits from many requests and group-commit them from one worker thread."""
+
+    def __init__(self, app, batch_size=200, flush_interval=0.05):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.deposits = 0
+
+    def submit(self, deposit):
+        """Queue a deposit; the returned future resolves to its status once committed."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((deposit, future))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deposit-batcher", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._flush(batch)
+                    return
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        deposits = [deposit for deposit, _ in batch]
+        try:
+            with self.app.app_context():
+                statuses = ingest_batch(deposits)
+        except Exception as e:
+            logger.error("Error ingesting deposit batch: %s", e)
+            statuses = ["error"] * len(batch)
+        self.batches += 1
+        self.deposits += len(batch)
+        for (deposit, future), status in zip(batch, statuses):
+            if status == "accepted":
+                logger.info("Deposit %s of %s credited to phone_number='%s'", deposit["receipt"], deposit["amount"], deposit["phone_number"])
+            future.set_result(status)
+
+    def stop(self):
+        """Flush what is queued and stop the worker thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=5)
+
+
+def init_deposit_batcher(app):
+    """Attach the deposit batcher to the app."""
+    app.extensions["deposit_batcher"] = DepositBatcher(
+        app,
+        batch_size=app.config["DEPOSIT_BATCH_SIZE"],
+        flush_interval=app.config["DEPOSIT_FLUSH_INTERVAL"],
+    )
+
+
+def get_deposit_batcher():
+    """Return the deposit batcher of the current app."""
+    return current_app.extensions["deposit_batcher"]
@@ -0,0 +1,162 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+from app.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class HashingUnavailable(Exception):
+    """Raised when a PIN hash cannot be computed in time."""
+
+
+class HashingOverloaded(HashingUnavailable):
+    """Raised when the hashing queue is full and the call is shed."""
+
+
+class HashingTimeout(HashingUnavailable):
+    """Raised when a hashing call misses its deadline."""
+
+
+class _ThreadBusy(threading.local):
+    # seconds this thread has spent waiting on hashes, read by the hop metrics
+    seconds = 0.0
+
+
+_executor = None
+_lock = threading.Lock()
+_thread_busy = _ThreadBusy()
+_config = {"workers": 0, "queue_limit": 0, "timeout": None, "method": "scrypt", "salt_length": 16, "prefix": None}
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "rejected": 0,
+    "timeouts": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "busy_seconds": 0.0,
+}
+
+
+def init_hashing(app):
+    """Configure the hashing pool from the app settings."""
+    global _executor
+    shutdown_hashing()
+    workers = int(app.config.get("HASH_POOL_WORKERS", 0))
+    _config["workers"] = workers
+    _config["queue_limit"] = int(app.config.get("HASH_QUEUE_LIMIT", workers * 4))
+    _config["timeout"] = float(app.config.get("HASH_TIMEOUT", 2.0))
+    _config["method"] = app.config.get("PIN_HASH_METHOD", "scrypt")
+    _config["salt_length"] = int(app.config.get("PIN_HASH_SALT_LENGTH", 16))
+    # werkzeug expands short method names, so read the full parameter prefix off a probe hash
+    _config["prefix"] = generate_password_hash("", _config["method"], _config["salt_length"]).split("$", 1)[0]
+    if workers > 0:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+
+
+def shutdown_hashing():
+    """Stop the worker processes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+atexit.register(shutdown_hashing)
+
+
+def _run(fn, *args):
+    # without a pool the call runs inline on the request thread
+    if _executor is None:
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            _thread_busy.seconds += elapsed
+        with _lock:
+            _stats["completed"] += 1
+            _stats["busy_seconds"] += elapsed
+        return result
+
+    with _lock:
+        if _stats["in_flight"] >= _config["queue_limit"]:
+            _stats["rejected"] += 1
+            raise HashingOverloaded("Hashing queue is full.")
+        _stats["in_flight"] += 1
+        _stats["submitted"] += 1
+        _stats["peak_in_flight"] = max(_stats["peak_in_flight"], _stats["in_flight"])
+
+    start = time.perf_counter()
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _release_slot(None)
+        raise
+    # a call that already started cannot be cancelled, so its slot is freed when it actually finishes
+    future.add_done_callback(_release_slot)
+    try:
+        result = future.result(timeout=_config["timeout"])
+        with _lock:
+            _stats["completed"] += 1
+        return result
+    except FutureTimeoutError:
+        future.cancel()
+        with _lock:
+            _stats["timeouts"] += 1
+        logger.warning("Hashing call exceeded its %ss deadline", _config["timeout"])
+        raise HashingTimeout("Hashing call timed out.")
+    finally:
+        elapsed = time.perf_counter() - start
+        _thread_busy.seconds += elapsed
+        with _lock:
+            _stats["busy_seconds"] += elapsed
+
+
+def _release_slot(future):
+    with _lock:
+        _stats["in_flight"] -= 1
+
+
+def thread_hash_seconds():
+    """Return the total time the calling thread has spent hashing or waiting on the pool."""
+    return _thread_busy.seconds
+
+
+def verify_password(pwhash, password):
+    """Check a PIN against its hash in the hashing pool."""
+    with span("pin.verify"):
+        return _run(check_password_hash, pwhash, password)
+
+
+def hash_password(password):
+    """Hash a PIN in the hashing pool using the configured policy."""
+    with span("pin.hash"):
+        return _run(generate_password_hash, password, _config["method"], _config["salt_length"])
+
+
+def needs_rehash(pwhash):
+    """Return True if a hash was made with parameters other than the current policy."""
+    if not pwhash or _config["prefix"] is None:
+        return False
+    method, _, rest = pwhash.partition("$")
+    salt = rest.partition("$")[0]
+    return method != _config["prefix"] or len(salt) != _config["salt_length"]
+
+
+def hash_policy():
+    """Return the active hashing policy."""
+    return {"method": _config["prefix"] or _config["method"], "salt_length": _config["salt_length"]}
+
+
+def hashing_stats():
+    """Return pool counters, including how saturated the queue is."""
+    with _lock:
+        stats = dict(_stats)
+    stats["workers"] = _config["workers"]
+    stats["queue_limit"] = _config["queue_limit"]
+    stats["saturation"] = stats["in_flight"] / _config["queue_limit"] if _config["queue_limit"] else 0.0
+    return stats
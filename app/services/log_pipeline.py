@@ -0,0 +1,240 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from app.helpers.redaction import RedactingFormatter, redact_record
+
+# the USSD session and menu being handled on this thread, attached to every record it logs
+_log_context = ContextVar("log_context", default=None)
+# the pipeline attached to the root logger; a new app replaces it
+_active = {}
+
+CONTEXT_FIELDS = ("session_id", "menu", "phone_number")
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+
+def bind_log_context(**fields):
+    """Attach fields to the records logged by the current request; returns a reset token."""
+    return _log_context.set(fields)
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+def parse_logger_settings(value, cast=float):
+    """Parse "logger:value,logger:value" settings into a dict."""
+    settings = {}
+    for item in (value or "").split(","):
+        name, _, setting = item.strip().rpartition(":")
+        if name and setting:
+            settings[name] = cast(setting)
+    return settings
+
+
+def _lookup(settings, name):
+    # a setting on a package applies to every module logger beneath it
+    while name:
+        if name in settings:
+            return settings[name]
+        name = name.rpartition(".")[0]
+    return None
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current log context onto each record before it leaves the request thread."""
+
+    def filter(self, record):
+        context = _log_context.get()
+        if context:
+            for key in CONTEXT_FIELDS:
+                if key in context and not hasattr(record, key):
+                    setattr(record, key, context[key])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Sample and rate-limit chatty loggers below WARNING.
+
+    Sampling is by session, so a sampled USSD session keeps all of its lines.
+    Rate limits are per logger, in records per second.
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limits = rate_limits or {}
+        self._settings = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def _settings_for(self, name):
+        settings = self._settings.get(name)
+        if settings is None:
+            settings = self._settings[name] = (_lookup(self.sample_rates, name), _lookup(self.rate_limits, name))
+        return settings
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        sample_rate, rate_limit = self._settings_for(record.name)
+
+        if sample_rate is not None and sample_rate < 1:
+            session_id = getattr(record, "session_id", None)
+            if session_id:
+                keep = zlib.crc32(str(session_id).encode()) % 10000 < sample_rate * 10000
+            else:
+                keep = random.random() < sample_rate
+            if not keep:
+                self.sampled_out += 1
+                return False
+
+        if rate_limit is not None:
+            now = time.monotonic()
+            with self._lock:
+                tokens, updated = self._buckets.get(record.name, (rate_limit, now))
+                tokens = min(rate_limit, tokens + (now - updated) * rate_limit)
+                if tokens < 1:
+                    self._buckets[record.name] = (tokens, now)
+                    self.rate_limited += 1
+                    return False
+                self._buckets[record.name] = (tokens - 1, now)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line, with sensitive values masked."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact_record(record),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class RedactingQueueHandler(QueueHandler):
+    """Queue records for the listener thread without blocking the request.
+
+    The message is formatted and redacted here, since its arguments may change
+    once the request moves on; JSON encoding and I/O happen on the listener.
+    A full queue drops the record and counts it instead of waiting.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        message = redact_record(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg, record.args, record.exc_info = message, None, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """Listener whose stop waits for room in a full queue rather than failing."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=5)
+
+
+class LogPipeline:
+    """Root QueueHandler feeding one output handler from a background listener."""
+
+    def __init__(self, handler, level=logging.INFO, queue_size=10000, sampling=None):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = RedactingQueueHandler(self.queue)
+        self.queue_handler.addFilter(ContextFilter())
+        self.sampling = sampling or SamplingFilter()
+        self.queue_handler.addFilter(self.sampling)
+        self.handler = handler
+        self.level = level
+        self.listener = DrainingQueueListener(self.queue, handler, respect_handler_level=True)
+        self._stopped = False
+
+    def start(self):
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Drain queued records to the output handler and detach from the root logger."""
+        if self._stopped:
+            return
+        self._stopped = True
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.handler.flush()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "sampled_out": self.sampling.sampled_out,
+            "rate_limited": self.sampling.rate_limited,
+        }
+
+
+def build_output_handler(config):
+    """Build the handler the listener writes to: a file or stderr, as JSON or text."""
+    path = config.get("LOG_FILE")
+    handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+    if config.get("LOG_FORMAT", "json") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(RedactingFormatter(TEXT_FORMAT))
+    return handler
+
+
+def init_logging(app):
+    """Route all logging through a background queue listener configured from the app."""
+    previous = _active.get("pipeline")
+    if previous is not None:
+        previous.stop()
+
+    sampling = SamplingFilter(
+        sample_rates=parse_logger_settings(app.config.get("LOG_SAMPLING")),
+        rate_limits=parse_logger_settings(app.config.get("LOG_RATE_LIMITS")),
+    )
+    pipeline = LogPipeline(
+        build_output_handler(app.config),
+        level=logging.getLevelName(str(app.config.get("LOG_LEVEL", "INFO")).upper()),
+        queue_size=int(app.config.get("LOG_QUEUE_SIZE", 10000)),
+        sampling=sampling,
+    )
+    pipeline.start()
+    _active["pipeline"] = pipeline
+    app.extensions["logging"] = pipeline
@@ -1,29 +1,44 @@
+import hmac
 import logging
-from flask import make_response
+from flask import current_app
 from app.models import Tests
+from app.services.session_store import get_session_store
+from app.services.menu_compiler import compile_menus
+from app.services.hashing import HashingUnavailable
+from app.services.log_pipeline import bind_log_context, reset_log_context
+from app.services.db_routing import bind_member_writes, remember_member_writes, replica_reads
+from app.services.metrics import finish_hop, mark_handler, start_hop
+from app.services.tracing import span
+from app.services.rate_limit import PinAttemptsExceeded, get_pin_limiter
+from app.services.member_cache import cache_member, get_member
 from app.helpers.utils import (
     normalize_phone_number,
     register_user,
     ussd_response,
+    init_static_responses,
     process_withdrawal,
     process_deposit,
+    request_mobile_deposit,
+    parse_amount,
     validate_phone_number,
     validate_national_id,
     validate_pin,
     verify_pin,
-    get_user_pin,
+    mask_sensitive_info,
+    upgrade_pin_hash,
+    issue_step_up_token,
+    pin_digest,
     get_recent_transactions,
     change_user_pin
 )
 
+logger = logging.getLogger(__name__)
+
 MENU_MAP = {
     "main": {
         "1": "login",
         "2": "register",
     },
-    "login": {
-        "pin": "enter_pin",
-    },
     "logged_in": {
         "1": "withdrawals",
         "2": "deposits",
@@ -93,10 +108,8 @@ MENU_MAP = {
         "4": "faq_support",
         "#": "enquiries",  # Back 
     },
-    "register": {
-        "phone": "enter_phone",
-        "national_id": "enter_national_id",
-        "pin": "enter_pin_register",
+    "mini_statement_more": {
+        "#": "enquiries",  # Back
     },
 }
 
@@ -118,8 +131,77 @@ INPUT_PROCESSING_MENUS = {
     "confirm_new_pin": "process_confirm_pin",
     "view_account_details": "process_view_details",
     "mini_statement": "process_mini_statement",
+    "login": "process_login",
+    "register": "process_register_phone",
+    "enter_national_id": "process_register_national_id",
+    "enter_pin_register": "process_register_pin",
+    "enter_pin_for_transaction": "process_transaction_pin",
+    "enter_mobile_amount": "process_mobile_amount",
+    "mini_statement_more": "process_mini_statement_more",
+}
+
+# states an input handler can move the session to
+INPUT_TRANSITIONS = {
+    "login": ("logged_in",),
+    "register": ("enter_national_id",),
+    "enter_national_id": ("enter_pin_register",),
+    "sacco_to_savings": ("enter_pin_for_transaction",),
+    "savings_to_sacco": ("enter_pin_for_transaction",),
+    "mpesa_sacco": ("enter_mobile_amount",),
+    "airtel_sacco": ("enter_mobile_amount",),
+    "mpesa_savings": ("enter_mobile_amount",),
+    "airtel_savings": ("enter_mobile_amount",),
+    "mpesa_to_sacco": ("enter_mobile_amount",),
+    "airtel_to_sacco": ("enter_mobile_amount",),
+    "mpesa_to_savings": ("enter_mobile_amount",),
+    "airtel_to_savings": ("enter_mobile_amount",),
+    "enter_mobile_amount": ("enter_pin_for_transaction",),
+    "update_pin": ("new_pin",),
+    "new_pin": ("confirm_new_pin",),
+    "mini_statement": ("mini_statement_more",),
+    "mini_statement_more": ("mini_statement_more",),
 }
 
+# mobile money menus -> (provider, action)
+MOBILE_MONEY_MENUS = {
+    "mpesa_sacco": ("M-Pesa", "sacco_to_mobile"),
+    "airtel_sacco": ("Airtel Money", "sacco_to_mobile"),
+    "mpesa_savings": ("M-Pesa", "savings_to_mobile"),
+    "airtel_savings": ("Airtel Money", "savings_to_mobile"),
+    "mpesa_to_sacco": ("M-Pesa", "deposit_to_sacco"),
+    "airtel_to_sacco": ("Airtel Money", "deposit_to_sacco"),
+    "mpesa_to_savings": ("M-Pesa", "deposit_to_savings"),
+    "airtel_to_savings": ("Airtel Money", "deposit_to_savings"),
+}
+
+MOBILE_WITHDRAWAL_ACTIONS = frozenset({"sacco_to_mobile", "savings_to_mobile"})
+
+# constant screens returned by the input handlers, pre-encoded at startup with the menu prompts
+STATIC_SCREENS = (
+    "CON Please enter your National ID number:",
+    "CON Please enter your PIN:",
+    "CON Enter amount to withdraw:",
+    "CON Enter deposit amount:",
+    "CON Enter your PIN to confirm withdrawal:",
+    "CON Enter new PIN:",
+    "CON Confirm new PIN:",
+    "END Invalid PIN. Please try again.",
+    "END Incorrect PIN. Please try again.",
+    "END Invalid phone number",
+    "END Invalid national ID",
+    "END Invalid amount.",
+    "END Invalid input.",
+    "END PIN changed successfully!",
+    "END Could not change your PIN. Please try again later.",
+    "END PINs do not match. Try again.",
+    "END No recent transactions found.",
+    "END Service is busy. Please try again shortly.",
+    "END Too many incorrect PIN attempts. Please try again later.",
+)
+
+# mini statement entries shown per screen
+STATEMENT_PAGE_SIZE = 5
+
 # parent menu mapping
 PARENT_MENUS = {
     "withdrawals": "logged_in",
@@ -152,23 +234,67 @@ MENU_TEXT = {
     "faqs": "CON FAQs:\n1. Faq Balance \n2. Faq Loan \n3. Faq Pin \n4. Faq Support \n#. Back",
 }
 
-# store sessions with navigation history
-sessions = {}
+# prompts for input menus and end screens
+MENU_PROMPTS = {
+    "login": "CON Please enter your PIN to proceed:",
+    "register": "CON Enter your phone number:",
+    "exit": "END Thank you for using our SACCO.",
+    "sacco_to_savings": "CON Enter amount to withdraw:",
+    "savings_to_sacco": "CON Enter amount to withdraw:",
+    "sacco_wallet_deposit": "CON Enter amount to deposit:",
+    "mpesa_sacco": "CON Enter your mobile number:",
+    "airtel_sacco": "CON Enter your mobile number:",
+    "mpesa_savings": "CON Enter your mobile number:",
+    "airtel_savings": "CON Enter your mobile number:",
+    "mpesa_to_sacco": "CON Enter your mobile number:",
+    "airtel_to_sacco": "CON Enter your mobile number:",
+    "mpesa_to_savings": "CON Enter your mobile number:",
+    "airtel_to_savings": "CON Enter your mobile number:",
+    "update_pin": "CON Enter your current PIN:",
+    "view_account_details": "CON Enter your PIN to view account details:",
+    "mini_statement": "CON Enter your PIN to access Mini Statement:",
+    "apply_loan": "END This feature is coming soon.",
+    "loan_status": "END This feature is coming soon.",
+    "help": "END Please contact customer support via 0720000000.",
+    "faq_balance": "END To check balance, go to Enquiries > Mini Statement.",
+    "faq_loan": "END To apply for a loan, navigate to Loans and follow the instructions.",
+    "faq_pin": "END To reset PIN, contact customer support at 0720000000.",
+    "faq_support": "END You can reach customer support via 0720000000.",
+}
+
+def menu_table():
+    """return the compiled menu table of the current app"""
+    return current_app.extensions["ussd_menu"]
 
 def get_menu_text(menu_name):
-    """return the predefined menu text or generate it dynamically if not found"""
-    if menu_name in MENU_TEXT:
-        return MENU_TEXT[menu_name]
-    else:
-        # generate menu text dynamically if not in predefined templates
-        if menu_name in MENU_MAP:
-            text = f"CON {menu_name.replace('_', ' ').title()}:\n"
-            for key, value in MENU_MAP[menu_name].items():
-                text += f"{key}. {value.replace('_', ' ').title()} \n"
-            return text
-        return f"CON {menu_name.replace('_', ' ').title()}"
-
-def handle_login(phone_number, choice, session_data, session_id, service_code):
+    """return the pre-rendered text for a menu"""
+    state = menu_table().get(menu_name)
+    if state and state.prompt:
+        return state.prompt
+    return f"CON {menu_name.replace('_', ' ').title()}"
+
+def current_member(phone_number, session_data):
+    """return the logged in member from the cache, or look them up by phone"""
+    user_id = session_data.get("user_id")
+    if user_id:
+        return get_member(user_id)
+    return Tests.query.filter_by(phone_number=phone_number).first()
+
+def check_pin(phone_number, member, pin, session_data):
+    """verify a PIN behind the attempt limiter, rejecting blocked callers before hashing"""
+    limiter = get_pin_limiter()
+    phone = member.phone_number if member else phone_number
+    session_id = session_data.get("session_id")
+    if limiter.is_blocked(phone, session_id):
+        raise PinAttemptsExceeded(f"Too many PIN attempts for phone_number='{mask_sensitive_info(phone)}'")
+
+    if member and verify_pin(member, pin):
+        limiter.record_success(phone, session_id)
+        return True
+    limiter.record_failure(phone, session_id)
+    return False
+
+def handle_login(phone_number, choice, session_data):
     """handles the login process."""
     if "*" in choice:
         parts = choice.split("*")
@@ -179,284 +305,335 @@ def handle_login(phone_number, choice, session_data, session_id, service_code):
     else:
         pin = choice
 
+    limiter = get_pin_limiter()
+    if limiter.is_blocked(phone_number, session_data.get("session_id")):
+        raise PinAttemptsExceeded(f"Too many PIN attempts for phone_number='{mask_sensitive_info(phone_number)}'")
+
     registered_user = Tests.query.filter_by(phone_number=phone_number).first()
-    if registered_user and verify_pin(registered_user, pin):
+    if registered_user:
+        limiter.seed(registered_user.phone_number, registered_user.failed_attempts, registered_user.pin_last_attempt)
+    if check_pin(phone_number, registered_user, pin, session_data):
+        upgrade_pin_hash(registered_user, pin)
         session_data["current_menu"] = "logged_in"
         session_data["menu_stack"].append("login")
         session_data["logged_in"] = True
         session_data["user_id"] = registered_user.id
+        cache_member(registered_user)
         return ussd_response(get_menu_text("logged_in"))
     else:
         return ussd_response("END Invalid PIN. Please try again.")
 
-def handle_registration(phone_number, choice, session_data):
-    """handles the registration process."""
-    if session_data["current_menu"] == "register" and "phone" in MENU_MAP["register"]:
+def process_register_phone(phone_number, choice, session_data):
+    """handles the phone number step of registration"""
+    if validate_phone_number(choice):
         session_data["menu_stack"].append("register")
         session_data["current_menu"] = "enter_national_id"
-        if validate_phone_number(choice):
-            session_data["menu_stack"].append(choice)
-            session_data["registration_phone"] = choice # Store phone
-            return ussd_response("CON Please enter your National ID number:")
-        else:
-            return ussd_response("END Invalid phone number")
-
-    elif session_data["current_menu"] == "enter_national_id":
-        session_data["menu_stack"].append("enter_national_id")
-        if validate_national_id(choice):
-            session_data["menu_stack"].append(choice)
-            session_data["registration_id"] = choice # Store ID
+        session_data["registration_phone"] = choice
+        return ussd_response("CON Please enter your National ID number:")
+    else:
+        return ussd_response("END Invalid phone number")
+
+def process_register_national_id(phone_number, choice, session_data):
+    """handles the national ID step of registration"""
+    # check if we received a three-part input
+    if "*" in choice and len(choice.split("*")) == 3:
+        national_id = choice.split("*")[2]
+        if validate_national_id(national_id):
+            session_data["registration_id"] = national_id
             session_data["current_menu"] = "enter_pin_register"
             return ussd_response("CON Please enter your PIN:")
         else:
             return ussd_response("END Invalid national ID")
+    elif validate_national_id(choice):
+        session_data["menu_stack"].append(choice)
+        session_data["registration_id"] = choice
+        session_data["current_menu"] = "enter_pin_register"
+        return ussd_response("CON Please enter your PIN:")
+    else:
+        return ussd_response("END Invalid national ID")
+
+def process_register_pin(phone_number, choice, session_data):
+    """handles the PIN step of registration"""
+    national_id = session_data.get("registration_id")
+    registration_phone = session_data.get("registration_phone")
+    pin = choice.split("*")[-1]
+    registration_message = register_user(registration_phone, national_id, pin)
+    return ussd_response(f"END {registration_message['message'] if 'message' in registration_message else registration_message}")
+
+def process_sacco_to_savings(phone_number, choice, session_data):
+    """handle withdrawal from sacco to savings"""
+    session_data["temp_amount"] = choice
+    session_data["temp_action"] = "sacco_to_savings"
+    session_data["current_menu"] = "enter_pin_for_transaction"
+    return ussd_response("CON Enter your PIN to confirm withdrawal:")
+
+def process_savings_to_sacco(phone_number, choice, session_data):
+    """handle withdrawal from savings to sacco"""
+    session_data["temp_amount"] = choice
+    session_data["temp_action"] = "savings_to_sacco"
+    session_data["current_menu"] = "enter_pin_for_transaction"
+    return ussd_response("CON Enter your PIN to confirm withdrawal:")
+
+# withdrawal actions -> (source account, destination)
+WITHDRAWAL_ACTIONS = {
+    "sacco_to_savings": ("sacco_wallet", "savings"),
+    "savings_to_sacco": ("savings", "sacco_wallet"),
+    "sacco_to_mobile": ("sacco_wallet", "mobile_money"),
+    "savings_to_mobile": ("savings", "mobile_money"),
+}
 
-    elif session_data["current_menu"] == "enter_pin_register":
-        national_id = session_data.get["registration_id"] # Get stored ID
-        registration_phone = session_data.get("registration_phone") # Get stored phone
-        pin = choice
-        registration_message = register_user(phone_number, national_id, pin)
-        return ussd_response(f"END {registration_message['message'] if 'message' in registration_message else registration_message}")
-
-def process_input(phone_number, menu_type, choice, session_data):
-    """process input for specific menu types"""
-    menu_stack = session_data["menu_stack"]
-    
-    # handle withdrawal from sacco to savings
-    if menu_type == "process_sacco_to_savings":
-        amount = choice
-        session_data["temp_amount"] = amount
-        session_data["temp_action"] = "sacco_to_savings"
-        session_data["current_menu"] = "enter_pin_for_transaction"
-        return ussd_response("CON Enter your PIN to confirm withdrawal:")
-    
-    # handle withdrawal from savings to sacco
-    elif menu_type == "process_savings_to_sacco":
-        amount = choice
+def process_transaction_pin(phone_number, choice, session_data):
+    """handle PIN entry for transactions"""
+    pin = choice
+    registered_user = current_member(phone_number, session_data)
+
+    if check_pin(phone_number, registered_user, pin, session_data):
+        action = session_data.get("temp_action", "")
+        amount = parse_amount(session_data.get("temp_amount"))
+        if action not in WITHDRAWAL_ACTIONS:
+            return ussd_response("END Unknown transaction type.")
+        if amount is None:
+            return ussd_response("END Invalid amount.")
+
+        # the PIN is verified once here; downstream checks accept the token instead
+        step_up_token = issue_step_up_token(registered_user, "withdrawal")
+        source, destination = WITHDRAWAL_ACTIONS[action]
+        withdrawal_result = process_withdrawal(
+            registered_user, amount, pin, source, destination,
+            provider=session_data.get("temp_provider"),
+            phone_number=session_data.get("temp_mobile"),
+            step_up_token=step_up_token,
+        )
+        return ussd_response(f"END {withdrawal_result['message']}")
+    else:
+        return ussd_response("END Invalid PIN. Please try again.")
+
+def process_mobile_number(phone_number, choice, session_data):
+    """process mobile number input for various mobile money services"""
+    current_menu = session_data["current_menu"]
+    if current_menu not in MOBILE_MONEY_MENUS:
+        return ussd_response("END Invalid menu state.")
+
+    session_data["temp_mobile"] = choice
+    # store original menu for later reference
+    session_data["last_menu"] = current_menu
+    session_data["current_menu"] = "enter_mobile_amount"
+
+    provider, action = MOBILE_MONEY_MENUS[current_menu]
+    if action in MOBILE_WITHDRAWAL_ACTIONS:
+        return ussd_response("CON Enter amount to withdraw:")
+    return ussd_response("CON Enter deposit amount:")
+
+def process_mobile_amount(phone_number, choice, session_data):
+    """process amount input after mobile number was provided"""
+    amount = choice
+    last_menu = session_data.get("last_menu")
+    if last_menu not in MOBILE_MONEY_MENUS:
+        return None
+
+    provider, action = MOBILE_MONEY_MENUS[last_menu]
+
+    # withdrawals to mobile money are confirmed with the member's PIN
+    if action in MOBILE_WITHDRAWAL_ACTIONS:
         session_data["temp_amount"] = amount
-        session_data["temp_action"] = "savings_to_sacco"
+        session_data["temp_provider"] = provider
+        session_data["temp_action"] = action
         session_data["current_menu"] = "enter_pin_for_transaction"
         return ussd_response("CON Enter your PIN to confirm withdrawal:")
-    
-    # handle PIN entry for transactions
-    elif session_data["current_menu"] == "enter_pin_for_transaction":
-        pin = choice
-        session_data["pin"] = pin
-        registered_user = Tests.query.filter_by(phone_number=phone_number).first()
-        
-        if registered_user and verify_pin(registered_user, pin):
-            action = session_data.get("temp_action", "")
-            amount = session_data.get("temp_amount", "0")
-            
-            if action == "sacco_to_savings":
-                withdrawal_result = process_withdrawal(registered_user, float(amount), pin, "savings", "sacco_wallet")
-                return ussd_response(f"END {withdrawal_result['message']}")
-            elif action == "savings_to_sacco":
-                withdrawal_result = process_withdrawal(registered_user, float(amount), pin, "sacco_wallet", "savings")
-                return ussd_response(f"END {withdrawal_result['message']}")
-            else:
-                return ussd_response("END Unknown transaction type.")
-        else:
-            return ussd_response("END Invalid PIN. Please try again.")
-    
-    # process mobile number input for various mobile money services
-    elif menu_type == "process_mobile_number":
-        mobile_number = choice
-        current_menu = session_data["current_menu"]
-        session_data["temp_mobile"] = mobile_number
-        
-        # store original menu for later reference
-        session_data["last_menu"] = current_menu
-        
-        # set next menu based on the current
-        if current_menu in ["mpesa_sacco", "airtel_sacco", "mpesa_savings", "airtel_savings"]:
-            return ussd_response("CON Enter amount to withdraw:")
-        elif current_menu in ["mpesa_to_sacco", "airtel_to_sacco", "mpesa_to_savings", "airtel_to_savings"]:
-            return ussd_response("CON Enter deposit amount:")
-        else:
-            return ussd_response("END Invalid menu state.")
-    
-    # handle direct sacco wallet deposit
-    elif menu_type == "process_sacco_wallet_deposit":
-        amount = choice
-        deposit_result = process_deposit(phone_number, amount, "SACCO Wallet", "SACCO Wallet")
-        return ussd_response(f"END {deposit_result['message']}")
-
-    # process amount input after mobile number was provided
-    elif session_data.get("temp_mobile") and session_data.get("last_menu"):
-        amount = choice
-        mobile_number = session_data.get("temp_mobile")
-        last_menu = session_data.get("last_menu")
-        
-        # handle withdrawal to mobile money
-        if last_menu in ["mpesa_sacco", "airtel_sacco"]:
-            # Determine provider
-            provider = "M-Pesa" if "mpesa" in last_menu else "Airtel Money"
-            # get PIN or ask for PIN
-            session_data["temp_amount"] = amount
-            session_data["temp_provider"] = provider
-            session_data["temp_action"] = "sacco_to_mobile"
-            session_data["current_menu"] = "enter_pin_for_transaction"
-            return ussd_response("CON Enter your PIN to confirm withdrawal:")
-            
-        # handle withdrawal to mobile money from savings
-        elif last_menu in ["mpesa_savings", "airtel_savings"]:
-            provider = "M-Pesa" if "mpesa" in last_menu else "Airtel Money"
-            session_data["temp_amount"] = amount
-            session_data["temp_provider"] = provider
-            session_data["temp_action"] = "savings_to_mobile"
-            session_data["current_menu"] = "enter_pin_for_transaction"
-            return ussd_response("CON Enter your PIN to confirm withdrawal:")
-            
-        # handle deposit from mobile money to sacco
-        elif last_menu in ["mpesa_to_sacco", "airtel_to_sacco"]:
-            provider = "M-Pesa" if "mpesa" in last_menu else "Airtel Money"
-            deposit_result = process_deposit(phone_number, amount, provider, "SACCO Wallet")
-            return ussd_response(f"END {deposit_result['message']}")
-            
-        # handle deposit from mobile money to savings
-        elif last_menu in ["mpesa_to_savings", "airtel_to_savings"]:
-            provider = "M-Pesa" if "mpesa" in last_menu else "Airtel Money"
-            deposit_result = process_deposit(phone_number, amount, provider, "Savings")
-            return ussd_response(f"END {deposit_result['message']}")
-    
-    # handle current PIN entry for updating PIN
-    elif menu_type == "process_current_pin":
-        current_pin = choice
-        registered_user = Tests.query.filter_by(phone_number=phone_number).first()
-        if registered_user and verify_pin(registered_user, current_pin):
-            session_data["menu_stack"].append(current_pin)
-            session_data["current_menu"] = "new_pin"
-            return ussd_response("CON Enter new PIN:")
-        else:
-            return ussd_response("END Invalid PIN. Please try again.")
-    
-    # handle new PIN entry
-    elif menu_type == "process_new_pin":
-        new_pin = choice
-        session_data["menu_stack"].append(new_pin)
-        session_data["current_menu"] = "confirm_new_pin"
-        return ussd_response("CON Confirm new PIN:")
-    
-    # handle PIN confirmation
-    elif menu_type == "process_confirm_pin":
-        new_pin = session_data["menu_stack"][-1]
-        confirm_pin = choice
-        if new_pin == confirm_pin:
-            registered_user = Tests.query.filter_by(phone_number=phone_number).first()
-            change_user_pin(registered_user, new_pin)
-            return ussd_response("END PIN changed successfully!")
-        else:
-            return ussd_response("END PINs do not match. Try again.")
-    
-    # handle view account details
-    elif menu_type == "process_view_details":
-        pin = choice
-        registered_user = Tests.query.filter_by(phone_number=phone_number).first()
-        if registered_user and verify_pin(registered_user, pin):
-            return ussd_response(f"END Account Details:\nPhone: {registered_user.phone_number}\nnational_id: {registered_user.national_id}\n")
-        else:
-            return ussd_response("END Invalid PIN. Please try again.")
-    
-    # handle mini statement request
-    elif menu_type == "process_mini_statement":
-        user_pin = choice
-        correct_pin = get_user_pin(phone_number)
-        if user_pin == correct_pin:
-            transactions = get_recent_transactions(phone_number, limit=5)
-            if transactions:
-                text = "END Last 5 Transactions:\n"
-                for txn in transactions:
-                    text += f"{txn['date']}: {txn['type']} {txn['amount']}\n"
-            else:
-                text = "END No recent transactions found."
-        else:
-            text = "END Incorrect PIN. Please try again."
-        return ussd_response(text)
-    
-    return None
+
+    # nothing is credited here; the provider's payment confirmation credits the account
+    destination = "sacco_wallet" if action == "deposit_to_sacco" else "savings"
+    deposit_result = request_mobile_deposit(current_member(phone_number, session_data), amount, provider, destination)
+    return ussd_response(f"END {deposit_result['message']}")
+
+def process_sacco_wallet_deposit(phone_number, choice, session_data):
+    """handle direct sacco wallet deposit"""
+    deposit_result = process_deposit(current_member(phone_number, session_data), choice, "sacco_wallet", "savings")
+    return ussd_response(f"END {deposit_result['message']}")
+
+def process_current_pin(phone_number, choice, session_data):
+    """handle current PIN entry for updating PIN"""
+    current_pin = choice
+    registered_user = current_member(phone_number, session_data)
+    if check_pin(phone_number, registered_user, current_pin, session_data):
+        session_data["current_menu"] = "new_pin"
+        return ussd_response("CON Enter new PIN:")
+    else:
+        return ussd_response("END Invalid PIN. Please try again.")
+
+def process_new_pin(phone_number, choice, session_data):
+    """handle new PIN entry"""
+    # session data can be written to disk, so only a keyed digest of the new PIN is kept for confirmation
+    session_data["new_pin_digest"] = pin_digest(choice, session_data.get("session_id"))
+    session_data["current_menu"] = "confirm_new_pin"
+    return ussd_response("CON Confirm new PIN:")
+
+def process_confirm_pin(phone_number, choice, session_data):
+    """handle PIN confirmation"""
+    new_pin_digest = session_data.pop("new_pin_digest", None)
+    if new_pin_digest and hmac.compare_digest(new_pin_digest, pin_digest(choice, session_data.get("session_id"))):
+        registered_user = current_member(phone_number, session_data)
+        result = change_user_pin(registered_user, choice)
+        if not result["status"]:
+            return ussd_response("END Could not change your PIN. Please try again later.")
+        return ussd_response("END PIN changed successfully!")
+    else:
+        return ussd_response("END PINs do not match. Try again.")
+
+@replica_reads
+def process_view_details(phone_number, choice, session_data):
+    """handle view account details"""
+    registered_user = current_member(phone_number, session_data)
+    if check_pin(phone_number, registered_user, choice, session_data):
+        return ussd_response(f"END Account Details:\nPhone: {registered_user.phone_number}\nnational_id: {registered_user.national_id}\n")
+    else:
+        return ussd_response("END Invalid PIN. Please try again.")
+
+def render_statement_page(session_data, transactions, next_cursor, title):
+    """format a page of the mini statement, offering older entries if there are any"""
+    if not transactions:
+        return ussd_response("END No recent transactions found.")
+
+    lines = "".join(f"{txn['line']}\n" for txn in transactions)
+    if next_cursor is None:
+        return ussd_response(f"END {title}\n{lines}")
+
+    session_data["statement_cursor"] = next_cursor
+    session_data["current_menu"] = "mini_statement_more"
+    return ussd_response(f"CON {title}\n{lines}0. More \n#. Back")
+
+def process_mini_statement(phone_number, choice, session_data):
+    """handle mini statement request"""
+    registered_user = current_member(phone_number, session_data)
+    if check_pin(phone_number, registered_user, choice, session_data):
+        transactions, next_cursor = get_recent_transactions(registered_user.id, limit=STATEMENT_PAGE_SIZE)
+        return render_statement_page(session_data, transactions, next_cursor, f"Last {STATEMENT_PAGE_SIZE} Transactions:")
+    return ussd_response("END Incorrect PIN. Please try again.")
+
+def process_mini_statement_more(phone_number, choice, session_data):
+    """page through older mini statement entries"""
+    if choice != "0":
+        return None
+    registered_user = current_member(phone_number, session_data)
+    cursor = session_data.get("statement_cursor")
+    transactions, next_cursor = get_recent_transactions(registered_user.id, limit=STATEMENT_PAGE_SIZE, cursor=cursor)
+    return render_statement_page(session_data, transactions, next_cursor, "Older Transactions:")
+
+# input handlers by the names used in INPUT_PROCESSING_MENUS
+INPUT_HANDLERS = {
+    "process_login": handle_login,
+    "process_register_phone": process_register_phone,
+    "process_register_national_id": process_register_national_id,
+    "process_register_pin": process_register_pin,
+    "process_sacco_to_savings": process_sacco_to_savings,
+    "process_savings_to_sacco": process_savings_to_sacco,
+    "process_transaction_pin": process_transaction_pin,
+    "process_mobile_number": process_mobile_number,
+    "process_mobile_amount": process_mobile_amount,
+    "process_sacco_wallet_deposit": process_sacco_wallet_deposit,
+    "process_current_pin": process_current_pin,
+    "process_new_pin": process_new_pin,
+    "process_confirm_pin": process_confirm_pin,
+    "process_view_details": process_view_details,
+    "process_mini_statement": process_mini_statement,
+    "process_mini_statement_more": process_mini_statement_more,
+}
+
+def build_menu_table():
+    """compile the menu definitions into the dispatch table used for every hop"""
+    return compile_menus(
+        MENU_MAP,
+        PARENT_MENUS,
+        INPUT_PROCESSING_MENUS,
+        MENU_TEXT,
+        MENU_PROMPTS,
+        INPUT_HANDLERS,
+        INPUT_TRANSITIONS,
+    )
+
+def init_menu_table(app):
+    """compile the menus once and attach the table to the app, with every static screen pre-encoded"""
+    table = app.extensions["ussd_menu"] = build_menu_table()
+    prompts = [state.prompt for state in table.values() if state.prompt]
+    init_static_responses(app, prompts + list(STATIC_SCREENS))
 
 def handle_menu_navigation(current_menu, choice, phone_number, session_data):
     """handles navigation through menus based on user choices"""
-    menu_stack = session_data["menu_stack"]
-    
-    # check for back navigation using #
-    if choice == "#" and current_menu in MENU_MAP:
-        parent_menu = MENU_MAP[current_menu].get("#")
-        if parent_menu:
-            session_data["current_menu"] = parent_menu
-            # Don't add to stack when going back
-            return ussd_response(get_menu_text(parent_menu))
-    
-    # check if user input is mapped to next menu
-    next_menu = MENU_MAP.get(current_menu, {}).get(choice)
-    
-    if next_menu:
-        # store current menu in stack before moving to next
-        menu_stack.append(current_menu)
-        session_data["current_menu"] = next_menu
-        
-        # special case for menus that need input rather than selection
-        if next_menu == "sacco_to_savings":
-            return ussd_response("CON Enter amount to withdraw:")
-        elif next_menu in ["mpesa_sacco", "airtel_sacco", "mpesa_savings", "airtel_savings"]:
-            return ussd_response("CON Enter your mobile number:")
-        elif next_menu == "savings_to_sacco":
-            return ussd_response("CON Enter amount to withdraw:")
-        elif next_menu == "sacco_wallet_deposit":
-            return ussd_response("CON Enter amount to deposit:")
-        elif next_menu in ["mpesa_to_sacco", "airtel_to_sacco", "mpesa_to_savings", "airtel_to_savings"]:
-            return ussd_response("CON Enter your mobile number:")
-        elif next_menu == "update_pin":
-            return ussd_response("CON Enter your current PIN:")
-        elif next_menu == "view_account_details":
-            return ussd_response("CON Enter your PIN to view account details:")
-        elif next_menu == "mini_statement":
-            return ussd_response("CON Enter your PIN to access Mini Statement:")
-        elif next_menu in ["apply_loan", "loan_status"]:
-            return ussd_response("END This feature is coming soon.")
-        elif next_menu == "help":
-            return ussd_response("END Please contact customer support via 0720000000.")
-        elif next_menu in ["faq_balance", "faq_loan", "faq_pin", "faq_support"]:
-            # FAQ responses
-            faq_responses = {
-                "faq_balance": "END To check balance, go to Enquiries > Mini Statement.",
-                "faq_loan": "END To apply for a loan, navigate to Loans and follow the instructions.",
-                "faq_pin": "END To reset PIN, contact customer support at 0720000000.",
-                "faq_support": "END You can reach customer support via 0720000000."
-            }
-            return ussd_response(faq_responses.get(next_menu, "END Information not available."))
-        # standard menus, display the menu text
-        return ussd_response(get_menu_text(next_menu))
-        
-    return None
+    table = menu_table()
+    state = table.get(current_menu)
+    if state is None:
+        return None
+
+    next_menu = state.transitions.get(choice)
+    if not next_menu:
+        return None
+
+    # don't add to stack when going back
+    if choice != "#":
+        session_data["menu_stack"].append(current_menu)
+    session_data["current_menu"] = next_menu
+    return ussd_response(table[next_menu].prompt or get_menu_text(next_menu))
 
 def handle_ussd_request(session_id, service_code, phone_number, text):
     """process USSD requests using a menu map with support for navigation."""
+    started = start_hop()
     phone_number = normalize_phone_number(phone_number)
 
     if not phone_number:
-        logging.error("Invalid phone number format.")
+        logger.error("Invalid phone number format.")
         return ussd_response("END Error: Invalid phone number format.", 400)
 
-    logging.info(f"USSD Request: phone_number='{phone_number}', text='{text}'")
-    logging.info(f"Session ID: '{session_id}', Current Menu: '{sessions.get(session_id, {}).get('current_menu')}'")
-
-    # initialize or retrieve session data
-    if session_id not in sessions:
-        sessions[session_id] = {
+    # retrieve session data from the shared store, or initialize it; the sessionId comes from
+    # the gateway, so it is only ever used as a key within the session namespace
+    store = get_session_store("session")
+    with span("session.load"):
+        session_data = store.get(session_id)
+    if session_data is None:
+        session_data = {
             "current_menu": "main",
             "menu_stack": [],
+            "session_id": session_id,
             "phone_number": phone_number,
             "logged_in": False
         }
 
-    session_data = sessions[session_id]
+    menu = session_data.get("current_menu")
+    # every line logged for this hop carries the session, menu and (masked) phone
+    token = bind_log_context(session_id=session_id, menu=menu, phone_number=phone_number)
+    # reads stay on the primary for a while after this member last wrote
+    write_token = bind_member_writes(phone_number)
+    try:
+        # the text carries PINs and IDs typed by the member, so only its hop count is logged
+        logger.info("USSD request with %d hops", text.count("*") + 1 if text else 0)
+        with span("ussd.dispatch", menu=menu):
+            response = dispatch_ussd_request(session_id, service_code, phone_number, text, session_data)
+    except HashingUnavailable as e:
+        logger.warning("Shedding USSD request: %s", e)
+        response = ussd_response("END Service is busy. Please try again shortly.")
+    except PinAttemptsExceeded as e:
+        logger.warning("%s", e)
+        response = ussd_response("END Too many incorrect PIN attempts. Please try again later.")
+    finally:
+        remember_member_writes(phone_number, write_token)
+        reset_log_context(token)
+
+    # finished sessions are dropped, live ones are written back with a fresh TTL
+    with span("session.save"):
+        if response is None or response.get_data(as_text=True).startswith("END"):
+            store.delete(session_id)
+        else:
+            store.set(session_id, session_data)
+    finish_hop(started, menu)
+    return response
+
+def dispatch_ussd_request(session_id, service_code, phone_number, text, session_data):
+    """route a single USSD hop to the handler for the session's current menu."""
     current_menu = session_data["current_menu"]
 
     # initial request - show main menu
     if text == "":
-        logging.info("Initial request - showing main menu")
+        logger.info("Initial request - showing main menu")
+        mark_handler("start")
         session_data["current_menu"] = "main"
         session_data["menu_stack"] = []
         session_data["logged_in"] = False
@@ -464,19 +641,20 @@ def handle_ussd_request(session_id, service_code, phone_number, text):
 
     # handle concatenated text
     processed_text = text
-    if "*" in text and session_data["current_menu"] not in ["enter_national_id", "enter_pin_register"]:
+    if "*" in text and current_menu not in ("enter_national_id", "enter_pin_register"):
         parts = text.split("*")
         processed_text = parts[-1]
-        logging.info(f"Concatenated input detected. Parts: '{parts}', Processed text: '{processed_text}'")
+        logger.info("Concatenated input detected with %d parts", len(parts))
 
     # handle special registration flow
     if text.startswith("2*"):
         parts = text.split("*")
-        logging.info(f"Registration flow triggered with parts: '{parts}'")
+        logger.info("Registration flow triggered with %d parts", len(parts))
+        mark_handler("registration")
         # registration with phone number
         if len(parts) == 2:
             phone_number_from_text = parts[1]
-            logging.info(f"Two-part registration input. Phone: '{phone_number_from_text}'")
+            logger.info("Two-part registration input. phone_number='%s'", phone_number_from_text)
             if validate_phone_number(phone_number_from_text):
                 session_data["menu_stack"].append("register")
                 session_data["current_menu"] = "enter_national_id"
@@ -488,7 +666,7 @@ def handle_ussd_request(session_id, service_code, phone_number, text):
         elif len(parts) == 3:
             phone_number_from_text = parts[1]
             national_id = parts[2]
-            logging.info(f"Three-part registration input. Phone: '{phone_number_from_text}', ID: '{national_id}'")
+            logger.info("Three-part registration input. phone_number='%s', national_id='%s'", phone_number_from_text, national_id)
             if validate_phone_number(phone_number_from_text) and validate_national_id(national_id):
                 session_data["menu_stack"].append("register")
                 session_data["menu_stack"].append(phone_number_from_text)
@@ -503,7 +681,7 @@ def handle_ussd_request(session_id, service_code, phone_number, text):
             phone_number_from_text = parts[1]
             national_id = parts[2]
             pin = parts[3]
-            logging.info(f"Four-part registration input. Phone: '{phone_number_from_text}', ID: '{national_id}', PIN: '{pin}'")
+            logger.info("Four-part registration input. phone_number='%s', national_id='%s'", phone_number_from_text, national_id)
             if validate_phone_number(phone_number_from_text) and validate_national_id(national_id) and validate_pin(pin):
                 registration_message = register_user(phone_number_from_text, national_id, pin) # Use extracted phone
                 return ussd_response(f"END {registration_message['message'] if 'message' in registration_message else registration_message}")
@@ -517,72 +695,23 @@ def handle_ussd_request(session_id, service_code, phone_number, text):
                     error_message = "Invalid PIN."
                 return ussd_response(f"END {error_message}")
 
-        return None # If the '2*' condition is met but doesn't fit the parts, exit this block
-
-    # handle main menu choices
-    if current_menu == "main":
-        if processed_text == "1":
-            session_data["current_menu"] = "login"
-            return ussd_response("CON Please enter your PIN to proceed:")
-        elif processed_text == "2":
-            session_data["current_menu"] = "register"
-            return ussd_response("CON Enter your phone number:")
-
-    # handle login
-    if current_menu == "login":
-        return handle_login(phone_number, processed_text, session_data, session_id, service_code)
-
-    # handle registration process
-    elif current_menu == "register":
-        if validate_phone_number(processed_text):
-            session_data["menu_stack"].append("register")
-            session_data["current_menu"] = "enter_national_id"
-            session_data["registration_phone"] = processed_text
-            return ussd_response("CON Please enter your National ID number:")
-        else:
-            return ussd_response("END Invalid phone number")
-    elif current_menu == "enter_national_id":
-        # Check if we received a three-part input
-        if "*" in text and len(text.split("*")) == 3:
-            parts = text.split("*")
-            national_id = parts[2]
-            if validate_national_id(national_id):
-                session_data["registration_id"] = national_id
-                session_data["current_menu"] = "enter_pin_register"
-                return ussd_response("CON Please enter your PIN:")
-            else:
-                return ussd_response("END Invalid national ID")
-        elif validate_national_id(processed_text):
-            session_data["menu_stack"].append(processed_text)
-            session_data["registration_id"] = processed_text
-            session_data["current_menu"] = "enter_pin_register"
-            return ussd_response("CON Please enter your PIN:")
-        else:
-            return ussd_response("END Invalid national ID")
-    elif current_menu == "enter_pin_register":
-        national_id = session_data.get("registration_id")
-        registration_phone = session_data.get("registration_phone")
-        pin = processed_text # Use processed_text for PIN
-        registration_message = register_user(registration_phone, national_id, pin)
-        return ussd_response(f"END {registration_message['message'] if 'message' in registration_message else registration_message}")
+        return ussd_response("END Invalid input.")
 
     # check if the current menu requires specific input processing
-    if current_menu in INPUT_PROCESSING_MENUS:
-        input_processor = INPUT_PROCESSING_MENUS[current_menu]
-        result = process_input(phone_number, input_processor, processed_text, session_data)
+    state = menu_table().get(current_menu)
+    if state is not None and state.handler is not None:
+        mark_handler(state.handler.__name__)
+        result = state.handler(phone_number, processed_text, session_data)
         if result:
             return result
 
     # handle menu navigation for standard menu options
+    mark_handler("navigation")
     nav_result = handle_menu_navigation(current_menu, processed_text, phone_number, session_data)
     if nav_result:
         return nav_result
 
-    # process amount input after mobile number was provided (this also covers many other cases)
-    if session_data.get("temp_mobile") and session_data.get("last_menu"):
-        result = process_input(phone_number, "process_mobile_input", processed_text, session_data)
-        if result:
-            return result
+    mark_handler("fallback")
 
     # if nothing matched but we're logged in, go back to logged_in menu
     if session_data.get("logged_in", False):
@@ -592,7 +721,3 @@ def handle_ussd_request(session_id, service_code, phone_number, text):
     # if all else fails, return to main menu
     session_data["current_menu"] = "main"
     return ussd_response(get_menu_text("main"))
-
-    resp = make_response(text, 200)
-    resp.headers['Content-Type'] = "text/plain"
-    return resp
@@ -0,0 +1,58 @@
+from collections import namedtuple
+from flask import current_app
+from app import db
+from app.models import Tests
+from app.services.db_routing import reading_from_replica
+from app.services.session_store import get_session_store
+
+# read-only view of a member row, enough for PIN checks and account details
+MemberSnapshot = namedtuple("MemberSnapshot", ["id", "phone_number", "national_id", "pin"])
+
+
+def _members():
+    return get_session_store("member")
+
+
+def _cache_enabled():
+    # the snapshot holds the PIN hash, so a PIN change must reach every worker's copy; "auto"
+    # therefore needs a shared store
+    setting = current_app.config.get("MEMBER_CACHE", "auto")
+    if setting == "auto":
+        return get_session_store().shared
+    return setting not in ("0", False)
+
+
+def cache_member(user):
+    """Store a snapshot of the member row and return it."""
+    member = MemberSnapshot(user.id, user.phone_number, user.national_id, user.pin)
+    if _cache_enabled():
+        _members().set(user.id, member._asdict())
+    return member
+
+
+def get_member(user_id):
+    """Return the cached member snapshot, loading it by primary key on a miss."""
+    cached = _members().get(user_id) if _cache_enabled() else None
+    if cached is not None:
+        return MemberSnapshot(**cached)
+
+    user = db.session.get(Tests, user_id)
+    if not user:
+        return None
+    if reading_from_replica():
+        # a replica may still hold the row from before a PIN change, so it is not cached
+        return MemberSnapshot(user.id, user.phone_number, user.national_id, user.pin)
+    return cache_member(user)
+
+
+def get_member_record(member):
+    """Return the ORM row behind a snapshot, for write paths."""
+    if isinstance(member, Tests):
+        return member
+    return db.session.get(Tests, member.id)
+
+
+def invalidate_member(user_id):
+    """Drop the cached snapshot after the member row changes."""
+    if _cache_enabled():
+        _members().delete(user_id)
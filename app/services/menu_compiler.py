@@ -0,0 +1,84 @@
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+# a compiled USSD state: the input handler (if any), choice -> next state, and the rendered prompt
+MenuState = namedtuple("MenuState", ["name", "handler", "transitions", "prompt"])
+
+
+class MenuCompileError(ValueError):
+    """Raised when the menu definitions contain dangling or unreachable states."""
+
+
+def render_menu_text(menu_name, options):
+    """Generate the text for a menu that has no predefined template."""
+    text = f"CON {menu_name.replace('_', ' ').title()}:\n"
+    for key, value in options.items():
+        text += f"{key}. {value.replace('_', ' ').title()} \n"
+    return text
+
+
+def compile_menus(menu_map, parent_menus, input_menus, menu_text, prompts, handlers, input_transitions, root="main"):
+    """Compile the menu definitions into an immutable state -> MenuState table.
+
+    Every state referenced by a transition must be defined, every input menu
+    must name a registered handler, and every state must be reachable from
+    the root menu. Violations raise MenuCompileError.
+    """
+    errors = []
+    states = set(menu_map) | set(input_menus) | set(menu_text) | set(prompts)
+
+    transitions = {name: dict(options) for name, options in menu_map.items()}
+    for child, parent in parent_menus.items():
+        if child not in states or parent not in states:
+            errors.append(f"parent mapping '{child}' -> '{parent}' references an undefined state")
+            continue
+        back = transitions.setdefault(child, {}).setdefault("#", parent)
+        if back != parent:
+            errors.append(f"menu '{child}' goes back to '{back}' but its parent is '{parent}'")
+
+    for name, options in transitions.items():
+        for choice, target in options.items():
+            if target not in states:
+                errors.append(f"menu '{name}' option '{choice}' leads to undefined state '{target}'")
+
+    for name, targets in input_transitions.items():
+        if name not in input_menus:
+            errors.append(f"state '{name}' declares input transitions but has no input handler")
+        for target in targets:
+            if target not in states:
+                errors.append(f"input state '{name}' leads to undefined state '{target}'")
+
+    for name, handler_name in input_menus.items():
+        if handler_name not in handlers:
+            errors.append(f"input menu '{name}' uses unknown handler '{handler_name}'")
+
+    # walk every edge from the root to find states no member can ever reach
+    reachable = {root}
+    queue = deque([root])
+    while queue:
+        name = queue.popleft()
+        edges = list(transitions.get(name, {}).values()) + list(input_transitions.get(name, ()))
+        for target in edges:
+            if target in states and target not in reachable:
+                reachable.add(target)
+                queue.append(target)
+    for name in sorted(states - reachable):
+        errors.append(f"state '{name}' is unreachable from '{root}'")
+
+    if errors:
+        raise MenuCompileError("Invalid USSD menu definition:\n" + "\n".join(errors))
+
+    table = {}
+    for name in states:
+        options = transitions.get(name, {})
+        if name in menu_text:
+            prompt = menu_text[name]
+        elif name in prompts:
+            prompt = prompts[name]
+        elif options:
+            prompt = render_menu_text(name, options)
+        else:
+            prompt = None
+        handler = handlers[input_menus[name]] if name in input_menus else None
+        table[name] = MenuState(name, handler, MappingProxyType(options), prompt)
+    return MappingProxyType(table)
@@ -0,0 +1,208 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from flask import current_app, g
+from app import db
+from app.services.db_pool import pool_stats
+from app.services.hashing import hashing_stats, thread_hash_seconds
+
+# upper bounds in seconds of the hop latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# row layout: hop count, latency sum, query count, hashing seconds, then one counter per bucket
+_COUNT, _SECONDS, _QUERIES, _HASH_SECONDS, _BUCKETS = range(5)
+
+# the handler that answered the hop being handled on this thread
+_hop_handler = ContextVar("ussd_handler", default=None)
+
+
+class HopMetrics:
+    """Latency histograms and counters per (menu, handler) for USSD hops.
+
+    Each thread records into its own shard of pre-allocated rows, so a hop
+    only indexes into lists it owns; shards are summed when metrics are read.
+    """
+
+    def __init__(self, labels, buckets=LATENCY_BUCKETS):
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._width = _BUCKETS + len(self.buckets) + 1
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _new_row(self):
+        row = [0] * self._width
+        row[_SECONDS] = row[_HASH_SECONDS] = 0.0
+        return row
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {label: self._new_row() for label in self.labels}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, label, seconds, queries=0, hash_seconds=0.0):
+        """Record one hop under a (menu, handler) label."""
+        shard = self._shard()
+        row = shard.get(label)
+        if row is None:
+            # labels outside the compiled menu table (e.g. an unknown state) are added on first use
+            with self._lock:
+                row = shard[label] = self._new_row()
+        row[_COUNT] += 1
+        row[_SECONDS] += seconds
+        row[_QUERIES] += queries
+        row[_HASH_SECONDS] += hash_seconds
+        row[_BUCKETS + bisect_left(self.buckets, seconds)] += 1
+
+    def snapshot(self):
+        """Return label -> merged row for every label that has recorded a hop."""
+        with self._lock:
+            items = [list(shard.items()) for shard in self._shards]
+        merged = {}
+        for shard_items in items:
+            for label, row in shard_items:
+                if not row[_COUNT]:
+                    continue
+                total = merged.setdefault(label, self._new_row())
+                for index, value in enumerate(row):
+                    total[index] += value
+        return merged
+
+
+def start_hop():
+    """Capture the clock, query count and hashing time at the start of a hop."""
+    # resolve the context proxies once; each lookup through them costs more than the recording itself
+    request_state = g._get_current_object()
+    _hop_handler.set(None)
+    return (
+        current_app._get_current_object().extensions["hop_metrics"],
+        request_state,
+        time.perf_counter(),
+        request_state.get("query_count", 0),
+        thread_hash_seconds(),
+    )
+
+
+def mark_handler(name):
+    """Name the handler that produced the response for the current hop."""
+    _hop_handler.set(name)
+
+
+def finish_hop(started, menu):
+    """Record the hop started by start_hop() against the menu it began in."""
+    metrics, request_state, start, queries, hash_seconds = started
+    metrics.observe(
+        (menu, _hop_handler.get() or "unknown"),
+        time.perf_counter() - start,
+        request_state.get("query_count", 0) - queries,
+        thread_hash_seconds() - hash_seconds,
+    )
+
+
+def init_metrics(app):
+    """Pre-allocate hop metrics for every state of the compiled menu table."""
+    labels = [
+        (state.name, state.handler.__name__ if state.handler else "navigation")
+        for state in app.extensions["ussd_menu"].values()
+    ]
+    app.extensions["hop_metrics"] = HopMetrics(labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _metric(lines, name, metric_type, help_text, samples):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+
+
+def render_prometheus(app):
+    """Render hop, query, hashing and session store metrics in the Prometheus text format."""
+    lines = []
+    metrics = app.extensions["hop_metrics"]
+    rows = sorted(metrics.snapshot().items())
+
+    histogram = []
+    for (menu, handler), row in rows:
+        cumulative = 0
+        for bound, count in zip(metrics.buckets + (float("inf"),), row[_BUCKETS:]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            histogram.append((_labels(menu=menu, handler=handler, le=le), cumulative))
+    lines.append("# HELP ussd_hop_duration_seconds Time to handle a USSD hop, by starting menu and handler.")
+    lines.append("# TYPE ussd_hop_duration_seconds histogram")
+    for labels, value in histogram:
+        lines.append(f"ussd_hop_duration_seconds_bucket{labels} {value}")
+    for (menu, handler), row in rows:
+        labels = _labels(menu=menu, handler=handler)
+        lines.append(f"ussd_hop_duration_seconds_sum{labels} {row[_SECONDS]}")
+        lines.append(f"ussd_hop_duration_seconds_count{labels} {row[_COUNT]}")
+
+    _metric(lines, "ussd_hop_queries_total", "counter", "SQL statements issued while handling USSD hops.", [
+        (_labels(menu=menu, handler=handler), row[_QUERIES]) for (menu, handler), row in rows
+    ])
+    _metric(lines, "ussd_hop_hash_seconds_total", "counter", "Time USSD hops spent hashing or verifying PINs.", [
+        (_labels(menu=menu, handler=handler), row[_HASH_SECONDS]) for (menu, handler), row in rows
+    ])
+
+    query_stats = app.extensions["query_stats"]
+    _metric(lines, "http_requests_total", "counter", "Requests handled.", [("", query_stats["requests"])])
+    _metric(lines, "db_queries_total", "counter", "SQL statements issued by requests.", [("", query_stats["queries"])])
+    _metric(lines, "db_query_budget_exceeded_total", "counter", "Requests that issued more statements than their route's budget.", [("", query_stats["over_budget"])])
+    _metric(lines, "db_repeated_statements_total", "counter", "Statements repeated past the limit within one request (likely N+1).", [("", query_stats["repeated_statements"])])
+
+    pool = pool_stats(db.engine)
+    if pool is not None:
+        _metric(lines, "db_pool_size", "gauge", "Connections the pool keeps open.", [("", pool["size"])])
+        _metric(lines, "db_pool_checked_out", "gauge", "Pooled connections in use.", [("", pool["checked_out"])])
+        _metric(lines, "db_pool_overflow", "gauge", "Connections open beyond the pool size.", [("", pool["overflow"])])
+        _metric(lines, "db_pool_checkouts_total", "counter", "Connection checkouts.", [("", pool["checkouts"])])
+        _metric(lines, "db_pool_wait_seconds_total", "counter", "Time spent waiting for or opening pooled connections.", [("", pool["wait_seconds"])])
+        _metric(lines, "db_pool_max_wait_seconds", "gauge", "Longest checkout wait since startup.", [("", pool["max_wait_seconds"])])
+        _metric(lines, "db_pool_timeouts_total", "counter", "Checkouts that timed out waiting for a connection.", [("", pool["timeouts"])])
+
+    routing = app.extensions.get("db_routing")
+    if routing is not None:
+        _metric(lines, "db_replica_reads_total", "counter", "SELECTs routed to a read replica.", [
+            (_labels(bind=key), count) for key, count in routing["reads"].items()
+        ])
+
+    hashing = hashing_stats()
+    for key in ("submitted", "completed", "rejected", "timeouts"):
+        _metric(lines, f"pin_hash_{key}_total", "counter", f"PIN hashing calls {key}.", [("", hashing[key])])
+    _metric(lines, "pin_hash_busy_seconds_total", "counter", "Time spent hashing PINs.", [("", hashing["busy_seconds"])])
+    _metric(lines, "pin_hash_in_flight", "gauge", "PIN hashing calls in the pool.", [("", hashing["in_flight"])])
+    _metric(lines, "pin_hash_saturation", "gauge", "Share of the hashing queue in use.", [("", hashing["saturation"])])
+
+    store = app.extensions["session_store"].stats()
+    backend = _labels(backend=store["backend"])
+    for key in ("hits", "misses", "evictions"):
+        _metric(lines, f"session_store_{key}_total", "counter", f"Session store {key}.", [(backend, store[key])])
+    _metric(lines, "session_store_entries", "gauge", "Entries in the session store.", [(backend, store["size"])])
+
+    pipeline = app.extensions.get("logging")
+    if pipeline is not None:
+        logging_stats = pipeline.stats()
+        _metric(lines, "log_queue_depth", "gauge", "Log records waiting for the listener.", [("", logging_stats["queued"])])
+        for key in ("dropped", "sampled_out", "rate_limited"):
+            _metric(lines, f"log_records_{key}_total", "counter", f"Log records {key.replace('_', ' ')}.", [("", logging_stats[key])])
+
+    sink = app.extensions.get("tracing")
+    if sink is not None:
+        tracing_stats = sink.stats()
+        _metric(lines, "traces_written_total", "counter", "Sampled requests traced.", [("", tracing_stats["written"])])
+        _metric(lines, "traces_dropped_total", "counter", "Traces dropped because the sink queue was full.", [("", tracing_stats["dropped"])])
+
+    return "\n".join(lines) + "\n"
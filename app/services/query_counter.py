@@ -0,0 +1,77 @@
+import logging
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.services.log_pipeline import parse_logger_settings
+from app.services.slow_queries import normalize_statement
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in testing when a request goes over its query budget or repeats a statement."""
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        state = g._get_current_object()
+        state.query_count = state.get("query_count", 0) + 1
+        # only set while a request's view runs, so work after the response is not budgeted
+        statements = state.get("query_statements")
+        if statements is not None:
+            statements[statement] = statements.get(statement, 0) + 1
+
+
+def get_query_count():
+    """Return the number of statements issued so far in this request."""
+    return g.get("query_count", 0)
+
+
+def over_budget(count, budget):
+    return bool(budget) and count > budget
+
+
+def check_query_budget(count, budget, statements, repeat_limit):
+    """Return the problems with a request's queries: over budget, and statements repeated past the limit."""
+    problems = []
+    if over_budget(count, budget):
+        problems.append(f"issued {count} queries, over its budget of {budget}")
+    for statement, repeats in statements.items():
+        if repeats > repeat_limit:
+            problems.append(f"repeated a statement {repeats} times (likely N+1): {normalize_statement(statement)[:200]}")
+    return problems
+
+
+def init_query_counter(app):
+    """Count the SQL statements issued by every request and hold routes to their query budgets."""
+    if not event.contains(Engine, "before_cursor_execute", _count_query):
+        event.listen(Engine, "before_cursor_execute", _count_query)
+
+    stats = app.extensions["query_stats"] = {"requests": 0, "queries": 0, "over_budget": 0, "repeated_statements": 0}
+    budgets = parse_logger_settings(app.config.get("QUERY_BUDGETS"), cast=int)
+    default_budget = int(app.config.get("QUERY_BUDGET_DEFAULT", 0))
+    repeat_limit = int(app.config.get("QUERY_REPEAT_LIMIT", 3))
+
+    @app.before_request
+    def start_query_budget():
+        g.query_statements = {}
+
+    @app.after_request
+    def record_query_count(response):
+        count = get_query_count()
+        stats["requests"] += 1
+        stats["queries"] += count
+        logger.debug("%s %s issued %d queries", request.method, request.path, count)
+
+        statements = g.pop("query_statements", None) or {}
+        budget = budgets.get(request.endpoint, default_budget)
+        problems = check_query_budget(count, budget, statements, repeat_limit)
+        if problems:
+            stats["over_budget"] += over_budget(count, budget)
+            stats["repeated_statements"] += sum(repeats > repeat_limit for repeats in statements.values())
+            # tests fail on a query regression; production only reports it
+            if app.testing:
+                raise QueryBudgetExceeded(f"{request.endpoint} " + "; ".join(problems))
+            for problem in problems:
+                logger.warning("%s %s", request.endpoint, problem)
+        return response
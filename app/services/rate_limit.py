@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam
+from app import db
+from app.models import Tests
+
+logger = logging.getLogger(__name__)
+
+
+class PinAttemptsExceeded(Exception):
+    """Raised when a phone or session has too many recent failed PIN attempts."""
+
+
+class PinAttemptLimiter:
+    """Sliding-window limiter for failed PIN attempts, keyed by phone and by session.
+
+    Counters live in memory and are written back to Tests.failed_attempts and
+    Tests.pin_last_attempt in batches rather than one UPDATE per attempt.
+    """
+
+    def __init__(self, max_attempts=5, window=300, flush_interval=5, flush_batch=100):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._failures = {}
+        self._dirty = {}
+        self._seeded = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return 0
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return 0
+        return len(failures)
+
+    def seed(self, phone_number, failed_attempts, last_attempt):
+        """Load persisted counters for a phone the first time this process sees it."""
+        with self._lock:
+            # a pending counter is newer than the row it would be seeded from
+            if phone_number in self._seeded or phone_number in self._dirty:
+                return
+            self._seeded.add(phone_number)
+            if not failed_attempts or not last_attempt:
+                return
+            # the columns keep only a count and the latest time, so replay them at that time
+            age = (datetime.utcnow() - last_attempt).total_seconds()
+            if age < self.window and phone_number not in self._failures:
+                at = time.monotonic() - max(age, 0)
+                self._failures[phone_number] = deque([at] * min(failed_attempts, self.max_attempts))
+
+    def is_blocked(self, phone_number, session_id=None):
+        now = time.monotonic()
+        with self._lock:
+            for key in (phone_number, f"session:{session_id}" if session_id else None):
+                if key and self._recent(key, now) >= self.max_attempts:
+                    return True
+        return False
+
+    def record_failure(self, phone_number, session_id=None):
+        now = time.monotonic()
+        with self._lock:
+            for key in (phone_number, f"session:{session_id}" if session_id else None):
+                if key:
+                    self._failures.setdefault(key, deque()).append(now)
+            self._dirty[phone_number] = (self._recent(phone_number, now), datetime.utcnow())
+
+    def record_success(self, phone_number, session_id=None):
+        with self._lock:
+            if session_id:
+                self._failures.pop(f"session:{session_id}", None)
+            # only phones with failures on record need their counter reset
+            if self._failures.pop(phone_number, None) is not None or phone_number in self._dirty:
+                self._dirty[phone_number] = (0, datetime.utcnow())
+
+    def maybe_flush(self):
+        """Write pending counters if the batch is full or the interval has passed."""
+        with self._lock:
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if not self._dirty or not (due or len(self._dirty) >= self.flush_batch):
+                return 0
+        return self.flush()
+
+    def flush(self):
+        """Write all pending counters to the members table in a single executemany."""
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+            self._last_flush = time.monotonic()
+            # seed phones from the database again so failures recorded by other workers are
+            # picked up, except those being written now, whose rows still hold older counters
+            self._seeded = set(pending)
+            # drop phones and sessions whose failures have aged out of the window
+            now = self._last_flush
+            for key in list(self._failures):
+                self._recent(key, now)
+        if not pending:
+            return 0
+
+        rows = [
+            {"phone": phone, "attempts": attempts, "attempted_at": attempted_at}
+            for phone, (attempts, attempted_at) in pending.items()
+        ]
+        statement = (
+            Tests.__table__.update()
+            .where(Tests.__table__.c.phone_number == bindparam("phone"))
+            .values(failed_attempts=bindparam("attempts"), pin_last_attempt=bindparam("attempted_at"))
+        )
+        try:
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error writing PIN attempt counters: %s", e)
+            with self._lock:
+                for phone, value in pending.items():
+                    self._dirty.setdefault(phone, value)
+            return 0
+
+        with self._lock:
+            # the rows are current now, unless a newer counter is already pending
+            self._seeded.difference_update(phone for phone in pending if phone not in self._dirty)
+        return len(rows)
+
+
+def init_pin_limiter(app):
+    """Attach the PIN attempt limiter to the app and flush it after requests."""
+    limiter = PinAttemptLimiter(
+        max_attempts=app.config["PIN_MAX_ATTEMPTS"],
+        window=app.config["PIN_ATTEMPT_WINDOW"],
+        flush_interval=app.config["PIN_ATTEMPT_FLUSH_INTERVAL"],
+    )
+    app.extensions["pin_limiter"] = limiter
+
+    @app.after_request
+    def flush_pin_attempts(response):
+        limiter.maybe_flush()
+        return response
+
+
+def get_pin_limiter():
+    """Return the PIN attempt limiter of the current app."""
+    return current_app.extensions["pin_limiter"]
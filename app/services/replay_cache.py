@@ -0,0 +1,72 @@
+import hashlib
+import hmac
+import threading
+from flask import current_app
+from app.helpers.utils import ussd_response
+from app.services.session_store import create_session_store
+
+
+class ReplayCache:
+    """Replays the response to a USSD hop the gateway retried with the same sessionId and text.
+
+    Responses are kept for a short TTL in a store of their own, so a burst of
+    retries cannot evict live sessions. Duplicates that arrive while the first
+    request is still running wait for it instead of running the hop a second
+    time.
+    """
+
+    def __init__(self, secret, store, ttl=30, wait_timeout=10):
+        self.secret = secret.encode("utf-8")
+        self.store = store
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.replays = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _key(self, session_id, text):
+        # a keyed hash of the text, so PINs in the input path cannot be recovered from store keys
+        digest = hmac.new(self.secret, f"{session_id}\0{text}".encode("utf-8"), hashlib.sha256).hexdigest()
+        return digest
+
+    def get_or_compute(self, session_id, text, compute):
+        """Return the hop's response, computing it only once per hop."""
+        key = self._key(session_id, text)
+        cached = self.store.get(key)
+        if cached is not None:
+            self.replays += 1
+            return ussd_response(cached["body"], cached["status"])
+
+        with self._lock:
+            event = self._in_flight.get(key)
+            leader = event is None
+            if leader:
+                event = self._in_flight[key] = threading.Event()
+
+        if not leader:
+            event.wait(self.wait_timeout)
+            cached = self.store.get(key)
+            if cached is not None:
+                self.replays += 1
+                return ussd_response(cached["body"], cached["status"])
+
+        try:
+            response = compute()
+            self.store.set(key, {"body": response.get_data(as_text=True), "status": response.status_code}, ttl=self.ttl)
+            return response
+        finally:
+            if leader:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                event.set()
+
+
+def init_replay_cache(app):
+    """Attach the replay cache to the app."""
+    store = create_session_store(app.config, table="ussd_replays", max_entries=app.config["REPLAY_CACHE_MAX_ENTRIES"])
+    app.extensions["replay_cache"] = ReplayCache(app.config["SECRET_KEY"], store, ttl=app.config["REPLAY_CACHE_TTL"])
+
+
+def get_replay_cache():
+    """Return the replay cache of the current app."""
+    return current_app.extensions["replay_cache"]
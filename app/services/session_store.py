@@ -0,0 +1,245 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+
+class SessionStore:
+    """Base class for USSD session storage backends.
+
+    Every backend stores JSON-serialisable values under string keys with a
+    time-to-live, and keeps hit, miss and eviction counters.
+    """
+
+    backend = "base"
+    # whether every worker process sees the same entries
+    shared = False
+
+    def __init__(self, ttl=300, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def namespace(self, name):
+        """Return a view of this store whose keys all live under "<name>:"."""
+        return NamespacedStore(self, name)
+
+    def stats(self):
+        """Return the counters for this backend."""
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": self.size(),
+        }
+
+
+class NamespacedStore:
+    """View of a session store that prefixes every key with its namespace.
+
+    Callers pass bare keys, so a key that comes from a request, such as the
+    gateway's sessionId, can only reach entries in its own namespace.
+    """
+
+    def __init__(self, store, name):
+        if ":" in name:
+            raise ValueError(f"Namespace must not contain ':': '{name}'")
+        self.store = store
+        self.prefix = f"{name}:"
+
+    @property
+    def shared(self):
+        return self.store.shared
+
+    def get(self, key):
+        return self.store.get(self.prefix + str(key))
+
+    def set(self, key, value, ttl=None):
+        self.store.set(self.prefix + str(key), value, ttl=ttl)
+
+    def delete(self, key):
+        self.store.delete(self.prefix + str(key))
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with TTL expiry and LRU eviction."""
+
+    backend = "memory"
+
+    def __init__(self, ttl=300, max_entries=10000):
+        super().__init__(ttl, max_entries)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            self._evict(time.monotonic())
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self):
+        return len(self._data)
+
+    def _evict(self, now):
+        # least recently used entries sit at the front, so expired ones are found there first
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now and len(self._data) <= self.max_entries:
+                break
+            del self._data[key]
+            self.evictions += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared between worker processes through a SQLite file in WAL mode."""
+
+    backend = "sqlite"
+    shared = True
+
+    # run the expiry/LRU sweep once every this many writes
+    PURGE_EVERY = 100
+
+    def __init__(self, path, ttl=300, max_entries=10000, table="ussd_sessions"):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_accessed ON {table} (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        if row[1] <= now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.evictions += 1
+            self.misses += 1
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        conn = self._connection()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), expires_at, now),
+        )
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self._evict(conn, now)
+
+    def delete(self, key):
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def size(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _evict(self, conn, now):
+        expired = conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)).rowcount
+        overflow = conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.evictions += expired + overflow
+
+
+SESSION_BACKENDS = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+
+def create_session_store(config, table="ussd_sessions", max_entries=None):
+    """Build a store on the backend selected by the app configuration.
+
+    Stores with their own table (SQLite) or their own dict (memory) keep their
+    own LRU, so one cache filling up cannot evict another's entries.
+    """
+    backend = config.get("SESSION_BACKEND", "memory")
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend: '{backend}'")
+
+    ttl = int(config.get("SESSION_TTL", 300))
+    if max_entries is None:
+        max_entries = int(config.get("SESSION_MAX_ENTRIES", 10000))
+    if backend == "sqlite":
+        path = config.get("SESSION_SQLITE_PATH") or os.path.join(os.getcwd(), "ussd_sessions.db")
+        return SQLiteSessionStore(path, ttl=ttl, max_entries=max_entries, table=table)
+    return MemorySessionStore(ttl=ttl, max_entries=max_entries)
+
+
+def init_session_store(app):
+    """Attach the configured session store to the app."""
+    app.extensions["session_store"] = create_session_store(app.config)
+
+
+def get_session_store(namespace=None):
+    """Return the session store of the current app, or a view of one namespace in it."""
+    store = current_app.extensions["session_store"]
+    return store.namespace(namespace) if namespace else store
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# the recorder of the current app; the engine listeners are shared by every app
+_active = {}
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# DBAPI placeholders: ?, %s, %(name)s and :name
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):\w+|\?")
+# expanded IN lists differ only in length
+_PLACEHOLDER_LIST = re.compile(r"\(\?(?:, ?\?)+\)")
+
+
+def normalize_statement(statement):
+    """Reduce a statement to its shape: literals and placeholders become ?, whitespace collapses."""
+    statement = _WHITESPACE.sub(" ", statement.strip())
+    statement = _STRING.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    return _PLACEHOLDER_LIST.sub("(?, ...)", statement)
+
+
+def _value_shape(value):
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany=False):
+    """Describe bound parameters by type and length only, so no member data is recorded."""
+    if executemany:
+        rows = list(parameters)
+        return {"rows": len(rows), "first": parameter_shapes(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: _value_shape(value) for key, value in parameters.items()}
+    return [_value_shape(value) for value in parameters or ()]
+
+
+class SlowQueryRecorder:
+    """Append statements slower than a threshold, with their plan, to an NDJSON file.
+
+    A plan is captured the first time a fingerprint is seen and then at most
+    once per explain interval, since EXPLAIN runs on the request's connection.
+    """
+
+    def __init__(self, path, threshold_ms, explain_interval=300):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.explain_interval = explain_interval
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._explained = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def _should_explain(self, key, statement, executemany):
+        if executemany or not statement.lstrip()[:6].upper() == "SELECT":
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(key)
+            if last is not None and now - last < self.explain_interval:
+                return False
+            self._explained[key] = now
+        return True
+
+    def explain(self, conn, statement, parameters):
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        # a raw DBAPI cursor keeps the EXPLAIN out of the engine events it was triggered from
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [[str(column) for column in row] for row in cursor.fetchall()]
+        except Exception as e:
+            return f"EXPLAIN failed: {e}"
+        finally:
+            cursor.close()
+
+    def record(self, conn, statement, parameters, executemany, seconds, streaming=False):
+        # the normalized form is logged so literals in hand-written SQL never reach the file
+        normalized = normalize_statement(statement)
+        key = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+        entry = {
+            "ts": round(time.time(), 3),
+            "fingerprint": key,
+            "duration_ms": round(seconds * 1000, 3),
+            "statement": normalized,
+            "parameters": parameter_shapes(parameters, executemany),
+        }
+        # a streamed result still has unread rows on the connection; running EXPLAIN there would discard them
+        if not streaming and self._should_explain(key, statement, executemany):
+            entry["plan"] = self.explain(conn, statement, parameters)
+        os.write(self._fd, (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8"))
+        self.recorded += 1
+        logger.warning("Slow query %s took %.1f ms", key, seconds * 1000)
+
+    def close(self):
+        os.close(self._fd)
+
+
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and "recorder" in _active:
+        context._slow_query_start = time.perf_counter()
+
+
+def _check_duration(conn, cursor, statement, parameters, context, executemany):
+    recorder = _active.get("recorder")
+    start = getattr(context, "_slow_query_start", None)
+    if recorder is None or start is None:
+        return
+    seconds = time.perf_counter() - start
+    if seconds >= recorder.threshold:
+        try:
+            streaming = context.execution_options.get("stream_results", False)
+            recorder.record(conn, statement, parameters, executemany, seconds, streaming)
+        except Exception:
+            # a broken recorder must never fail the query it was timing
+            logger.exception("Could not record a slow query")
+
+
+def summarize_slow_queries(path, sort="total"):
+    """Aggregate a slow query log by fingerprint, ordered by total, count or max time."""
+    groups = {}
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            group = groups.get(entry["fingerprint"])
+            if group is None:
+                group = groups[entry["fingerprint"]] = {
+                    "fingerprint": entry["fingerprint"],
+                    "statement": entry["statement"],
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "parameters": entry["parameters"],
+                    "plan": None,
+                }
+            group["count"] += 1
+            group["total_ms"] += entry["duration_ms"]
+            group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+            if "plan" in entry:
+                group["plan"] = entry["plan"]
+    key = {"total": "total_ms", "count": "count", "max": "max_ms"}[sort]
+    return sorted(groups.values(), key=lambda group: -group[key])
+
+
+def init_slow_query_log(app):
+    """Record statements slower than SLOW_QUERY_THRESHOLD_MS when it is above zero."""
+    previous = _active.pop("recorder", None)
+    if previous is not None:
+        previous.close()
+
+    threshold = float(app.config.get("SLOW_QUERY_THRESHOLD_MS", 0))
+    if threshold <= 0:
+        return
+    recorder = SlowQueryRecorder(
+        app.config.get("SLOW_QUERY_LOG", "slow_queries.ndjson"),
+        threshold,
+        float(app.config.get("SLOW_QUERY_EXPLAIN_INTERVAL", 300)),
+    )
+    _active["recorder"] = recorder
+    app.extensions["slow_queries"] = recorder
+    if not event.contains(Engine, "before_cursor_execute", _start_timer):
+        event.listen(Engine, "before_cursor_execute", _start_timer)
+        event.listen(Engine, "after_cursor_execute", _check_duration)
@@ -0,0 +1,87 @@
+import os
+from flask import current_app
+from app.services.session_store import get_session_store
+
+
+def _pages():
+    return get_session_store("statement")
+
+
+def _generations():
+    return get_session_store("statement_generation")
+
+
+def _cache_size():
+    return current_app.config["STATEMENT_CACHE_SIZE"]
+
+
+def _cache_ttl():
+    return current_app.config["STATEMENT_CACHE_TTL"]
+
+
+def _cache_enabled():
+    # a write in one worker must reach every worker's cache, so "auto" needs a shared store
+    setting = current_app.config.get("STATEMENT_CACHE", "auto")
+    if setting == "auto":
+        return get_session_store().shared
+    return setting not in ("0", False)
+
+
+def _new_generation(user_id):
+    generation = os.urandom(8).hex()
+    _generations().set(user_id, generation, ttl=_cache_ttl())
+    return generation
+
+
+def statement_generation(user_id):
+    """Return the member's statement generation, starting one if there is none.
+
+    Take it before reading the newest page from the database: a write that
+    commits after that read starts a new generation, so the page it fills is
+    never served.
+    """
+    if not _cache_enabled():
+        return None
+    generation = _generations().get(user_id)
+    if generation is None:
+        generation = _new_generation(user_id)
+    return generation
+
+
+def get_cached_statement(user_id, limit):
+    """Return (entries, next_cursor) for the newest page, or None on a miss."""
+    if limit > _cache_size() or not _cache_enabled():
+        return None
+    cached = _pages().get(user_id)
+    if cached is None or cached["generation"] != _generations().get(user_id):
+        return None
+
+    entries = cached["entries"]
+    page = entries[:limit]
+    next_cursor = None
+    if page and (len(entries) > limit or cached["has_more"]):
+        next_cursor = [page[-1]["created_at"], page[-1]["id"]]
+    return page, next_cursor
+
+
+def fill_statement_cache(user_id, entries, has_more, generation):
+    """Store the newest entries read from the database after a miss, under the generation taken before the read."""
+    if generation is None:
+        return
+    _pages().set(
+        user_id,
+        {
+            "generation": generation,
+            "entries": entries[:_cache_size()],
+            "has_more": has_more or len(entries) > _cache_size(),
+        },
+        ttl=_cache_ttl(),
+    )
+
+
+def invalidate_statement(user_id):
+    """Start a new generation once a write commits, so pages cached before it are not served."""
+    if not _cache_enabled():
+        return
+    _new_generation(user_id)
+    _pages().delete(user_id)
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+from sqlalchemy import literal, null, select, union_all
+from app import db
+from app.models import Transactions, Withdrawals
+
+EXPORT_COLUMNS = ["record", "id", "created_at", "type", "amount", "source", "destination", "provider", "phone_number"]
+
+
+def statement_query(user_id):
+    """Build one ordered query over a member's ledger.
+
+    Every money movement is one Transactions row; the Withdrawals row written
+    with it only adds the provider and phone number. Withdrawals recorded
+    before transactions existed have no ledger row and are exported as is.
+    """
+    transactions = select(
+        literal("transaction").label("record"),
+        Transactions.id,
+        Transactions.created_at,
+        Transactions.transaction_type.label("type"),
+        Transactions.amount,
+        Transactions.source,
+        Transactions.destination,
+        Withdrawals.provider,
+        Withdrawals.phone_number,
+    ).outerjoin(Withdrawals, Withdrawals.transaction_id == Transactions.id).where(Transactions.user_id == user_id)
+    withdrawals = select(
+        literal("withdrawal").label("record"),
+        Withdrawals.id,
+        Withdrawals.created_at,
+        literal("withdrawal").label("type"),
+        Withdrawals.amount,
+        null().label("source"),
+        Withdrawals.withdrawal_method.label("destination"),
+        Withdrawals.provider,
+        Withdrawals.phone_number,
+    ).where(Withdrawals.user_id == user_id, Withdrawals.transaction_id.is_(None))
+    statement = union_all(transactions, withdrawals).subquery()
+    return select(statement).order_by(statement.c.created_at, statement.c.record, statement.c.id)
+
+
+def iter_statement_rows(user_id, chunk_size=1000):
+    """Yield a member's statement rows from a server-side cursor, chunk_size rows at a time."""
+    query = statement_query(user_id).execution_options(stream_results=True, yield_per=chunk_size)
+    result = db.session.execute(query)
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _export_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def iter_csv(user_id, chunk_size=1000):
+    """Yield the statement as CSV text, one chunk of rows per piece."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for partition in iter_statement_rows(user_id, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_export_value(value) for value in row] for row in partition)
+        yield buffer.getvalue()
+
+
+def iter_ndjson(user_id, chunk_size=1000):
+    """Yield the statement as newline-delimited JSON, one chunk of rows per piece."""
+    for partition in iter_statement_rows(user_id, chunk_size):
+        yield "".join(
+            json.dumps({key: _export_value(value) for key, value in row._mapping.items()}) + "\n"
+            for row in partition
+        )
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,234 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.services.log_pipeline import DrainingQueueListener, RedactingQueueHandler
+
+# the trace of the request being handled on this thread, or None when it is not sampled
+_trace = ContextVar("trace", default=None)
+# the sink writing traces; a new app replaces it
+_active = {}
+_NOOP = nullcontext()
+
+# span layout: name, start offset, duration, parent index, attributes
+_NAME, _START, _DURATION, _PARENT, _ATTRS = range(5)
+
+
+class Trace:
+    """Spans of one sampled request, kept as plain lists until the request ends."""
+
+    __slots__ = ("trace_id", "wall_start", "start", "spans", "stack")
+
+    def __init__(self, name):
+        self.trace_id = os.urandom(8).hex()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.spans = [[name, 0.0, None, None, {}]]
+        self.stack = [0]
+
+    def open(self, name, attrs):
+        self.spans.append([name, time.perf_counter() - self.start, None, self.stack[-1], attrs])
+        self.stack.append(len(self.spans) - 1)
+        return len(self.spans) - 1
+
+    def close(self, index):
+        span = self.spans[index]
+        span[_DURATION] = time.perf_counter() - self.start - span[_START]
+        if self.stack[-1] == index:
+            self.stack.pop()
+
+    def add(self, name, start, end, attrs):
+        """Record a finished span under the innermost open one, e.g. from an engine event."""
+        parent = self.stack[-1] if self.stack else 0
+        self.spans.append([name, start - self.start, end - start, parent, attrs])
+
+    def server_timing(self):
+        """Sum the spans by name into a Server-Timing header value."""
+        totals = {}
+        for name, _, duration, parent, _ in self.spans:
+            if parent is not None and duration is not None:
+                total, count = totals.get(name, (0.0, 0))
+                totals[name] = (total + duration, count + 1)
+        entries = [f"total;dur={self.spans[0][_DURATION] * 1000:.2f}"]
+        for name, (total, count) in totals.items():
+            entry = f"{name};dur={total * 1000:.2f}"
+            entries.append(entry + f';desc="x{count}"' if count > 1 else entry)
+        return ", ".join(entries)
+
+    def __str__(self):
+        # one NDJSON line per trace, encoded by the sink's listener thread; child spans are
+        # [name, parent, start ms, duration ms, attributes]
+        root = self.spans[0]
+        return json.dumps({
+            "trace": self.trace_id,
+            "ts": round(self.wall_start, 6),
+            "name": root[_NAME],
+            "dur_ms": round((root[_DURATION] or 0.0) * 1000, 3),
+            **root[_ATTRS],
+            "spans": [
+                [name, parent, round(start * 1000, 3), round((duration or 0.0) * 1000, 3), attrs]
+                for name, start, duration, parent, attrs in self.spans[1:]
+            ],
+        }, default=str, separators=(",", ":"))
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "index")
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.index = self.trace.open(self.name, self.attrs)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.close(self.index)
+
+
+def span(name, **attrs):
+    """Time a block as a child span of the current trace; does nothing when the request is not sampled."""
+    trace = _trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, attrs)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None and context is not None:
+        context._trace_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    start = getattr(context, "_trace_start", None)
+    if trace is not None and start is not None:
+        # statements carry bound parameters, so no member data ends up in the trace
+        trace.add("db", start, time.perf_counter(), {"statement": statement[:200], "rows": cursor.rowcount})
+
+
+def _before_commit(session):
+    if _trace.get() is not None:
+        session.info["_trace_commit"] = time.perf_counter()
+
+
+def _after_commit(session):
+    trace = _trace.get()
+    start = session.info.pop("_trace_commit", None)
+    if trace is not None and start is not None:
+        trace.add("db.commit", start, time.perf_counter(), {})
+
+
+class _TraceQueueHandler(RedactingQueueHandler):
+    """Queue the finished Trace itself; it is encoded when the listener formats it.
+
+    Trace lines are built from statements and timings only, so they skip redaction.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class TraceSink:
+    """Writes finished traces to a rotating NDJSON file from a background listener."""
+
+    def __init__(self, path, max_bytes, backups, queue_size=10000):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = _TraceQueueHandler(self.queue)
+        self.file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self.file_handler.setFormatter(logging.Formatter("%(message)s"))
+        self.listener = DrainingQueueListener(self.queue, self.file_handler)
+        # a logger of its own that does not propagate, so traces never reach the application log
+        self.logger = logging.getLogger("app.trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.written = 0
+        self._stopped = False
+
+    def start(self):
+        for existing in list(self.logger.handlers):
+            self.logger.removeHandler(existing)
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
+
+    def write(self, trace):
+        self.logger.info(trace)
+        self.written += 1
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.handler.dropped, "queued": self.queue.qsize()}
+
+
+def init_tracing(app):
+    """Trace a sample of requests when TRACE_SAMPLE_RATE is above zero."""
+    previous = _active.pop("sink", None)
+    if previous is not None:
+        previous.stop()
+
+    rate = float(app.config.get("TRACE_SAMPLE_RATE", 0))
+    if rate <= 0:
+        return
+
+    sink = TraceSink(
+        app.config.get("TRACE_FILE", "traces.ndjson"),
+        int(app.config.get("TRACE_FILE_MAX_BYTES", 10 * 1024 * 1024)),
+        int(app.config.get("TRACE_FILE_BACKUPS", 5)),
+    )
+    sink.start()
+    _active["sink"] = sink
+    app.extensions["tracing"] = sink
+    server_timing = app.config.get("TRACE_SERVER_TIMING", True)
+
+    for target, identifier, listener in (
+        (Engine, "before_cursor_execute", _before_cursor_execute),
+        (Engine, "after_cursor_execute", _after_cursor_execute),
+        (Session, "before_commit", _before_commit),
+        (Session, "after_commit", _after_commit),
+    ):
+        if not event.contains(target, identifier, listener):
+            event.listen(target, identifier, listener)
+
+    @app.before_request
+    def start_trace():
+        if rate >= 1 or random.random() < rate:
+            g.trace_token = _trace.set(Trace(f"{request.method} {request.path}"))
+
+    @app.after_request
+    def finish_trace(response):
+        trace = _trace.get()
+        if trace is not None:
+            trace.close(0)
+            trace.spans[0][_ATTRS]["status"] = response.status_code
+            if server_timing:
+                response.headers["Server-Timing"] = trace.server_timing()
+            sink.write(trace)
+        return response
+
+    @app.teardown_request
+    def clear_trace(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            _trace.reset(token)
@@ -0,0 +1,99 @@
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import time
+from urllib.parse import parse_qsl
+from app.helpers.redaction import mask_sensitive_info
+
+CAPTURE_PATH_INFO = "/api/ussd/callback"
+
+PIN_SEGMENT = re.compile(r"\d{4}")
+# phone numbers and national IDs typed into the menus
+LONG_SEGMENT = re.compile(r"\+?\d{8,}")
+
+
+def mask_ussd_text(text):
+    """Split a USSD text path into segments with PINs, phones and IDs masked.
+
+    The result is a list because masked values contain "*", the USSD
+    separator; empty segments from stray "*" input are kept as they are.
+    """
+    if not text:
+        return []
+    segments = []
+    for segment in text.split("*"):
+        if PIN_SEGMENT.fullmatch(segment):
+            segment = "****"
+        elif LONG_SEGMENT.fullmatch(segment):
+            segment = mask_sensitive_info(segment)
+        segments.append(segment)
+    return segments
+
+
+class UssdCaptureMiddleware:
+    """WSGI middleware that appends every USSD callback to a compact NDJSON capture file.
+
+    Each line holds the arrival time, duration, status, session id, service
+    code, the masked phone with a keyed pseudonym (so a replay can tell
+    callers apart without the number) and the masked text segments. Lines
+    are written with a single O_APPEND write, so several workers can share
+    one file.
+    """
+
+    def __init__(self, wsgi_app, path, key):
+        self.wsgi_app = wsgi_app
+        self.path = path
+        self.key = key.encode("utf-8") if isinstance(key, str) else key
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.captured = 0
+
+    def pseudonym(self, phone_number):
+        return hmac.new(self.key, phone_number.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") != CAPTURE_PATH_INFO:
+            return self.wsgi_app(environ, start_response)
+
+        arrived = time.time()
+        start = time.perf_counter()
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length > 0 else b""
+        # hand the app an unread copy of the body
+        environ["wsgi.input"] = io.BytesIO(body)
+        form = dict(parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True))
+
+        status = []
+
+        def capture_start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+
+        response = self.wsgi_app(environ, capture_start_response)
+        phone_number = form.get("phoneNumber", "")
+        record = {
+            "t": round(arrived, 3),
+            "d": round((time.perf_counter() - start) * 1000, 2),
+            "s": int(status[0].split(" ", 1)[0]) if status else 0,
+            "m": environ.get("REQUEST_METHOD"),
+            "sid": form.get("sessionId", ""),
+            "sc": form.get("serviceCode", ""),
+            "p": mask_sensitive_info(phone_number) if phone_number else "",
+            "u": self.pseudonym(phone_number) if phone_number else "",
+            "x": mask_ussd_text(form.get("text", "")),
+        }
+        os.write(self._fd, (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+        self.captured += 1
+        return response
+
+
+def init_traffic_capture(app):
+    """Record USSD callbacks to USSD_CAPTURE_PATH when it is set."""
+    path = app.config.get("USSD_CAPTURE_PATH")
+    if not path:
+        return
+    middleware = UssdCaptureMiddleware(app.wsgi_app, path, app.config["SECRET_KEY"])
+    app.wsgi_app = middleware
+    app.extensions["traffic_capture"] = middleware
@@ -0,0 +1,89 @@
+"""Compare batched deposit ingestion against committing each confirmation on its own.
+
+Run from the repository root:
+
+    python -m benchmarks.deposit_ingest --deposits 5000 --members 500
+
+Both paths run against the same kind of SQLite database (in memory by
+default, or --database-url for a real server) seeded with synthetic members.
+"""
+import argparse
+import time
+from app import create_app, db
+from app.models import Tests, Accounts
+from app.services.deposit_ingest import ingest_batch
+
+
+def build_app(database_url):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "HASH_POOL_WORKERS": 0,
+        "LOG_LEVEL": "WARNING",
+    })
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed_members(app, count):
+    with app.app_context():
+        db.session.execute(db.insert(Tests), [
+            {"phone_number": f"07{index:08d}", "national_id": f"{10000000 + index}", "pin": "unused"}
+            for index in range(count)
+        ])
+        db.session.execute(db.insert(Accounts), [
+            {"user_id": index + 1, "wallet_balance": 0, "savings_balance": 0} for index in range(count)
+        ])
+        db.session.commit()
+
+
+def confirmations(count, members):
+    return [
+        {
+            "receipt": f"mpesa:R{index:010d}",
+            "phone_number": f"07{index % members:08d}",
+            "amount": float(100 + index % 50),
+            "destination": "sacco_wallet" if index % 3 else "savings",
+        }
+        for index in range(count)
+    ]
+
+
+def run_row_at_a_time(app, deposits):
+    with app.test_request_context():
+        start = time.perf_counter()
+        for deposit in deposits:
+            ingest_batch([dict(deposit)])
+        return time.perf_counter() - start
+
+
+def run_batched(app, deposits, batch_size):
+    with app.test_request_context():
+        start = time.perf_counter()
+        for offset in range(0, len(deposits), batch_size):
+            ingest_batch([dict(deposit) for deposit in deposits[offset:offset + batch_size]])
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deposits", type=int, default=5000)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--database-url", default="sqlite://")
+    args = parser.parse_args()
+
+    deposits = confirmations(args.deposits, args.members)
+    results = {}
+    for name, runner in (("row-at-a-time", run_row_at_a_time), ("batched", run_batched)):
+        app = build_app(args.database_url)
+        seed_members(app, args.members)
+        elapsed = runner(app, deposits) if runner is run_row_at_a_time else runner(app, deposits, args.batch_size)
+        results[name] = elapsed
+        print(f"{name:>14}: {args.deposits} deposits in {elapsed:.3f}s ({args.deposits / elapsed:,.0f}/s)")
+    print(f"{'speedup':>14}: {results['row-at-a-time'] / results['batched']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
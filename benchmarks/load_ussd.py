@@ -0,0 +1,302 @@
+"""Closed-loop load generator that emulates the USSD gateway against a running server.
+
+Start the server, then drive it from the repository root:
+
+    flask --app "app:create_app" run --port 5000 --with-threads
+    python -m benchmarks.load_ussd --url http://127.0.0.1:5000 --dialers 1000 \\
+        --arrival-rate 100 --think-time 2 --duration 120 \\
+        --mix login=4,deposit=2,withdrawal=2,mini_statement=2,pin_change=1,register=1
+
+Each virtual dialer waits for an arrival slot (--arrival-rate sessions per
+second across all dialers), picks a journey from the mix, and sends its hops
+as form-encoded POSTs to /api/ussd/callback with the growing text path and
+one sessionId, pausing for an exponentially distributed think time between
+hops. When a journey ends the dialer goes back for its next arrival slot, so
+at most --dialers sessions are in flight at once. No session starts after
+--duration, but sessions already in flight are played to the end.
+
+Every --report-interval seconds it prints throughput, hop latency
+percentiles, the error rate (transport failures and non-200 replies), the
+share of END screens and the session store size scraped from /api/metrics.
+--output writes the same series as JSON.
+
+Journeys log in as the synthetic members used by benchmarks.ussd_flows;
+--seed-database-url creates them in the server's database first. Give
+each dialer its own member (--members >= --dialers) when the mix includes
+pin_change, since the generator tracks PINs per dialer.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from urllib.parse import urlencode, urlsplit
+from app import db
+from app.models import Tests
+from benchmarks.ussd_flows import JOURNEYS, OTHER_PIN, PIN, build_app, member_phone, percentile, seed_members
+
+SESSION_ENTRIES = re.compile(rb"^session_store_entries\{[^}]*\} (\S+)$", re.MULTILINE)
+
+
+class HttpConnection:
+    """A keep-alive HTTP/1.1 connection that reconnects when the server closes it."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines.extend(f"{key}: {value}" for key, value in (headers or {}).items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await self.writer.drain()
+            head = await self.reader.readuntil(b"\r\n\r\n")
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            version, status = status_line.split(" ", 2)[:2]
+            response_headers = {}
+            for line in header_lines:
+                if line:
+                    key, _, value = line.partition(":")
+                    response_headers[key.strip().lower()] = value.strip()
+            if "content-length" in response_headers:
+                payload = await self.reader.readexactly(int(response_headers["content-length"]))
+            else:
+                payload = await self.reader.read()
+        except Exception:
+            self.close()
+            raise
+        keep_alive = version == "HTTP/1.1" and response_headers.get("connection", "").lower() != "close"
+        if not keep_alive or "content-length" not in response_headers:
+            self.close()
+        return int(status), payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class ArrivalGate:
+    """Spaces session starts evenly at a fixed rate across all dialers."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = time.monotonic()
+
+    async def wait(self, deadline):
+        """Wait for the next slot; returns False if it falls after the deadline."""
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        if slot >= deadline:
+            return False
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        return True
+
+
+class Recorder:
+    """Collects hop outcomes for the current report interval and for the whole run."""
+
+    def __init__(self):
+        self.interval = self._empty()
+        self.total = self._empty()
+        self.active = 0
+
+    @staticmethod
+    def _empty():
+        return {"latencies": [], "errors": 0, "ends": 0, "journeys": 0, "journey_failures": 0}
+
+    def hop(self, seconds, ok, end):
+        for bucket in (self.interval, self.total):
+            bucket["latencies"].append(seconds)
+            bucket["errors"] += not ok
+            bucket["ends"] += end
+
+    def journey(self, ok):
+        for bucket in (self.interval, self.total):
+            bucket["journeys"] += 1
+            bucket["journey_failures"] += not ok
+
+    def take_interval(self):
+        interval, self.interval = self.interval, self._empty()
+        return interval
+
+
+def summarize(bucket, seconds):
+    latencies = bucket["latencies"]
+    hops = len(latencies)
+    return {
+        "hops_per_second": round(hops / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "error_rate": round(bucket["errors"] / hops, 4) if hops else 0.0,
+        "end_rate": round(bucket["ends"] / hops, 4) if hops else 0.0,
+        "journeys": bucket["journeys"],
+        "journey_failures": bucket["journey_failures"],
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in JOURNEYS:
+            raise SystemExit(f"unknown journey '{name}', expected one of {', '.join(JOURNEYS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def dialer(dialer_id, args, gate, recorder, deadline, serials):
+    rng = random.Random(args.seed * 100003 + dialer_id)
+    names, weights = zip(*args.mix.items())
+    phone = member_phone(dialer_id % args.members)
+    pin = PIN
+    connection = HttpConnection(args.host, args.port)
+    journey_count = 0
+    try:
+        while True:
+            if not await gate.wait(deadline):
+                return
+            name = rng.choices(names, weights)[0]
+            texts, expected = JOURNEYS[name](phone, pin, next(serials))
+            journey_count += 1
+            session_id = f"load-{args.seed}-{dialer_id}-{journey_count}"
+            recorder.active += 1
+            body = ""
+            try:
+                for index, text in enumerate(texts):
+                    if index:
+                        await asyncio.sleep(rng.expovariate(1.0 / args.think_time) if args.think_time > 0 else 0)
+                    form = urlencode({
+                        "sessionId": session_id,
+                        "serviceCode": args.service_code,
+                        "phoneNumber": "+254" + phone[1:],
+                        "text": text,
+                    }).encode("ascii")
+                    start = time.perf_counter()
+                    try:
+                        status, payload = await connection.request("POST", "/api/ussd/callback", form, {
+                            "Content-Type": "application/x-www-form-urlencoded",
+                        })
+                    except (OSError, asyncio.IncompleteReadError, ValueError):
+                        recorder.hop(time.perf_counter() - start, False, False)
+                        body = ""
+                        break
+                    body = payload.decode("utf-8", "replace")
+                    recorder.hop(time.perf_counter() - start, status == 200, body.startswith("END"))
+                    if status != 200 or body.startswith("END"):
+                        break
+            finally:
+                recorder.active -= 1
+            ok = body.startswith(expected)
+            recorder.journey(ok)
+            if name == "pin_change" and ok:
+                pin = texts[-1].rsplit("*", 1)[1]
+            elif body.startswith("END Invalid PIN"):
+                # an earlier run against the same database may have left the other PIN set
+                pin = OTHER_PIN if pin == PIN else PIN
+    finally:
+        connection.close()
+
+
+async def session_entries(args):
+    connection = HttpConnection(args.host, args.port)
+    headers = {"Connection": "close"}
+    if args.metrics_key:
+        headers["X-API-Key"] = args.metrics_key
+    try:
+        status, payload = await connection.request("GET", "/api/metrics", headers=headers)
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        return None
+    finally:
+        connection.close()
+    match = SESSION_ENTRIES.search(payload) if status == 200 else None
+    return int(float(match.group(1))) if match else None
+
+
+async def reporter(args, recorder, started, deadline, series):
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(min(args.report_interval, max(deadline - time.monotonic(), 0) + 0.01))
+        now = time.monotonic()
+        point = summarize(recorder.take_interval(), now - last)
+        point["elapsed"] = round(now - started, 1)
+        point["active_sessions"] = recorder.active
+        point["session_store_entries"] = await session_entries(args)
+        series.append(point)
+        last = now
+        print(
+            f"{point['elapsed']:7.1f}s {point['hops_per_second']:8.1f} hops/s "
+            f"p50/p95/p99 {point['p50_ms']:.1f}/{point['p95_ms']:.1f}/{point['p99_ms']:.1f} ms "
+            f"errors {point['error_rate']:.2%} END {point['end_rate']:.2%} "
+            f"active {point['active_sessions']} store {point['session_store_entries']}"
+        )
+        if now >= deadline:
+            return
+
+
+async def run(args):
+    gate = ArrivalGate(args.arrival_rate)
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    serials = iter(range(random.Random(args.seed).randrange(500000), 10 ** 6))
+    series = []
+    report = asyncio.create_task(reporter(args, recorder, started, deadline, series))
+    await asyncio.gather(*(dialer(index, args, gate, recorder, deadline, serials) for index in range(args.dialers)))
+    await report
+    total = summarize(recorder.total, time.monotonic() - started)
+    return total, series
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--dialers", type=int, default=200, help="virtual dialers, i.e. the most concurrent sessions")
+    parser.add_argument("--arrival-rate", type=float, default=20.0, help="new sessions per second; 0 for no limit")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between hops of a session")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--mix", default="login=4,deposit=2,withdrawal=2,mini_statement=2,pin_change=1,register=1")
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--service-code", default="*384#")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--metrics-key", help="X-API-Key for /api/metrics when METRICS_API_KEY is set")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seed-database-url", help="create the synthetic members in this database first")
+    parser.add_argument("--pin-hash-method", default="scrypt", help="hash method for seeded PINs")
+    parser.add_argument("--output", help="write the summary and interval series as JSON")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    args.host, args.port = url.hostname, url.port or 80
+    args.mix = parse_mix(args.mix)
+    if args.seed_database_url:
+        app = build_app(args.pin_hash_method, args.seed_database_url)
+        with app.app_context():
+            seeded = db.session.scalar(db.select(db.func.count()).select_from(Tests))
+        if not seeded:
+            seed_members(app, args.members)
+
+    total, series = asyncio.run(run(args))
+    print(
+        f"  total: {total['hops_per_second']:.1f} hops/s, "
+        f"p50/p95/p99 {total['p50_ms']:.1f}/{total['p95_ms']:.1f}/{total['p99_ms']:.1f} ms, "
+        f"errors {total['error_rate']:.2%}, END {total['end_rate']:.2%}, "
+        f"{total['journeys']} journeys ({total['journey_failures']} did not reach their final screen)"
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({"summary": total, "intervals": series}, output, indent=2)
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
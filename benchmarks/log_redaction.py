@@ -0,0 +1,126 @@
+"""Measure log redaction throughput and check that no sensitive digits leak.
+
+Run from the repository root:
+
+    python -m benchmarks.log_redaction --records 100000
+
+Compares the old masking formatter (eager f-strings, three re.sub passes)
+with the RedactingFormatter (lazy %-style arguments, one combined pattern)
+on the redaction pass alone, for records that are emitted and for records
+dropped by the level check, then scans every emitted line for the raw
+phone numbers, IDs and PINs.
+"""
+import argparse
+import io
+import logging
+import random
+import re
+import time
+from app.helpers.redaction import RedactingFormatter, mask_sensitive_info, redact
+
+FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def legacy_sanitize(message):
+    message = re.sub(r"phone_number='(\d{10,})'", lambda m: f"phone_number='{mask_sensitive_info(m.group(1))}'", message)
+    message = re.sub(r"national_id='(\d+)'", lambda m: f"national_id='{mask_sensitive_info(m.group(1))}'", message)
+    message = re.sub(r"pin='(\d+)'", lambda m: "pin='****'", message)
+    return message
+
+
+class LegacyFormatter(logging.Formatter):
+    def format(self, record):
+        record.msg = legacy_sanitize(str(record.msg))
+        return super().format(record)
+
+
+def make_members(count):
+    rng = random.Random(7)
+    return [
+        (f"07{rng.randrange(10**8):08d}", f"{rng.randrange(10**7, 10**8)}", f"{rng.randrange(10**4):04d}")
+        for _ in range(count)
+    ]
+
+
+def build_logger(name, formatter, level):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(formatter)
+    logger = logging.getLogger(f"benchmarks.{name}")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger, stream
+
+
+def run_legacy(logger, members):
+    start = time.perf_counter()
+    for phone, national_id, pin in members:
+        logger.info(f"Registering user: phone_number='{phone}', national_id='{national_id}'")
+        logger.info(f"Verifying PIN for phone_number='{phone}' pin='{pin}'")
+        logger.info(f"Deposit of 100.0 to sacco_wallet for phone_number='{phone}'")
+    return time.perf_counter() - start
+
+
+def run_redacting(logger, members):
+    start = time.perf_counter()
+    for phone, national_id, pin in members:
+        logger.info("Registering user: phone_number='%s', national_id='%s'", phone, national_id)
+        logger.info("Verifying PIN for phone_number='%s' pin='%s'", phone, pin)
+        logger.info("Deposit of %s to %s", 100.0, "sacco_wallet", extra={"phone_number": phone})
+    return time.perf_counter() - start
+
+
+def time_scans(sanitize, messages):
+    start = time.perf_counter()
+    for message in messages:
+        sanitize(message)
+    return time.perf_counter() - start
+
+
+def leaks(output, members):
+    digits = set(re.findall(r"\d+", output))
+    pins = set(re.findall(r"pin='(\d+)'", output))
+    found = 0
+    for phone, national_id, pin in members:
+        found += phone in digits
+        found += national_id in digits
+        found += pin in pins
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100000)
+    args = parser.parse_args()
+    members = make_members(args.records // 3)
+    lines = len(members) * 3
+
+    messages = [
+        message
+        for phone, national_id, pin in members
+        for message in (
+            f"Registering user: phone_number='{phone}', national_id='{national_id}'",
+            f"Verifying PIN for phone_number='{phone}' pin='{pin}'",
+            "Session ID: 'ATUid_5f1c2e', Current Menu: 'logged_in'",
+        )
+    ]
+
+    for label, formatter, run, sanitize in (
+        ("legacy", LegacyFormatter(FORMAT), run_legacy, legacy_sanitize),
+        ("redacting", RedactingFormatter(FORMAT), run_redacting, redact),
+    ):
+        scan = time_scans(sanitize, messages)
+        logger, stream = build_logger(label, formatter, logging.INFO)
+        emitted = run(logger, members)
+        dropped_logger, _ = build_logger(f"{label}.dropped", formatter, logging.WARNING)
+        dropped = run(dropped_logger, members)
+        print(
+            f"{label:>9}: {scan / len(messages) * 1e6:5.2f} us/message scan, "
+            f"{lines / emitted:8,.0f} records/s emitted, "
+            f"{lines / dropped:10,.0f} records/s dropped, "
+            f"{leaks(stream.getvalue(), members)} leaked values"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Replay a captured USSD traffic file against a test instance, keeping its timing.
+
+Capture on the instance whose traffic you want, then replay on a test server:
+
+    USSD_CAPTURE_PATH=/var/tmp/ussd.ndjson flask --app "app:create_app" run
+    python -m benchmarks.replay_capture /var/tmp/ussd.ndjson --url http://127.0.0.1:5000 \\
+        --speed 10 --seed-database-url sqlite:////tmp/replay.db
+
+Each hop is sent at its original offset from the first captured hop divided
+by --speed (1x to 50x), so bursts and idle gaps keep their shape; --start and
+--end cut a window, e.g. around a peak-hour incident, in seconds from the
+start of the capture. Hops of one session go out in order on one connection.
+
+The capture holds no phone numbers or PINs, so masked values are filled in
+with the synthetic members of benchmarks.ussd_flows: each captured caller
+(by pseudonym) becomes one member and "****" segments become that member's
+PIN. A masked phone segment becomes the member's phone when its visible
+digits match the caller's, e.g. a withdrawal to one's own number, and an
+unused phone otherwise, as in a registration; masked IDs get fresh IDs.
+Input that was not masked, such as stray "*" segments, retries and menu
+choices, is replayed as captured.
+
+It reports how far sends lagged their schedule, latency percentiles, and how
+many replies had a different status than in production.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+from app import db
+from app.models import Tests
+from benchmarks.load_ussd import HttpConnection
+from benchmarks.ussd_flows import PIN, build_app, member_phone, percentile, seed_members
+
+
+def load_capture(path, start=0.0, end=None):
+    """Read capture records in arrival order, keeping those between start and end seconds."""
+    with open(path, encoding="utf-8") as capture:
+        records = [json.loads(line) for line in capture if line.strip()]
+    records.sort(key=lambda record: record["t"])
+    if not records:
+        return []
+    first = records[0]["t"]
+    return [
+        record for record in records
+        if record["t"] - first >= start and (end is None or record["t"] - first <= end)
+    ]
+
+
+class Substitutions:
+    """Consistent synthetic values for the masked fields of a capture."""
+
+    def __init__(self, members, pin=PIN):
+        self.members = members
+        self.pin = pin
+        self.callers = {}
+        self.fresh = {}
+
+    def phone(self, record):
+        caller = record.get("u") or record.get("p") or record["sid"]
+        index = self.callers.setdefault(caller, len(self.callers) % self.members)
+        return member_phone(index)
+
+    def fresh_value(self, record, masked, base):
+        # the same masked value within one session maps to the same replacement
+        return self.fresh.setdefault((record["sid"], masked), f"{base + len(self.fresh)}")
+
+    def text(self, record, phone):
+        segments = []
+        for segment in record["x"]:
+            if segment == "****":
+                segment = self.pin
+            elif "*" in segment:
+                # masked phone numbers keep their prefix, IDs are plain digits
+                if segment.startswith(("0", "+")) and len(segment) >= 10:
+                    if segment[-2:] == record.get("p", "")[-2:]:
+                        segment = phone
+                    else:
+                        segment = "0" + self.fresh_value(record, segment, 798000000)
+                else:
+                    segment = self.fresh_value(record, segment, 40000000)
+            segments.append(segment)
+        return "*".join(segments)
+
+
+async def replay_session(args, hops, started, results):
+    connection = HttpConnection(args.host, args.port)
+    try:
+        for offset, record, form in hops:
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            results["lag"].append(max(-delay, 0.0))
+            request_start = time.perf_counter()
+            try:
+                status, payload = await connection.request("POST", "/api/ussd/callback", form, {
+                    "Content-Type": "application/x-www-form-urlencoded",
+                })
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                results["errors"] += 1
+                continue
+            results["latencies"].append(time.perf_counter() - request_start)
+            results["statuses"][status] += 1
+            results["status_mismatches"] += status != record["s"]
+            results["ends"] += payload.startswith(b"END")
+    finally:
+        connection.close()
+
+
+async def run(args, records):
+    substitutions = Substitutions(args.members)
+    first = records[0]["t"]
+    sessions = {}
+    for record in records:
+        phone = substitutions.phone(record)
+        form = urlencode({
+            "sessionId": f"replay-{args.run_id}-{record['sid']}",
+            "serviceCode": record["sc"],
+            "phoneNumber": "+254" + phone[1:],
+            "text": substitutions.text(record, phone),
+        }).encode("ascii")
+        offset = (record["t"] - first) / args.speed
+        sessions.setdefault(record["sid"], []).append((offset, record, form))
+
+    results = {"lag": [], "latencies": [], "errors": 0, "statuses": Counter(), "status_mismatches": 0, "ends": 0}
+    started = time.monotonic()
+    await asyncio.gather(*(replay_session(args, hops, started, results) for hops in sessions.values()))
+    elapsed = time.monotonic() - started
+    return {
+        "hops": len(records),
+        "sessions": len(sessions),
+        "callers": len(substitutions.callers),
+        "seconds": round(elapsed, 2),
+        "captured_seconds": round(records[-1]["t"] - first, 2),
+        "lag_p99_ms": round(percentile(results["lag"], 0.99) * 1000, 2),
+        "p50_ms": round(percentile(results["latencies"], 0.5) * 1000, 2),
+        "p95_ms": round(percentile(results["latencies"], 0.95) * 1000, 2),
+        "p99_ms": round(percentile(results["latencies"], 0.99) * 1000, 2),
+        "captured_p99_ms": round(percentile([record["d"] for record in records], 0.99), 2),
+        "errors": results["errors"],
+        "statuses": dict(results["statuses"]),
+        "status_mismatches": results["status_mismatches"],
+        "ends": results["ends"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="NDJSON file written by USSD_CAPTURE_PATH")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 to 50 times the captured rate")
+    parser.add_argument("--start", type=float, default=0.0, help="skip hops before this many seconds into the capture")
+    parser.add_argument("--end", type=float, help="stop at this many seconds into the capture")
+    parser.add_argument("--members", type=int, default=1000, help="synthetic members the callers are mapped onto")
+    parser.add_argument("--run-id", default=str(int(time.time())), help="prefix for replayed session ids")
+    parser.add_argument("--seed-database-url", help="create the synthetic members in this database first")
+    parser.add_argument("--pin-hash-method", default="scrypt", help="hash method for seeded PINs")
+    parser.add_argument("--output", help="write the summary as JSON")
+    args = parser.parse_args()
+
+    if not 1 <= args.speed <= 50:
+        raise SystemExit("--speed must be between 1 and 50")
+    url = urlsplit(args.url)
+    args.host, args.port = url.hostname, url.port or 80
+    records = load_capture(args.capture, args.start, args.end)
+    if not records:
+        raise SystemExit(f"no captured hops in {args.capture} for that window")
+    if args.seed_database_url:
+        app = build_app(args.pin_hash_method, args.seed_database_url)
+        with app.app_context():
+            seeded = db.session.scalar(db.select(db.func.count()).select_from(Tests))
+        if not seeded:
+            seed_members(app, args.members)
+
+    summary = asyncio.run(run(args, records))
+    print(
+        f"replayed {summary['hops']} hops from {summary['sessions']} sessions ({summary['callers']} callers) "
+        f"in {summary['seconds']:.1f}s, captured over {summary['captured_seconds']:.1f}s at {args.speed:g}x\n"
+        f"  schedule lag p99 {summary['lag_p99_ms']:.1f} ms, "
+        f"p50/p95/p99 {summary['p50_ms']:.1f}/{summary['p95_ms']:.1f}/{summary['p99_ms']:.1f} ms "
+        f"(captured p99 {summary['captured_p99_ms']:.1f} ms)\n"
+        f"  statuses {summary['statuses']}, {summary['status_mismatches']} differ from the capture, "
+        f"{summary['errors']} transport errors, {summary['ends']} END screens"
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(summary, output, indent=2)
+            output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measure static USSD screens with and without pre-encoded responses.
+
+Run from the repository root:
+
+    python -m benchmarks.static_responses --requests 20000
+
+Reports the cost of building a static response in isolation and the
+requests/sec of main-menu hops through the full callback route.
+"""
+import argparse
+import time
+from app import create_app
+
+
+def build_app(static_cache):
+    return create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "HASH_POOL_WORKERS": 0,
+        "LOG_LEVEL": "WARNING",
+        "STATIC_RESPONSE_CACHE": static_cache,
+    })
+
+
+def time_response_builds(app, count):
+    from app.helpers.utils import ussd_response
+    from app.services.logic import MENU_TEXT
+    message = MENU_TEXT["faqs"]
+    with app.test_request_context():
+        start = time.perf_counter()
+        for _ in range(count):
+            ussd_response(message)
+        return time.perf_counter() - start
+
+
+def time_static_hops(app, count):
+    client = app.test_client()
+    start = time.perf_counter()
+    for index in range(count):
+        client.post("/api/ussd/callback", data={
+            "sessionId": f"bench-{index}",
+            "serviceCode": "*384#",
+            "phoneNumber": "+254712345678",
+            "text": "",
+        })
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    for label, static_cache in (("before", False), ("after", True)):
+        app = build_app(static_cache)
+        builds = time_response_builds(app, args.requests)
+        hops = time_static_hops(app, args.requests)
+        print(
+            f"{label:>6}: {builds / args.requests * 1e6:6.2f} us/response build, "
+            f"{args.requests / hops:8,.0f} static hops/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
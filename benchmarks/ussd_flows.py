@@ -0,0 +1,260 @@
+"""Replay scripted USSD journeys through the callback route and record a baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.ussd_flows --iterations 50
+    python -m benchmarks.ussd_flows --compare benchmarks/ussd_flows_baseline.json
+
+Builds the app against an in-memory SQLite database, seeds synthetic members
+and replays deterministic journeys (registration, login, withdrawals,
+deposits, PIN change, mini statement) through the Flask test client, the
+way the gateway sends them: one POST per hop with the growing text path.
+
+For every journey it reports journey and hop latency percentiles, SQL
+statements per hop and the peak memory allocated per journey (tracemalloc,
+measured in a separate pass so tracing does not skew the timings). Results
+are written as JSON so a change in queries or latency shows up as a diff.
+
+PINs are hashed with a cheap method by default (--pin-hash-method) so the
+timings show the request path rather than the cost of scrypt.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from app import create_app, db
+from app.models import Tests, Accounts
+from app.services.hashing import hash_password
+
+PIN = "1234"
+OTHER_PIN = "4321"
+START_BALANCE = 1_000_000
+
+
+def build_app(pin_hash_method, database_url="sqlite://"):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_url,
+        "HASH_POOL_WORKERS": 0,
+        "LOG_LEVEL": "WARNING",
+        "PIN_HASH_METHOD": pin_hash_method,
+        "PIN_MAX_ATTEMPTS": 1_000_000,
+        # a single process, so the in-memory member and statement caches stay coherent
+        "MEMBER_CACHE": "1",
+        "STATEMENT_CACHE": "1",
+    })
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed_members(app, count):
+    with app.app_context():
+        pin_hash = hash_password(PIN)
+        db.session.execute(db.insert(Tests), [
+            {"phone_number": member_phone(index), "national_id": f"{20000000 + index}", "pin": pin_hash}
+            for index in range(count)
+        ])
+        db.session.execute(db.insert(Accounts), [
+            {"user_id": index + 1, "wallet_balance": START_BALANCE, "savings_balance": START_BALANCE}
+            for index in range(count)
+        ])
+        db.session.commit()
+
+
+def member_phone(index):
+    return f"0711{index:06d}"
+
+
+def hops(*steps):
+    """Expand journey steps into the cumulative text the gateway sends on each hop."""
+    texts = [""]
+    path = []
+    for step in steps:
+        path.append(step)
+        texts.append("*".join(path))
+    return texts
+
+
+# each journey returns the texts for a member's phone and current PIN, and the expected
+# start(s) of the final screen; serial is unique per replayed journey
+def journey_register(phone, pin, serial):
+    return ["", f"2*0799{serial:06d}*{30000000 + serial}*{PIN}"], "END User registered"
+
+
+def journey_login(phone, pin, serial):
+    return hops("1", pin, "0"), "END Thank you"
+
+
+def journey_withdrawal(phone, pin, serial):
+    return hops("1", pin, "1", "1", "100", pin), "END Withdrawal successful"
+
+
+def journey_mobile_withdrawal(phone, pin, serial):
+    return hops("1", pin, "1", "2", "1", phone, "50", pin), "END Withdrawal successful"
+
+
+def journey_deposit(phone, pin, serial):
+    return hops("1", pin, "2", "1", "1", "1", phone, "50"), "END Complete the KES 50.0 payment"
+
+
+def journey_pin_change(phone, pin, serial):
+    new_pin = OTHER_PIN if pin == PIN else PIN
+    return hops("1", pin, "3", "1", pin, new_pin, new_pin), "END PIN changed"
+
+
+def journey_mini_statement(phone, pin, serial):
+    # members with more than a page of transactions get a CON screen offering the next page
+    return hops("1", pin, "5", "1", pin), ("END Last", "CON Last", "END No recent transactions")
+
+
+JOURNEYS = {
+    "register": journey_register,
+    "login": journey_login,
+    "withdrawal": journey_withdrawal,
+    "mobile_withdrawal": journey_mobile_withdrawal,
+    "deposit": journey_deposit,
+    "pin_change": journey_pin_change,
+    "mini_statement": journey_mini_statement,
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Runner:
+    """Replays journeys against one app, tracking each member's current PIN."""
+
+    def __init__(self, app, members):
+        self.app = app
+        self.client = app.test_client()
+        self.members = members
+        self.pins = {}
+        self.sessions = 0
+
+    def run(self, name, iteration):
+        index = iteration % self.members
+        phone = member_phone(index)
+        pin = self.pins.get(phone, PIN)
+        self.sessions += 1
+        texts, expected = JOURNEYS[name](phone, pin, self.sessions)
+        session_id = f"bench-{name}-{self.sessions}"
+
+        stats = self.app.extensions["query_stats"]
+        hop_seconds, hop_queries = [], []
+        body = ""
+        for text in texts:
+            queries = stats["queries"]
+            start = time.perf_counter()
+            response = self.client.post("/api/ussd/callback", data={
+                "sessionId": session_id,
+                "serviceCode": "*384#",
+                "phoneNumber": "+254" + phone[1:],
+                "text": text,
+            })
+            hop_seconds.append(time.perf_counter() - start)
+            hop_queries.append(stats["queries"] - queries)
+            body = response.get_data(as_text=True)
+
+        if name == "pin_change" and body.startswith(expected):
+            self.pins[phone] = texts[-1].rsplit("*", 1)[1]
+        return hop_seconds, hop_queries, body.startswith(expected)
+
+
+def measure(runner, name, iterations):
+    journeys, hop_times, queries = [], [], []
+    failures = 0
+    for iteration in range(iterations):
+        hop_seconds, hop_queries, ok = runner.run(name, iteration)
+        journeys.append(sum(hop_seconds))
+        hop_times.extend(hop_seconds)
+        queries.extend(hop_queries)
+        failures += not ok
+    return {
+        "journeys": iterations,
+        "hops_per_journey": len(hop_times) // iterations,
+        "failures": failures,
+        "journey_ms": {key: round(percentile(journeys, q) * 1000, 3) for key, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "hop_ms": {key: round(percentile(hop_times, q) * 1000, 3) for key, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "queries_per_hop": round(sum(queries) / len(queries), 3),
+        "queries_per_journey": round(sum(queries) / iterations, 3),
+    }
+
+
+def measure_allocations(runner, name, iterations):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for iteration in range(iterations):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            runner.run(name, iteration)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return round(percentile(peaks, 0.5) / 1024, 1)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)["journeys"]
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:>18}: not in baseline")
+            continue
+        query_delta = result["queries_per_journey"] - before["queries_per_journey"]
+        p95_before = before["hop_ms"]["p95"]
+        p95_change = (result["hop_ms"]["p95"] - p95_before) / p95_before * 100 if p95_before else 0.0
+        print(f"{name:>18}: queries/journey {query_delta:+.2f}, hop p95 {p95_change:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--journeys", default=",".join(JOURNEYS), help="comma separated journey names")
+    parser.add_argument("--pin-hash-method", default="pbkdf2:sha256:1000")
+    parser.add_argument("--output", default="benchmarks/ussd_flows_baseline.json")
+    parser.add_argument("--compare", help="print the change against an earlier baseline instead of overwriting it")
+    args = parser.parse_args()
+
+    app = build_app(args.pin_hash_method)
+    seed_members(app, args.members)
+    runner = Runner(app, args.members)
+
+    results = {}
+    for name in args.journeys.split(","):
+        # one untimed pass warms the caches and the compiled statements
+        runner.run(name, args.iterations)
+        results[name] = measure(runner, name, args.iterations)
+        results[name]["peak_alloc_kib"] = measure_allocations(runner, name, min(args.iterations, 20))
+        result = results[name]
+        print(
+            f"{name:>18}: {result['hops_per_journey']:2d} hops, "
+            f"journey p50/p95/p99 {result['journey_ms']['p50']:.2f}/{result['journey_ms']['p95']:.2f}/{result['journey_ms']['p99']:.2f} ms, "
+            f"hop p95 {result['hop_ms']['p95']:.2f} ms, "
+            f"{result['queries_per_hop']:.2f} queries/hop, "
+            f"{result['peak_alloc_kib']:.0f} KiB peak, "
+            f"{result['failures']} failed"
+        )
+
+    if args.compare:
+        compare(results, args.compare)
+        return
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump({
+            "iterations": args.iterations,
+            "members": args.members,
+            "pin_hash_method": args.pin_hash_method,
+            "journeys": results,
+        }, output, indent=2, sort_keys=True)
+        output.write("\n")
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import pytest
+from app import create_app, db
+from app.models import Tests, Accounts
+from app.services.hashing import hash_password
+
+PIN = "1234"
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build apps on a file-backed SQLite database, with config overrides; they are shut down after the test."""
+    apps = []
+
+    def make(**config):
+        app = create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'sacco.db'}",
+            "HASH_POOL_WORKERS": 0,
+            "PIN_HASH_METHOD": "pbkdf2:sha256:1000",
+            "LOG_LEVEL": "WARNING",
+            **config,
+        })
+        with app.app_context():
+            db.create_all()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        app.extensions["deposit_batcher"].stop()
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        # the log listener writes to pytest's captured stderr, which is closed before atexit runs
+        app.extensions["logging"].stop()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def add_member(app, phone_number, wallet_balance=0, savings_balance=0):
+    """Insert a member with an account and return its id."""
+    with app.app_context():
+        member = Tests(phone_number=phone_number, national_id=phone_number[2:], pin=hash_password(PIN))
+        member.account = Accounts(wallet_balance=wallet_balance, savings_balance=savings_balance)
+        db.session.add(member)
+        db.session.commit()
+        return member.id
@@ -0,0 +1,29 @@
+import os
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+from app.services.db_pool import dispose_after_fork
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_workers_do_not_reuse_the_parents_connections(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    dispose_after_fork(engine)
+    assert engine.pool.checkedin() == 1
+
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_end, str(engine.pool.checkedin()).encode())
+        os._exit(0)
+    os.close(write_end)
+    os.waitpid(pid, 0)
+    child_checked_in = int(os.read(read_end, 16))
+    os.close(read_end)
+
+    assert child_checked_in == 0
+    # the parent keeps its own pooled connection
+    assert engine.pool.checkedin() == 1
+    engine.dispose()
@@ -0,0 +1,96 @@
+import pytest
+from app import db
+from app.models import Accounts, Transactions
+from app.services.deposit_ingest import ingest_batch, validate_confirmation
+from tests.conftest import add_member
+
+PHONE = "0711000009"
+TOKEN = "callback-token"
+MAX_AMOUNT = 250000
+
+
+@pytest.fixture
+def payments_app(make_app):
+    app = make_app(PAYMENT_CALLBACK_TOKEN=TOKEN)
+    add_member(app, PHONE)
+    return app
+
+
+def confirm(app, payload):
+    response = app.test_client().post("/api/payments/confirmations", json=payload, headers={"X-Callback-Token": TOKEN})
+    return response.status_code, response.get_json()["results"]
+
+
+def confirmation(receipt, amount=100, **fields):
+    return {"receipt": receipt, "provider": "mpesa", "phone_number": PHONE, "amount": amount, **fields}
+
+
+def wallet_balance(app):
+    with app.app_context():
+        return db.session.scalar(db.select(Accounts.wallet_balance))
+
+
+@pytest.mark.parametrize("payload, error", [
+    (confirmation(["QK1"]), "Invalid receipt."),
+    (confirmation("QK1", provider={"name": "mpesa"}), "Invalid provider."),
+    (confirmation("QK1", phone_number=254711000009), "Invalid phone_number."),
+    (confirmation("QK1", destination=["savings"]), "Invalid destination."),
+    (confirmation("QK1", destination={"savings": 1}), "Invalid destination."),
+    (confirmation("QK1", destination="loans"), "Invalid destination."),
+    (confirmation("Q" * 59), "Missing or invalid receipt."),
+    (confirmation("  "), "Missing or invalid receipt."),
+    (confirmation("QK1", provider="paypal"), "Unknown provider."),
+    (confirmation("QK1", amount=True), "Invalid amount."),
+    (confirmation("QK1", amount="nan"), "Invalid amount."),
+    (confirmation("QK1", amount=0), "Invalid amount."),
+    (confirmation("QK1", amount=MAX_AMOUNT + 1), "Invalid amount."),
+])
+def test_invalid_confirmations_are_rejected(payload, error):
+    assert validate_confirmation(payload, MAX_AMOUNT) == (None, error)
+
+
+def test_longest_receipt_fits_the_column():
+    deposit, error = validate_confirmation(confirmation("Q" * 58), MAX_AMOUNT)
+    assert error is None
+    assert len(deposit["receipt"]) == Transactions.provider_receipt.type.length
+
+
+def test_bad_items_are_rejected_without_failing_the_request(payments_app):
+    status, results = confirm(payments_app, [
+        confirmation("QK1", destination=["savings"]),
+        confirmation("QK2"),
+        "not an object",
+    ])
+    assert status == 200
+    assert [result["status"] for result in results] == ["rejected", "accepted", "rejected"]
+    assert wallet_balance(payments_app) == 100
+
+
+def test_repeated_receipts_are_credited_once(payments_app):
+    status, results = confirm(payments_app, [confirmation("QK1"), confirmation("QK1")])
+    assert status == 200
+    assert [result["status"] for result in results] == ["accepted", "duplicate"]
+
+    status, results = confirm(payments_app, confirmation("QK1"))
+    assert status == 200
+    assert [result["status"] for result in results] == ["duplicate"]
+
+    assert wallet_balance(payments_app) == 100
+    with payments_app.app_context():
+        assert db.session.scalar(db.select(db.func.count(Transactions.id))) == 1
+
+
+def test_unknown_members_are_reported_per_item(payments_app):
+    status, results = confirm(payments_app, [confirmation("QK1"), confirmation("QK2", phone_number="0799999999")])
+    assert status == 200
+    assert [result["status"] for result in results] == ["accepted", "unknown_member"]
+
+
+def test_a_failing_row_does_not_fail_its_batch(payments_app):
+    good, _ = validate_confirmation(confirmation("QK1"), MAX_AMOUNT)
+    bad, _ = validate_confirmation(confirmation("QK2"), MAX_AMOUNT)
+    # a NULL amount breaks the insert for this row only
+    bad["amount"] = None
+    with payments_app.app_context():
+        assert ingest_batch([good, bad]) == ["accepted", "error"]
+    assert wallet_balance(payments_app) == 100
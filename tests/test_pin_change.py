@@ -0,0 +1,66 @@
+import pytest
+from app import db
+from app.helpers import utils
+from app.services.hashing import HashingOverloaded
+from benchmarks.ussd_flows import OTHER_PIN, hops
+from tests.conftest import PIN, add_member
+
+PHONE = "0711000008"
+
+
+def run_journey(app, session_id, *steps):
+    client = app.test_client()
+    for text in hops(*steps):
+        response = client.post("/api/ussd/callback", data={"sessionId": session_id, "serviceCode": "*384#", "phoneNumber": PHONE, "text": text})
+    return response.get_data(as_text=True)
+
+
+def change_pin(app, session_id):
+    return run_journey(app, session_id, "1", PIN, "3", "1", PIN, OTHER_PIN, OTHER_PIN)
+
+
+def test_pin_change_takes_effect(app):
+    add_member(app, PHONE)
+    assert change_pin(app, "change") == "END PIN changed successfully!"
+    assert run_journey(app, "login-new", "1", OTHER_PIN, "0").startswith("END Thank you")
+
+
+def test_busy_hashing_pool_does_not_report_a_changed_pin(app, monkeypatch):
+    add_member(app, PHONE)
+    real_hash_password = utils.hash_password
+
+    def overloaded(password):
+        if password == OTHER_PIN:
+            raise HashingOverloaded("queue full")
+        return real_hash_password(password)
+
+    monkeypatch.setattr(utils, "hash_password", overloaded)
+    assert change_pin(app, "busy") == "END Service is busy. Please try again shortly."
+    assert run_journey(app, "login-old", "1", PIN, "0").startswith("END Thank you")
+
+
+def test_failed_commit_does_not_report_a_changed_pin(app, monkeypatch):
+    add_member(app, PHONE)
+
+    def fail_commit():
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(db.session, "commit", fail_commit)
+    assert change_pin(app, "failed") == "END Could not change your PIN. Please try again later."
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_pin_change_reaches_other_workers(make_app, tmp_path, backend):
+    config = {"SESSION_BACKEND": backend, "SESSION_SQLITE_PATH": str(tmp_path / "sessions.db")}
+    worker_a, worker_b = make_app(**config), make_app(**config)
+    add_member(worker_a, PHONE)
+
+    # worker B logs the member in, then worker A changes the PIN
+    assert run_journey(worker_b, "session-b", "1", PIN).startswith("CON Choose an option")
+    assert change_pin(worker_a, "session-a") == "END PIN changed successfully!"
+
+    # the old PIN no longer authorises anything on worker B
+    client = worker_b.test_client()
+    for text in hops("1", PIN, "5", "1", PIN)[3:]:
+        response = client.post("/api/ussd/callback", data={"sessionId": "session-b", "serviceCode": "*384#", "phoneNumber": PHONE, "text": text})
+    assert response.get_data(as_text=True) == "END Incorrect PIN. Please try again."
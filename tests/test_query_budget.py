@@ -0,0 +1,47 @@
+import pytest
+from app import db, models
+from app.services.query_counter import QueryBudgetExceeded
+from benchmarks.ussd_flows import JOURNEYS
+from tests.conftest import PIN, add_member
+
+PHONE = "0711000006"
+
+
+@pytest.mark.parametrize("journey", sorted(JOURNEYS))
+def test_ussd_journeys_stay_within_budget(app, journey):
+    add_member(app, PHONE, wallet_balance=1000, savings_balance=1000)
+    texts, expected = JOURNEYS[journey](PHONE, PIN, 1)
+    client = app.test_client()
+
+    # under TESTING a hop over its budget, or repeating a statement, raises out of the request
+    for text in texts:
+        response = client.post("/api/ussd/callback", data={"sessionId": f"budget-{journey}", "serviceCode": "*384#", "phoneNumber": PHONE, "text": text})
+    assert response.get_data(as_text=True).startswith(expected)
+
+
+def test_repeated_lookups_fail_the_request(app):
+    add_member(app, PHONE)
+
+    @app.route("/repeated-lookups")
+    def repeated_lookups():
+        for _ in range(5):
+            models.Tests.query.filter_by(phone_number=PHONE).first()
+        return "ok"
+
+    with pytest.raises(QueryBudgetExceeded, match="repeated a statement 5 times"):
+        app.test_client().get("/repeated-lookups")
+
+
+def test_route_over_its_budget_fails_the_request(make_app):
+    app = make_app(QUERY_BUDGETS="many_lookups:2")
+    add_member(app, PHONE)
+
+    @app.route("/many-lookups")
+    def many_lookups():
+        db.session.scalar(db.select(models.Tests.id).where(models.Tests.phone_number == PHONE))
+        db.session.scalar(db.select(models.Accounts.id).where(models.Accounts.user_id == 1))
+        db.session.scalar(db.select(models.Transactions.id).where(models.Transactions.user_id == 1))
+        return "ok"
+
+    with pytest.raises(QueryBudgetExceeded, match="issued 3 queries, over its budget of 2"):
+        app.test_client().get("/many-lookups")
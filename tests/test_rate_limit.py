@@ -0,0 +1,42 @@
+from datetime import datetime
+import pytest
+from app import db
+from app.services.rate_limit import PinAttemptLimiter
+
+PHONE = "0711000004"
+
+
+@pytest.fixture
+def limiter():
+    return PinAttemptLimiter(max_attempts=3, window=300)
+
+
+def test_failures_block_after_the_limit(limiter):
+    limiter.seed(PHONE, 0, None)
+    for _ in range(3):
+        limiter.record_failure(PHONE, "session-1")
+    assert limiter.is_blocked(PHONE)
+    assert limiter.is_blocked("0711000005", "session-1")
+
+
+def test_seed_replays_persisted_failures(limiter):
+    limiter.seed(PHONE, 2, datetime.utcnow())
+    limiter.record_failure(PHONE)
+    assert limiter.is_blocked(PHONE)
+
+
+def test_unflushed_reset_is_not_overwritten_by_a_stale_seed(app, limiter, monkeypatch):
+    limiter.seed(PHONE, 2, datetime.utcnow())
+    limiter.record_success(PHONE)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    with app.app_context():
+        monkeypatch.setattr(db.session, "execute", fail)
+        assert limiter.flush() == 0
+
+    # the row still holds the two failures from before the successful login
+    limiter.seed(PHONE, 2, datetime.utcnow())
+    limiter.record_failure(PHONE)
+    assert not limiter.is_blocked(PHONE)
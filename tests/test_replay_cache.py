@@ -0,0 +1,38 @@
+import pytest
+from benchmarks.ussd_flows import hops
+from tests.conftest import PIN, add_member
+
+PHONE = "0711000010"
+
+
+def post(client, session_id, text):
+    return client.post("/api/ussd/callback", data={"sessionId": session_id, "serviceCode": "*384#", "phoneNumber": PHONE, "text": text})
+
+
+def test_retried_hop_is_answered_from_the_cache(app):
+    add_member(app, PHONE)
+    client = app.test_client()
+    for text in hops("1", PIN):
+        first = post(client, "retried", text)
+    retry = post(client, "retried", hops("1", PIN)[-1])
+
+    assert retry.get_data() == first.get_data()
+    assert retry.headers["Content-Type"] == first.headers["Content-Type"]
+    assert app.extensions["replay_cache"].replays == 1
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_replayed_hops_do_not_evict_live_sessions(make_app, tmp_path, backend):
+    app = make_app(SESSION_BACKEND=backend, SESSION_SQLITE_PATH=str(tmp_path / "sessions.db"), SESSION_MAX_ENTRIES=20)
+    # sweep on every write so an overflowing SQLite store evicts straight away
+    app.extensions["session_store"].PURGE_EVERY = 1
+    add_member(app, PHONE)
+    client = app.test_client()
+
+    sessions = [f"s{index}" for index in range(10)]
+    for session_id in sessions:
+        for text in hops("1"):
+            post(client, session_id, text)
+
+    assert app.extensions["session_store"].evictions == 0
+    assert post(client, "s0", "1*" + PIN).get_data(as_text=True).startswith("CON Choose an option")
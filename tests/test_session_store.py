@@ -0,0 +1,157 @@
+"""Contract tests every session store backend must pass."""
+import time
+import pytest
+from app.services.session_store import MemorySessionStore, SQLiteSessionStore, create_session_store, get_session_store
+from benchmarks.ussd_flows import hops
+from tests.conftest import PIN, add_member
+
+PHONE = "0711000007"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(ttl=300, max_entries=10000):
+        if request.param == "memory":
+            return MemorySessionStore(ttl=ttl, max_entries=max_entries)
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=ttl, max_entries=max_entries)
+        # sweep on every write so LRU eviction is observable straight away
+        store.PURGE_EVERY = 1
+        return store
+    return make
+
+
+def test_get_returns_what_was_set(make_store):
+    store = make_store()
+    store.set("session-1", {"current_menu": "main", "menu_stack": ["login"]})
+    assert store.get("session-1") == {"current_menu": "main", "menu_stack": ["login"]}
+
+
+def test_set_replaces_the_previous_value(make_store):
+    store = make_store()
+    store.set("session-1", {"current_menu": "main"})
+    store.set("session-1", {"current_menu": "logged_in"})
+    assert store.get("session-1") == {"current_menu": "logged_in"}
+    assert store.size() == 1
+
+
+def test_missing_key_returns_none(make_store):
+    assert make_store().get("unknown") is None
+
+
+def test_delete_removes_the_entry(make_store):
+    store = make_store()
+    store.set("session-1", {"current_menu": "main"})
+    store.delete("session-1")
+    assert store.get("session-1") is None
+    assert store.size() == 0
+
+
+def test_delete_of_a_missing_key_is_a_no_op(make_store):
+    make_store().delete("unknown")
+
+
+def test_entries_expire_after_their_ttl(make_store):
+    store = make_store(ttl=0.05)
+    store.set("session-1", {"current_menu": "main"})
+    store.set("session-2", {"current_menu": "main"}, ttl=60)
+    time.sleep(0.1)
+    assert store.get("session-1") is None
+    assert store.get("session-2") == {"current_menu": "main"}
+
+
+def test_least_recently_used_entry_is_evicted(make_store):
+    store = make_store(max_entries=2)
+    store.set("a", 1)
+    time.sleep(0.01)
+    store.set("b", 2)
+    time.sleep(0.01)
+    assert store.get("a") == 1
+    time.sleep(0.01)
+    store.set("c", 3)
+    assert store.get("b") is None
+    assert store.get("a") == 1
+    assert store.get("c") == 3
+    assert store.size() == 2
+
+
+def test_counters_track_hits_misses_and_evictions(make_store):
+    store = make_store(ttl=0.05, max_entries=2)
+    store.set("a", 1, ttl=60)
+    store.get("a")
+    store.get("unknown")
+    store.set("b", 2)
+    time.sleep(0.1)
+    store.get("b")
+    store.set("c", 3, ttl=60)
+    store.set("d", 4, ttl=60)
+
+    stats = store.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    # b expired on read, then a was the least recently used entry over the limit
+    assert stats["evictions"] == 2
+    assert stats["size"] == 2
+    assert stats["backend"] in ("memory", "sqlite")
+
+
+def test_namespaces_do_not_share_keys(make_store):
+    store = make_store()
+    sessions = store.namespace("session")
+    members = store.namespace("member")
+    members.set(1, {"pin": "hash"})
+    sessions.set("member:1", {"current_menu": "main"})
+
+    assert members.get(1) == {"pin": "hash"}
+    assert sessions.get("member:1") == {"current_menu": "main"}
+    assert sessions.get(1) is None
+    sessions.delete(1)
+    assert members.get(1) == {"pin": "hash"}
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_stores_on_one_backend_keep_their_own_entries(tmp_path, backend):
+    config = {"SESSION_BACKEND": backend, "SESSION_SQLITE_PATH": str(tmp_path / "sessions.db"), "SESSION_MAX_ENTRIES": 1}
+    sessions = create_session_store(config)
+    replays = create_session_store(config, table="ussd_replays", max_entries=2)
+    sessions.PURGE_EVERY = replays.PURGE_EVERY = 1
+
+    sessions.set("s1", {"current_menu": "main"})
+    replays.set("a", 1)
+    replays.set("b", 2)
+
+    assert sessions.get("s1") == {"current_menu": "main"}
+    assert sessions.get("a") is None
+    assert (replays.get("a"), replays.get("b")) == (1, 2)
+    assert (sessions.size(), replays.size()) == (1, 2)
+
+
+def test_hostile_session_ids_cannot_reach_other_caches(make_app):
+    app = make_app(MEMBER_CACHE="1", STATEMENT_CACHE="1")
+    member_id = add_member(app, PHONE, wallet_balance=1000)
+    client = app.test_client()
+
+    def post(session_id, text):
+        return client.post("/api/ussd/callback", data={"sessionId": session_id, "serviceCode": "*384#", "phoneNumber": PHONE, "text": text})
+
+    def run(session_id, *steps):
+        for text in hops(*steps):
+            response = post(session_id, text)
+        return response.get_data(as_text=True)
+
+    assert run("withdraw", "1", PIN, "1", "1", "100", PIN).startswith("END Withdrawal successful")
+    assert run("statement", "1", PIN, "5", "1", PIN).startswith("END Last")
+
+    keys = [f"member:{member_id}", f"statement:{member_id}", f"statement_generation:{member_id}", "last_write:254711000007"]
+    with app.app_context():
+        store = get_session_store()
+        cached = {key: store.get(key) for key in keys}
+    assert all(value is not None for key, value in cached.items() if not key.startswith("last_write"))
+
+    for session_id in keys:
+        for text in ("", "1", "1*0000"):
+            assert post(session_id, text).status_code == 200
+
+    with app.app_context():
+        store = get_session_store()
+        assert {key: store.get(key) for key in keys} == cached
+    assert run("statement-again", "1", PIN, "5", "1", PIN).startswith("END Last")
@@ -0,0 +1,25 @@
+from app import db
+from app.models import Withdrawals
+from app.helpers.utils import process_withdrawal
+from app.services.member_cache import get_member
+from app.services.statement_export import iter_statement_rows
+from tests.conftest import PIN, add_member
+
+
+def test_each_money_movement_is_exported_once(app):
+    user_id = add_member(app, "0711000003", wallet_balance=1000)
+    with app.app_context():
+        member = get_member(user_id)
+        assert process_withdrawal(member, 100, PIN, "sacco_wallet", "mobile_money", provider="M-Pesa", phone_number="0711000003")["status"]
+        assert process_withdrawal(member, 50, PIN, "sacco_wallet", "savings")["status"]
+        # recorded before withdrawals had a ledger row
+        db.session.add(Withdrawals(user_id=user_id, amount=25, withdrawal_method="mobile_money", provider="Airtel Money", phone_number="0711000003"))
+        db.session.commit()
+
+        rows = [row._asdict() for partition in iter_statement_rows(user_id) for row in partition]
+
+    assert [(row["record"], row["amount"], row["destination"], row["provider"]) for row in rows] == [
+        ("transaction", 100, "mobile_money", "M-Pesa"),
+        ("transaction", 50, "savings", None),
+        ("withdrawal", 25, "mobile_money", "Airtel Money"),
+    ]
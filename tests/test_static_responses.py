@@ -0,0 +1,30 @@
+from app.helpers.utils import USSD_CONTENT_TYPE, ussd_response
+from app.services.logic import MENU_TEXT
+
+
+def test_static_screens_do_not_share_state(app):
+    message = MENU_TEXT["faqs"]
+    with app.test_request_context():
+        first = ussd_response(message)
+        first.headers["Server-Timing"] = "total;dur=1"
+        first.set_cookie("seen", "1")
+        first.set_data(b"changed")
+        second = ussd_response(message)
+
+    assert second.get_data(as_text=True) == message
+    assert second.headers["Content-Type"] == USSD_CONTENT_TYPE
+    assert "Server-Timing" not in second.headers
+    assert "Set-Cookie" not in second.headers
+
+
+def test_static_screens_match_built_responses(make_app):
+    message = MENU_TEXT["faqs"]
+    cached, uncached = make_app(), make_app(STATIC_RESPONSE_CACHE=False)
+    with cached.test_request_context():
+        from_cache = ussd_response(message)
+    with uncached.test_request_context():
+        built = ussd_response(message)
+
+    assert from_cache.get_data() == built.get_data()
+    assert from_cache.status_code == built.status_code == 200
+    assert dict(from_cache.headers) == dict(built.headers)
@@ -0,0 +1,57 @@
+import threading
+from sqlalchemy import func, select
+from app import db
+from app.models import Accounts, Transactions, Withdrawals
+from app.helpers.utils import process_withdrawal
+from app.services.member_cache import get_member
+from tests.conftest import PIN, add_member
+
+THREADS = 20
+
+
+def withdraw_concurrently(app, user_id, amount, destination, **details):
+    barrier = threading.Barrier(THREADS)
+    results = []
+    # loaded up front, so no thread holds a read transaction open while the others write
+    with app.app_context():
+        member = get_member(user_id)
+
+    def withdraw():
+        with app.app_context():
+            barrier.wait()
+            results.append(process_withdrawal(member, amount, PIN, "sacco_wallet", destination, **details))
+            db.session.remove()
+
+    threads = [threading.Thread(target=withdraw) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_withdrawals_never_overdraw(app):
+    user_id = add_member(app, "0711000001", wallet_balance=1000)
+
+    results = withdraw_concurrently(app, user_id, 100, "mobile_money", provider="M-Pesa", phone_number="0711000001")
+
+    succeeded = [result for result in results if result["status"]]
+    assert len(succeeded) == 10
+    assert {result["message"] for result in results if not result["status"]} == {"Insufficient funds."}
+    with app.app_context():
+        account = db.session.scalars(select(Accounts).where(Accounts.user_id == user_id)).one()
+        assert account.wallet_balance == 0
+        assert db.session.scalar(select(func.count()).select_from(Transactions).where(Transactions.user_id == user_id)) == 10
+        assert db.session.scalar(select(func.count()).select_from(Withdrawals).where(Withdrawals.user_id == user_id)) == 10
+
+
+def test_concurrent_transfers_conserve_the_total(app):
+    user_id = add_member(app, "0711000002", wallet_balance=550, savings_balance=50)
+
+    results = withdraw_concurrently(app, user_id, 100, "savings")
+
+    assert sum(result["status"] for result in results) == 5
+    with app.app_context():
+        account = db.session.scalars(select(Accounts).where(Accounts.user_id == user_id)).one()
+        assert (account.wallet_balance, account.savings_balance) == (50, 550)
+        assert db.session.scalar(select(func.count()).select_from(Transactions).where(Transactions.user_id == user_id)) == 5